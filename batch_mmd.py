@@ -0,0 +1,1008 @@
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+from mmd_utils.metadata_extraction import ODATA_URL
+from mmd_utils.odata_mirror import open_mirror, ingest_dump
+from mmd_utils.odata_sync import COLLECTIONS, SYNC_FIELDS, ChangeFeed, parse_odata_time, poll, prepare_record, sync_changes
+from mmd_utils.config_handling import configure_logging, load_config
+from mmd_utils.archive_inventory import reconcile, reconciliation_worklist, json_worklist
+from mmd_utils.archive_crawler import ArchiveFilter, crawl_worklist, parse_date
+from mmd_utils.batch import read_worklist, resolve_json_metadata, write_worklist
+from mmd_utils.catalogue import MetadataCatalogue, count_products
+from mmd_utils.extraction_store import ExtractionStore, rerender
+from mmd_utils.parent_aggregates import ParentAggregates, write_parent_extents
+from mmd_utils.spatial_index import SpatialIndex, parse_aoi
+from mmd_utils.enrichment import EnrichmentQueue, drain, enrich_item
+from mmd_utils.generator import MMDConfig
+from mmd_utils.work_queue import WorkQueue, work
+from mmd_utils.journal import RunJournal, load_journal, filter_worklist
+from mmd_utils.pipeline import mmd_stages, run_pipeline, worker_functions, write_mmd
+from mmd_utils.worker_recycling import MemoryReport, RecycledWorker, TaskKilled, run_recycled
+from mmd_utils.scheduling import (
+    DEFAULT_CLASSES_CONFIG,
+    PriorityScheduler,
+    DeadlineReport,
+    load_priority_classes,
+    mirror_footprint_lookup,
+    scheduled,
+    enqueue_scheduled,
+)
+from mmd_utils.output_writers import WRITERS
+from mmd_utils.io_throttle import configure_io
+from create_mmd import generate_mmd, script_dir
+
+
+def ingest_odata(args):
+    """
+    Ingest OData JSON/JSONL dumps into the local SQLite mirror.
+    """
+    conn = open_mirror(args.odata_mirror)
+    for dump_path in args.dumps:
+        count = ingest_dump(conn, dump_path)
+        print(f"Ingested {count} records from {dump_path}")
+    total = conn.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+    conn.close()
+    print(f"OData mirror {args.odata_mirror} now holds {total} products")
+
+
+def reconcile_archive(args):
+    """
+    Find products without MMD files, orphaned MMD files and outdated MMD files,
+    and write a work list for the products that need (re)generating.
+    """
+    missing, orphaned, outdated = reconcile(args.archive, args.mmd_dir, args.workers)
+    print(f"Missing: {len(missing)}, orphaned: {len(orphaned)}, outdated: {len(outdated)}")
+
+    count = write_worklist(reconciliation_worklist(missing, outdated, args.archive, args.mmd_dir), args.worklist)
+    print(f"Wrote {count} work items to {args.worklist}")
+
+    if args.orphans:
+        orphaned[['id', 'path']].to_csv(args.orphans, index=False)
+        print(f"Wrote {len(orphaned)} orphaned MMD files to {args.orphans}")
+
+
+def generate_item(args, item, catalogue=None, extraction_store=None, parent_aggregates=None, spatial_index=None,
+                  enrichment_queue=None, mirror=None):
+    """
+    Generate the MMD file for one work item, looking products up in mirror (an
+    open connection to the OData mirror) if given.
+    """
+    output_dir = os.path.dirname(item['mmd_path'])
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    return generate_mmd(
+        filename=item['filename'],
+        global_attributes_config=args.global_attributes_config,
+        platform_metadata_config=args.platform_metadata_config,
+        product_metadata_csv=args.product_metadata_csv,
+        output_path=item['mmd_path'],
+        filepath=item['filepath'],
+        json_metadata=item.get('json_metadata'),
+        create_id=args.create_id,
+        odata_mirror=mirror if mirror is not None else args.odata_mirror,
+        odata_url=args.odata_url,
+        catalogue=catalogue,
+        extraction_store=extraction_store,
+        parent_aggregates=parent_aggregates,
+        spatial_index=spatial_index,
+        update=args.update,
+        formats=args.formats,
+        swath_footprint=args.swath_footprint,
+        odata_budget=args.odata_budget,
+        enrichment_queue=enrichment_queue
+    )
+
+
+def recycling_enabled(args):
+    return any(value is not None for value in (args.recycle_after, args.max_worker_rss, args.task_rss_limit, args.task_timeout))
+
+
+def recycled_worker_options(args, workers=1):
+    """
+    Keyword arguments of RecycledWorker (and run_recycled) for the command line options.
+    The overall read budget is shared by the worker processes.
+    """
+    io_limit = args.io_limit / workers if args.io_limit else None
+    options = worker_functions(
+        script_dir,
+        args.global_attributes_config,
+        args.platform_metadata_config,
+        args.product_metadata_csv,
+        create_id=args.create_id,
+        odata_mirror=args.odata_mirror,
+        odata_url=args.odata_url,
+        swath_footprint=args.swath_footprint,
+        odata_budget=args.odata_budget,
+        io_settings=(io_limit, args.io_limit_per_worker, args.fadvise)
+    )
+    options.update(
+        max_tasks=args.recycle_after,
+        max_rss_mb=args.max_worker_rss,
+        task_rss_mb=args.task_rss_limit,
+        task_timeout=args.task_timeout
+    )
+    return options
+
+
+def print_memory_report(args, memory_report):
+    print("Peak worker RSS per product type:")
+    for line in memory_report.lines():
+        print(line)
+    if args.memory_report:
+        memory_report.write(args.memory_report)
+        print(f"Wrote the peak worker RSS per product type to {args.memory_report}")
+
+
+def run_worklist(args):
+    """
+    Generate MMD files for every product in a work list. With a journal, the
+    outcome of each product is recorded so an interrupted run can be resumed.
+    """
+    succeeded = 0
+    skipped = 0
+    failed = 0
+    if args.json:
+        if not args.archive or not args.mmd_dir:
+            print("Error: --json needs --archive and --mmd_dir to match records to product files")
+            return
+        items = json_worklist(args.json, args.archive, args.mmd_dir)
+    elif args.crawl:
+        if not args.mmd_dir:
+            print("Error: --crawl needs --mmd_dir")
+            return
+        items = crawl_worklist(args.crawl, args.mmd_dir, archive_filter_from_args(args))
+    else:
+        items = read_worklist(args.worklist)
+    # JSON files shared by many items are read once, not once per product
+    items = map(resolve_json_metadata, items)
+    journal = None
+    if args.journal:
+        if args.resume or args.retry_failed:
+            outcomes = load_journal(args.journal)
+            print(f"Journal {args.journal} has outcomes for {len(outcomes)} products")
+            items = filter_worklist(items, outcomes, retry_failed=args.retry_failed)
+        journal = RunJournal(args.journal)
+    elif args.resume or args.retry_failed:
+        print("Error: --resume and --retry_failed need a --journal")
+        return
+    recycled = recycling_enabled(args)
+    if recycled and args.pipeline:
+        print("Error: --pipeline cannot be combined with recycled worker processes")
+        return
+
+    report = None
+    if args.schedule:
+        footprint_lookup = mirror_footprint_lookup(args.odata_mirror) if args.odata_mirror else None
+        items = scheduled(items, PriorityScheduler(load_priority_classes(args.schedule), footprint_lookup))
+        report = DeadlineReport()
+
+    catalogue = MetadataCatalogue(args.catalogue) if args.catalogue else None
+    extraction_store = ExtractionStore(args.extraction_store) if args.extraction_store else None
+    parent_aggregates = ParentAggregates(args.parent_aggregates) if args.parent_aggregates else None
+    spatial_index = SpatialIndex(args.spatial_index) if args.spatial_index else None
+    enrichment_queue = EnrichmentQueue(args.enrichment_queue) if args.enrichment_queue else None
+    mirror = None
+    if args.odata_mirror and not (args.pipeline or recycled):
+        mirror = open_mirror(args.odata_mirror, read_only=True)
+    if args.pipeline:
+        stages = mmd_stages(
+            script_dir,
+            args.global_attributes_config,
+            args.platform_metadata_config,
+            args.product_metadata_csv,
+            create_id=args.create_id,
+            odata_mirror=args.odata_mirror,
+            odata_url=args.odata_url,
+            swath_footprint=args.swath_footprint,
+            odata_budget=args.odata_budget,
+            extract_workers=args.extract_workers,
+            odata_workers=args.odata_workers,
+            checksum_workers=args.checksum_workers,
+            xml_workers=args.xml_workers
+        )
+        items = run_pipeline(items, stages)
+    memory_report = None
+    if recycled:
+        items = run_recycled(items, workers=args.worker_processes, **recycled_worker_options(args, args.worker_processes))
+        memory_report = MemoryReport()
+    for item in items:
+        try:
+            if args.pipeline or recycled:
+                if memory_report is not None:
+                    memory_report.record(item)
+                if item.get('error'):
+                    raise RuntimeError(item['error'])
+                written = write_mmd(
+                    item, args.update, catalogue, extraction_store, args.formats, parent_aggregates, spatial_index,
+                    enrichment_queue
+                )
+                print(f"Processed {item['filename']}")
+            else:
+                print(f"Processing {item['filename']}...")
+                written = generate_item(
+                    args, item, catalogue, extraction_store, parent_aggregates, spatial_index, enrichment_queue, mirror
+                )
+        except Exception as e:
+            print(f"Error: Failed to generate MMD for {item['filename']}. Reason: {e}")
+            failed += 1
+            if journal is not None:
+                journal.record(item, 'failed', str(e))
+            continue
+        if written:
+            succeeded += 1
+        else:
+            skipped += 1
+        if journal is not None:
+            journal.record(item, 'ok' if written else 'skipped')
+        if report is not None:
+            report.record(item)
+    if journal is not None:
+        journal.close()
+    if catalogue is not None:
+        catalogue.close()
+    if extraction_store is not None:
+        extraction_store.close()
+    if parent_aggregates is not None:
+        parent_aggregates.close()
+    if spatial_index is not None:
+        spatial_index.close()
+    if mirror is not None:
+        mirror.close()
+    if enrichment_queue is not None:
+        print(f"{len(enrichment_queue)} provisional MMD files queued for enrichment in {args.enrichment_queue}")
+        enrichment_queue.close()
+    print(f"Finished: {succeeded} succeeded, {skipped} unchanged, {failed} failed")
+    if report is not None:
+        for line in report.lines():
+            print(line)
+    if memory_report is not None:
+        print_memory_report(args, memory_report)
+
+
+def archive_filter_from_args(args):
+    return ArchiveFilter(
+        platforms=args.platforms,
+        start=parse_date(args.start) if args.start else None,
+        end=parse_date(args.end, end=True) if args.end else None,
+        product_types=args.product_types
+    )
+
+
+def crawl(args):
+    """
+    Crawl part of the archive and write a work list of the products found.
+    """
+    items = crawl_worklist(args.archive, args.mmd_dir, archive_filter_from_args(args), args.workers)
+    count = write_worklist(items, args.worklist)
+    print(f"Wrote {count} work items to {args.worklist}")
+
+
+def queue_init(args):
+    """
+    Split a work list into batches in a shared work queue.
+    """
+    queue = WorkQueue(args.queue)
+    if args.schedule:
+        footprint_lookup = mirror_footprint_lookup(args.odata_mirror) if args.odata_mirror else None
+        classes = load_priority_classes(args.schedule)
+        batches = enqueue_scheduled(queue, read_worklist(args.worklist), classes, args.batch_size, footprint_lookup)
+        for name, count in batches.items():
+            print(f"Queued {count} batches of class {name} from {args.worklist} in {args.queue}")
+        return
+    batches = queue.enqueue(read_worklist(args.worklist), batch_size=args.batch_size)
+    print(f"Queued {batches} batches from {args.worklist} in {args.queue}")
+
+
+def queue_work(args):
+    """
+    Claim batches from a shared work queue and generate their MMD files,
+    until no batches are left.
+    """
+    max_wait_seconds = args.max_wait * 60 if args.max_wait else None
+    queue = WorkQueue(args.queue, node=args.node, lease_seconds=args.lease_seconds, max_wait_seconds=max_wait_seconds)
+    catalogue = MetadataCatalogue(args.catalogue) if args.catalogue else None
+    extraction_store = ExtractionStore(args.extraction_store) if args.extraction_store else None
+    enrichment_queue = EnrichmentQueue(args.enrichment_queue) if args.enrichment_queue else None
+    worker = RecycledWorker(**recycled_worker_options(args)) if recycling_enabled(args) else None
+    mirror = open_mirror(args.odata_mirror, read_only=True) if args.odata_mirror and worker is None else None
+    memory_report = MemoryReport()
+
+    def process_item(item):
+        print(f"Processing {item['filename']}...")
+        item = resolve_json_metadata(item)
+        if worker is None:
+            generate_item(args, item, catalogue, extraction_store, enrichment_queue=enrichment_queue, mirror=mirror)
+            return
+        try:
+            result, peak_rss_mb = worker.run(item)
+        except TaskKilled as e:
+            memory_report.record(dict(item, peak_rss_mb=e.rss_mb, killed=True))
+            raise
+        result['peak_rss_mb'] = peak_rss_mb
+        memory_report.record(result)
+        write_mmd(result, args.update, catalogue, extraction_store, args.formats, enrichment_queue=enrichment_queue)
+
+    try:
+        processed, failed = work(queue, process_item, wait_for_work=args.wait)
+    finally:
+        if worker is not None:
+            worker.stop()
+        if mirror is not None:
+            mirror.close()
+    if catalogue is not None:
+        catalogue.close()
+    if extraction_store is not None:
+        extraction_store.close()
+    if enrichment_queue is not None:
+        enrichment_queue.close()
+    print(f"Finished on {queue.node}: {processed - failed} succeeded, {failed} failed")
+    if worker is not None:
+        print_memory_report(args, memory_report)
+
+
+def queue_status(args):
+    """
+    Show the number of batches in each state of a shared work queue.
+    """
+    queue = WorkQueue(args.queue, lease_seconds=args.lease_seconds)
+    if args.reclaim:
+        queue.reclaim_expired()
+    counts = queue.status()
+    print(f"Pending: {counts['pending']}, leased: {counts['leased']}, done: {counts['done']}, with failures: {counts['failed']}")
+    for node, count in sorted(counts['nodes'].items()):
+        print(f"  {node}: {count} leased")
+
+
+def rerender_store(args):
+    """
+    Re-create MMD files from stored extraction results, e.g. after a configuration change.
+    """
+    with ExtractionStore(args.extraction_store) as store:
+        print(f"Re-rendering {store.count()} products from {args.extraction_store}")
+        written, unchanged, failed = rerender(
+            store,
+            script_dir,
+            args.global_attributes_config,
+            args.platform_metadata_config,
+            args.product_metadata_csv,
+            mmd_dir=args.mmd_dir,
+            workers=args.workers,
+            update=args.update
+        )
+    for filename, reason in failed:
+        print(f"Error: Failed to re-render MMD for {filename}. Reason: {reason}")
+    print(f"Finished: {written} written, {unchanged} unchanged, {len(failed)} failed")
+
+
+def parent_extents(args):
+    """
+    Write parent dataset MMD files with extents from the parent aggregates,
+    optionally seeding the aggregates from an existing tree of MMD files first.
+    """
+    with ParentAggregates(args.parent_aggregates) as aggregates:
+        if args.seed:
+            seeded = 0
+            for directory, _, files in os.walk(args.seed):
+                for name in files:
+                    if name.endswith('.xml') and aggregates.add_file(os.path.join(directory, name)):
+                        seeded += 1
+            aggregates.commit()
+            print(f"Added {seeded} MMD files from {args.seed} to {args.parent_aggregates}")
+        for aggregate in aggregates.parents():
+            print(
+                f"  {aggregate['platform']} {aggregate['product_type']} ({aggregate['parent_id']}): "
+                f"{aggregate['child_count']} products, {aggregate['total_size_mb']:.0f} MB, "
+                f"{aggregate['start_date']} to {aggregate['end_date']}"
+            )
+        if args.output_dir:
+            written = write_parent_extents(aggregates, args.output_dir, args.parent_mmd_dir)
+            print(f"Wrote {written} parent MMD files to {args.output_dir}")
+
+
+def query_index(args):
+    """
+    List the products in the spatial index covering an area and time window,
+    optionally indexing the products of an extraction store first.
+    """
+    with SpatialIndex(args.spatial_index) as index:
+        if args.from_store:
+            with ExtractionStore(args.from_store) as store:
+                count = index.add_from_store(store)
+            print(f"Indexed {count} products from {args.from_store}")
+        if not (args.aoi or args.start or args.end):
+            print(f"{len(index)} products in {args.spatial_index}")
+            return
+        started = time.perf_counter()
+        results = index.query(start=args.start, end=args.end, aoi=parse_aoi(args.aoi) if args.aoi else None)
+        elapsed = time.perf_counter() - started
+        for filename, id, start, end in results:
+            print(f"{id}\t{filename}\t{start}\t{end}" if args.verbose else id or filename)
+        print(f"{len(results)} products found in {elapsed * 1000:.1f} ms", file=sys.stderr)
+
+
+def sync_odata(args):
+    """
+    Write MMD files for products newly published or modified in OData, from
+    their OData records alone, so the metadata is ready when the files arrive.
+    """
+    if not args.odata_mirror:
+        print("Error: odata-sync needs --odata_mirror to keep its watermarks")
+        return
+    global_attributes = load_config(args.global_attributes_config)
+    platform_metadata = load_config(args.platform_metadata_config)
+    product_metadata_df = pd.read_csv(args.product_metadata_csv)
+
+    def prepare(record):
+        return prepare_record(record, script_dir, global_attributes, platform_metadata, product_metadata_df,
+                              args.mmd_dir, args.archive, args.create_id)
+
+    since = parse_odata_time(args.since) if args.since else datetime.now(timezone.utc) - timedelta(days=1)
+    aoi_wkt = parse_aoi(args.aoi).wkt if args.aoi else None
+
+    def sync():
+        mirror = open_mirror(args.odata_mirror)
+        feed = ChangeFeed(mirror, args.odata_url, args.field, aoi_wkt, args.page_size, args.lookback)
+        catalogue = MetadataCatalogue(args.catalogue) if args.catalogue else None
+        extraction_store = ExtractionStore(args.extraction_store) if args.extraction_store else None
+        parent_aggregates = ParentAggregates(args.parent_aggregates) if args.parent_aggregates else None
+        spatial_index = SpatialIndex(args.spatial_index) if args.spatial_index else None
+        try:
+            written, unchanged, skipped, failed = sync_changes(
+                feed, [COLLECTIONS[mission] for mission in args.missions], since, prepare, args.update,
+                catalogue, extraction_store, args.formats, parent_aggregates, spatial_index
+            )
+        finally:
+            for sink in (catalogue, extraction_store, parent_aggregates, spatial_index):
+                if sink is not None:
+                    sink.close()
+            mirror.close()
+        print(f"Finished: {written} prepared, {unchanged} unchanged, {skipped} of types not configured, {failed} failed")
+
+    if args.interval:
+        poll(args.interval, sync)
+    else:
+        sync()
+
+
+def enrich_provisional(args):
+    """
+    Complete provisional MMD files from OData, for the products of the
+    enrichment queue that are due. Products OData does not have yet stay
+    queued and are tried again later, waiting longer each time.
+    """
+    if not args.enrichment_queue:
+        print("Error: enrich needs --enrichment_queue")
+        return
+    def enrich_once():
+        # Loaded on every pass, so a polling run sees edits to the configuration
+        config = MMDConfig.load(args.global_attributes_config, args.platform_metadata_config, args.product_metadata_csv)
+        mirror = open_mirror(args.odata_mirror, read_only=True) if args.odata_mirror else None
+        queue = EnrichmentQueue(args.enrichment_queue)
+        catalogue = MetadataCatalogue(args.catalogue) if args.catalogue else None
+        extraction_store = ExtractionStore(args.extraction_store) if args.extraction_store else None
+        parent_aggregates = ParentAggregates(args.parent_aggregates) if args.parent_aggregates else None
+        spatial_index = SpatialIndex(args.spatial_index) if args.spatial_index else None
+
+        def enrich(item, local_metadata):
+            query_options = {}
+            if args.odata_budget is not None:
+                query_options['deadline'] = time.monotonic() + args.odata_budget
+            return enrich_item(item, local_metadata, config, mirror, args.odata_url, **query_options)
+
+        def write(item):
+            # The provisional file is upgraded in place, keeping its update history
+            write_mmd(item, True, catalogue, extraction_store, args.formats, parent_aggregates, spatial_index)
+
+        try:
+            enriched, pending = drain(queue, enrich, write, args.limit)
+            status = queue.status()
+        finally:
+            for sink in (catalogue, extraction_store, parent_aggregates, spatial_index, queue, mirror):
+                if sink is not None:
+                    sink.close()
+        print(f"Finished: {enriched} enriched, {pending} not in OData yet, "
+              f"{status['queued']} queued ({status['due']} due)")
+
+    if args.interval:
+        poll(args.interval, enrich_once)
+    else:
+        enrich_once()
+
+
+def query_catalogue(args):
+    """
+    Count products in the Parquet catalogue.
+    """
+    result = count_products(
+        args.catalogue,
+        group_by=args.group_by,
+        mission=args.mission,
+        platform=args.platform,
+        product_type=args.product_type,
+        year=args.year,
+        month=args.month,
+        sios=True if args.sios else None
+    )
+    print(result)
+
+
+def add_crawl_filter_arguments(parser):
+    parser.add_argument(
+        "--platforms", nargs="+", required=False,
+        help="Platforms to crawl, or their prefixes, e.g. S1A or S1."
+    )
+    parser.add_argument(
+        "--start", type=str, required=False,
+        help="First date to crawl, YYYY-MM-DD or YYYY-MM."
+    )
+    parser.add_argument(
+        "--end", type=str, required=False,
+        help="Last date to crawl, YYYY-MM-DD or YYYY-MM (inclusive)."
+    )
+    parser.add_argument(
+        "--product_types", nargs="+", required=False,
+        help="Directories below the day to crawl: S1 modes (e.g. EW) or S3/S5 product types (e.g. OL-L1-EFR). S2 products are matched on the ESA product type (e.g. MSIL1C)."
+    )
+
+
+def add_schedule_argument(parser):
+    parser.add_argument(
+        "--schedule", nargs="?", const=DEFAULT_CLASSES_CONFIG, required=False,
+        help="Process products by priority class and deadline instead of in input order, with classes from a YAML file (default: config/priority_classes.yaml)."
+    )
+
+
+def add_worker_arguments(parser):
+    parser.add_argument(
+        "--recycle_after", type=int, required=False,
+        help="Generate MMD files in worker processes, each replaced after this many products."
+    )
+    parser.add_argument(
+        "--max_worker_rss", type=float, required=False,
+        help="Generate MMD files in worker processes, each replaced after a product leaves its RSS above this many MB."
+    )
+    parser.add_argument(
+        "--task_rss_limit", type=float, required=False,
+        help="Generate MMD files in worker processes, killed when their RSS passes this many MB during a product, which then fails."
+    )
+    parser.add_argument(
+        "--task_timeout", type=float, required=False,
+        help="Generate MMD files in worker processes, killed when a product takes longer than this many seconds, which then fails."
+    )
+    parser.add_argument(
+        "--memory_report", type=str, required=False,
+        help="Path of a JSON file to write the peak worker RSS per product type to (with worker processes)."
+    )
+
+
+def add_config_arguments(parser, local_databases=True):
+    # Parent aggregates and spatial indexes are SQLite databases of one process,
+    # so commands sharing work between nodes do not take them
+    parser.add_argument(
+        "--global_attributes_config", "-g", type=str, required=True,
+        help="Path to the YAML global attributes configuration file."
+    )
+    parser.add_argument(
+        "--platform_metadata_config", "-pl", type=str, required=True,
+        help="Path to the YAML platform metadata configuration file."
+    )
+    parser.add_argument(
+        "--product_metadata_csv", "-pr", type=str, required=True,
+        help="Path to the CSV file with metadata related to each product type."
+    )
+    parser.add_argument('--create_id', '-id', action='store_true',
+        help='If present, a metadata identifier will be created unique to NBS instead. If not, the tracking ID provided by ESA is used.')
+    parser.add_argument(
+        "--odata_mirror", "-o", type=str, required=False,
+        help="Path to a local SQLite mirror of OData records, looked up before querying the OData API."
+    )
+    parser.add_argument(
+        "--odata_url", type=str, default=ODATA_URL,
+        help="OData Products endpoint queried when the metadata is insufficient, e.g. a local mock server for testing."
+    )
+    parser.add_argument(
+        "--catalogue", "-c", type=str, required=False,
+        help="Root directory of a Parquet catalogue to append the extracted metadata to."
+    )
+    parser.add_argument(
+        "--extraction_store", "-e", type=str, required=False,
+        help="Path to an SQLite store of extraction results, used to re-render MMD files without the source files."
+    )
+    if local_databases:
+        parser.add_argument(
+            "--parent_aggregates", type=str, required=False,
+            help="Path to an SQLite database of parent dataset extents, updated with each MMD file generated. Use one database per process."
+        )
+        parser.add_argument(
+            "--spatial_index", type=str, required=False,
+            help="Path to an SQLite spatial index of product footprints and temporal extents, updated with each MMD file generated. Use one index per process."
+        )
+    parser.add_argument('--update', '-u', action='store_true',
+        help='If present, existing MMD files are only rewritten if their content changed, and their update history is kept.')
+    parser.add_argument(
+        "--formats", nargs="+", choices=list(WRITERS), default=["mmd"],
+        help="Metadata formats to write from the same extraction: mmd, stac (STAC Item) and/or iso19139. Written next to the MMD path."
+    )
+    parser.add_argument(
+        "--io_limit", type=float, required=False,
+        help="Read budget for product files in MB/s, shared by all workers of this process."
+    )
+    parser.add_argument(
+        "--io_limit_per_worker", type=float, required=False,
+        help="Read budget for product files in MB/s for each worker thread."
+    )
+    parser.add_argument('--fadvise', action='store_true',
+        help='If present, sequential reads are hinted to the kernel and checksummed files are dropped from the page cache.')
+    parser.add_argument('--swath_footprint', action='store_true',
+        help='If present, the footprint of S5P products is derived from the edges of the swath in their geolocation arrays.')
+    parser.add_argument(
+        "--odata_budget", type=float, required=False,
+        help="Seconds the OData fallback may take per product. If OData has not answered by then, a provisional MMD file is written from the local metadata."
+    )
+    parser.add_argument(
+        "--enrichment_queue", type=str, required=False,
+        help="Path to an SQLite queue of provisional MMD files, completed from OData later with the enrich command. Use one queue per node."
+    )
+
+
+def main():
+    """
+    Main function for batch and archive level MMD operations.
+    """
+    parser = argparse.ArgumentParser(description="Batch and archive level operations for NBS MMD files.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser(
+        "ingest-odata",
+        help="Ingest OData JSON/JSONL dumps into a local SQLite mirror."
+    )
+    ingest_parser.add_argument(
+        "--odata_mirror", "-o", type=str, required=True,
+        help="Path to the SQLite mirror. Created if it does not exist."
+    )
+    ingest_parser.add_argument(
+        "dumps", nargs="+",
+        help="OData dump files: single records or response pages (.json) or one record per line (.jsonl)."
+    )
+    ingest_parser.set_defaults(func=ingest_odata)
+
+    reconcile_parser = subparsers.add_parser(
+        "reconcile",
+        help="Compare the data archive with the MMD tree and write a work list of products to (re)generate."
+    )
+    reconcile_parser.add_argument(
+        "--archive", "-a", type=str, required=True,
+        help="Root directory of the data archive."
+    )
+    reconcile_parser.add_argument(
+        "--mmd_dir", "-m", type=str, required=True,
+        help="Root directory of the MMD files."
+    )
+    reconcile_parser.add_argument(
+        "--worklist", "-w", type=str, required=True,
+        help="Path to write the JSONL work list of missing and outdated products."
+    )
+    reconcile_parser.add_argument(
+        "--orphans", type=str, required=False,
+        help="Optional path to write a CSV of MMD files without a product in the archive."
+    )
+    reconcile_parser.add_argument(
+        "--workers", type=int, default=16,
+        help="Number of directories listed in parallel."
+    )
+    reconcile_parser.set_defaults(func=reconcile_archive)
+
+    run_parser = subparsers.add_parser(
+        "run",
+        help="Generate MMD files for all products in a work list."
+    )
+    run_input = run_parser.add_mutually_exclusive_group(required=True)
+    run_input.add_argument(
+        "--worklist", "-w", type=str,
+        help="Path to a JSONL work list, e.g. written by the reconcile command."
+    )
+    run_input.add_argument(
+        "--json", "-j", nargs="+",
+        help="OData JSON/JSONL dumps (single records, response pages or one record per line) to generate MMD files from."
+    )
+    run_input.add_argument(
+        "--crawl", type=str,
+        help="Root directory of the data archive to crawl for products, filtered with --platforms, --start, --end and --product_types."
+    )
+    run_parser.add_argument(
+        "--archive", "-a", type=str, required=False,
+        help="Root directory of the data archive, searched for the product file of each record in --json."
+    )
+    run_parser.add_argument(
+        "--mmd_dir", "-m", type=str, required=False,
+        help="Root directory of the MMD files written for --json or --crawl, mirroring the archive layout."
+    )
+    add_crawl_filter_arguments(run_parser)
+    run_parser.add_argument(
+        "--journal", type=str, required=False,
+        help="Path to a JSONL journal of per-product outcomes, appended to as products finish."
+    )
+    run_parser.add_argument(
+        "--resume", action="store_true",
+        help="Skip products that already have an outcome in the journal."
+    )
+    run_parser.add_argument(
+        "--retry_failed", action="store_true",
+        help="Only process products whose last outcome in the journal was a failure."
+    )
+    run_parser.add_argument(
+        "--pipeline", action="store_true",
+        help="Overlap extraction, OData queries, checksums and XML building across products, each stage with its own workers."
+    )
+    run_parser.add_argument("--extract_workers", type=int, default=8, help="Threads reading product files (with --pipeline).")
+    run_parser.add_argument("--odata_workers", type=int, default=16, help="Threads querying OData (with --pipeline).")
+    run_parser.add_argument("--checksum_workers", type=int, default=4, help="Threads computing checksums (with --pipeline).")
+    run_parser.add_argument(
+        "--xml_workers", type=int, required=False,
+        help="Processes building MMD XML (with --pipeline). Defaults to the number of CPUs."
+    )
+    run_parser.add_argument(
+        "--worker_processes", type=int, default=1,
+        help="Number of worker processes (with --recycle_after, --max_worker_rss, --task_rss_limit or --task_timeout)."
+    )
+    add_worker_arguments(run_parser)
+    add_schedule_argument(run_parser)
+    add_config_arguments(run_parser)
+    run_parser.set_defaults(func=run_worklist)
+
+    crawl_parser = subparsers.add_parser(
+        "crawl",
+        help="Crawl part of the archive and write a work list of the products found."
+    )
+    crawl_parser.add_argument(
+        "--archive", "-a", type=str, required=True,
+        help="Root directory of the data archive."
+    )
+    crawl_parser.add_argument(
+        "--mmd_dir", "-m", type=str, required=True,
+        help="Root directory of the MMD files, mirroring the archive layout."
+    )
+    crawl_parser.add_argument(
+        "--worklist", "-w", type=str, required=True,
+        help="Path to write the JSONL work list."
+    )
+    crawl_parser.add_argument(
+        "--workers", type=int, default=16,
+        help="Number of directories listed in parallel."
+    )
+    add_crawl_filter_arguments(crawl_parser)
+    crawl_parser.set_defaults(func=crawl)
+
+    queue_init_parser = subparsers.add_parser(
+        "queue-init",
+        help="Split a work list into batches in a work queue on shared storage."
+    )
+    queue_init_parser.add_argument(
+        "--queue", "-q", type=str, required=True,
+        help="Work queue directory on storage shared by all processing nodes."
+    )
+    queue_init_parser.add_argument(
+        "--worklist", "-w", type=str, required=True,
+        help="Path to a JSONL work list, e.g. written by the reconcile command."
+    )
+    queue_init_parser.add_argument(
+        "--batch_size", type=int, default=100,
+        help="Number of products per batch."
+    )
+    add_schedule_argument(queue_init_parser)
+    queue_init_parser.add_argument(
+        "--odata_mirror", "-o", type=str, required=False,
+        help="Path to a local SQLite mirror of OData records, used for the footprints of products in SIOS classes."
+    )
+    queue_init_parser.set_defaults(func=queue_init)
+
+    queue_work_parser = subparsers.add_parser(
+        "queue-work",
+        help="Claim batches from a work queue and generate their MMD files. Run on each processing node."
+    )
+    queue_work_parser.add_argument(
+        "--queue", "-q", type=str, required=True,
+        help="Work queue directory on storage shared by all processing nodes."
+    )
+    queue_work_parser.add_argument(
+        "--node", type=str, required=False,
+        help="Name of this worker in lease files. Defaults to hostname and process ID."
+    )
+    queue_work_parser.add_argument(
+        "--lease_seconds", type=int, default=600,
+        help="Seconds without a heartbeat after which a leased batch is reclaimed."
+    )
+    queue_work_parser.add_argument(
+        "--wait", action="store_true",
+        help="Keep polling while other nodes hold leases, to pick up batches they abandon."
+    )
+    queue_work_parser.add_argument(
+        "--max_wait", type=float, required=False,
+        help="Minutes after which a pending batch is claimed before batches of higher priority."
+    )
+    add_worker_arguments(queue_work_parser)
+    add_config_arguments(queue_work_parser, local_databases=False)
+    queue_work_parser.set_defaults(func=queue_work)
+
+    queue_status_parser = subparsers.add_parser(
+        "queue-status",
+        help="Show the state of a work queue."
+    )
+    queue_status_parser.add_argument(
+        "--queue", "-q", type=str, required=True,
+        help="Work queue directory."
+    )
+    queue_status_parser.add_argument(
+        "--lease_seconds", type=int, default=600,
+        help="Seconds without a heartbeat after which a leased batch is reclaimed."
+    )
+    queue_status_parser.add_argument(
+        "--reclaim", action="store_true",
+        help="Move abandoned batches back to pending before counting."
+    )
+    queue_status_parser.set_defaults(func=queue_status)
+
+    rerender_parser = subparsers.add_parser(
+        "rerender",
+        help="Re-create MMD files from an extraction store without opening the source files."
+    )
+    rerender_parser.add_argument(
+        "--extraction_store", "-e", type=str, required=True,
+        help="Path to the SQLite extraction store."
+    )
+    rerender_parser.add_argument(
+        "--global_attributes_config", "-g", type=str, required=True,
+        help="Path to the YAML global attributes configuration file."
+    )
+    rerender_parser.add_argument(
+        "--platform_metadata_config", "-pl", type=str, required=True,
+        help="Path to the YAML platform metadata configuration file."
+    )
+    rerender_parser.add_argument(
+        "--product_metadata_csv", "-pr", type=str, required=True,
+        help="Path to the CSV file with metadata related to each product type."
+    )
+    rerender_parser.add_argument(
+        "--mmd_dir", "-m", type=str, required=False,
+        help="Write all MMD files to this directory instead of their original paths."
+    )
+    rerender_parser.add_argument(
+        "--workers", type=int, required=False,
+        help="Number of worker processes. Defaults to the number of CPUs."
+    )
+    rerender_parser.add_argument('--update', '-u', action='store_true',
+        help='If present, existing MMD files are only rewritten if their content changed, and their update history is kept.')
+    rerender_parser.set_defaults(func=rerender_store)
+
+    query_parser = subparsers.add_parser(
+        "catalogue-query",
+        help="Count products in the Parquet metadata catalogue."
+    )
+    query_parser.add_argument(
+        "--catalogue", "-c", type=str, required=True,
+        help="Root directory of the Parquet catalogue."
+    )
+    query_parser.add_argument("--mission", type=str, help="Mission, e.g. S2.")
+    query_parser.add_argument("--platform", type=str, help="Platform, e.g. S2A.")
+    query_parser.add_argument("--product_type", type=str, help="Product type, e.g. MSI-L1C or MSIL1C.")
+    query_parser.add_argument("--year", type=int, help="Year of the start date.")
+    query_parser.add_argument("--month", type=int, help="Month of the start date.")
+    query_parser.add_argument("--sios", action="store_true", help="Only count products within the SIOS region.")
+    query_parser.add_argument(
+        "--group_by", nargs="+", required=False,
+        help="Columns to group the counts by, e.g. platform year."
+    )
+    query_parser.set_defaults(func=query_catalogue)
+
+    sync_parser = subparsers.add_parser(
+        "odata-sync",
+        help="Prepare MMD files for products newly published or modified in OData."
+    )
+    sync_parser.add_argument(
+        "--mmd_dir", "-m", type=str, required=True,
+        help="Root directory for the MMD files, laid out like the archive."
+    )
+    sync_parser.add_argument(
+        "--archive", "-a", type=str, required=False,
+        help="Root directory of the archive the products will be downloaded to, used for their file paths."
+    )
+    sync_parser.add_argument(
+        "--missions", nargs="+", choices=list(COLLECTIONS), default=list(COLLECTIONS),
+        help="Missions to sync. Defaults to all."
+    )
+    sync_parser.add_argument(
+        "--aoi", type=str, required=False,
+        help="Only sync products intersecting this area, as 'west,south,east,north' or WKT in EPSG:4326."
+    )
+    sync_parser.add_argument(
+        "--field", choices=SYNC_FIELDS, default="ModificationDate",
+        help="OData date the watermark is kept on."
+    )
+    sync_parser.add_argument(
+        "--since", type=str, required=False,
+        help="Start of the first sync of a mission, e.g. 2024-03-01T00:00:00Z. Defaults to one day ago. Later syncs continue from the stored watermark."
+    )
+    sync_parser.add_argument(
+        "--lookback", type=float, default=10,
+        help="Minutes before the watermark to query again, for products catalogued late. Products already synced are skipped."
+    )
+    sync_parser.add_argument("--page_size", type=int, default=100, help="Products per OData page.")
+    sync_parser.add_argument(
+        "--interval", type=float, required=False,
+        help="Sync again every this many minutes until interrupted. Without it, sync once."
+    )
+    add_config_arguments(sync_parser)
+    sync_parser.set_defaults(func=sync_odata)
+
+    enrich_parser = subparsers.add_parser(
+        "enrich",
+        help="Complete provisional MMD files from OData once their products are published."
+    )
+    enrich_parser.add_argument(
+        "--limit", type=int, required=False,
+        help="Products to attempt per pass. Defaults to all products due."
+    )
+    enrich_parser.add_argument(
+        "--interval", type=float, required=False,
+        help="Attempt the products due again every this many minutes until interrupted. Without it, make one pass."
+    )
+    add_config_arguments(enrich_parser)
+    enrich_parser.set_defaults(func=enrich_provisional)
+
+    extents_parser = subparsers.add_parser(
+        "parent-extents",
+        help="Write parent dataset MMD files with the extents of their children."
+    )
+    extents_parser.add_argument(
+        "--parent_aggregates", type=str, required=True,
+        help="Path to the SQLite database of parent dataset extents."
+    )
+    extents_parser.add_argument(
+        "--output_dir", "-m", type=str, required=False,
+        help="Directory to write the parent MMD files to. Without it the extents are only listed."
+    )
+    extents_parser.add_argument(
+        "--parent_mmd_dir", type=str, required=False,
+        help="Directory of existing parent MMD files (<parent_id>.xml) to update instead of writing minimal records."
+    )
+    extents_parser.add_argument(
+        "--seed", type=str, required=False,
+        help="Directory of existing child MMD files to add to the database first, e.g. for an archive processed before the database existed."
+    )
+    extents_parser.set_defaults(func=parent_extents)
+
+    index_parser = subparsers.add_parser(
+        "index-query",
+        help="Find products in the spatial index covering an area and time window."
+    )
+    index_parser.add_argument(
+        "--spatial_index", type=str, required=True,
+        help="Path to the SQLite spatial index."
+    )
+    index_parser.add_argument(
+        "--aoi", type=str, required=False,
+        help="Area of interest as 'west,south,east,north' or WKT in EPSG:4326. Products with a footprint must intersect it."
+    )
+    index_parser.add_argument("--start", type=str, help="Start of the time window, e.g. 2024-03-01.")
+    index_parser.add_argument("--end", type=str, help="End of the time window, e.g. 2024-03-31T23:59:59Z.")
+    index_parser.add_argument(
+        "--from_store", type=str, required=False,
+        help="Index all products of this extraction store first, e.g. for products generated before the index existed."
+    )
+    index_parser.add_argument(
+        "--verbose", "-v", action="store_true",
+        help="Print the filename and temporal extent with each product ID."
+    )
+    index_parser.set_defaults(func=query_index)
+
+    args = parser.parse_args()
+    configure_logging()
+    if hasattr(args, 'io_limit'):
+        configure_io(args.io_limit, args.io_limit_per_worker, args.fadvise)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,24 @@
 import argparse
+import logging
 import os
+import sqlite3
 import sys
+import time
 import pandas as pd
-from mmd_utils.metadata_extraction import (
-    get_metadata_from_netcdf,
-    get_metadata_from_odata,
-    get_metadata_from_json,
-    get_metadata_from_safe,
-    get_metadata_from_sen3,
-    check_metadata,
-)
-from mmd_utils.config_handling import load_config,save_xml_to_file
-from mmd_utils.mmd_helpers import create_xml, generate_nbs_id
+from mmd_utils.metadata_extraction import extract_metadata, ODATA_URL
+from mmd_utils.odata_mirror import open_mirror, get_fallback_metadata
+from mmd_utils.catalogue import MetadataCatalogue, catalogue_record
+from mmd_utils.extraction_store import ExtractionStore
+from mmd_utils.parent_aggregates import ParentAggregates
+from mmd_utils.spatial_index import SpatialIndex
+from mmd_utils.enrichment import EnrichmentQueue, provisional_metadata
+from mmd_utils.mmd_update import mark_provisional
+from mmd_utils.config_handling import configure_logging, load_config
+from mmd_utils.output_writers import WRITERS, keep_current, write_outputs
+from mmd_utils.io_throttle import configure_io
+from mmd_utils.mmd_helpers import create_xml, generate_nbs_id, fill_storage_information
+
+logger = logging.getLogger(__name__)
 
 # Get the script's directory
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -24,38 +31,48 @@ def generate_mmd(
         output_path,
         filepath,
         json_metadata=None,
-        create_id=False
+        create_id=False,
+        odata_mirror=None,
+        odata_url=ODATA_URL,
+        catalogue=None,
+        extraction_store=None,
+        parent_aggregates=None,
+        spatial_index=None,
+        update=False,
+        formats=None,
+        swath_footprint=False,
+        odata_budget=None,
+        enrichment_queue=None
         ):
     
     basename = filename.split('.')[0]
+    # odata_mirror is the path of the mirror, or a connection kept open by the caller for many products
+    if isinstance(odata_mirror, sqlite3.Connection):
+        mirror = odata_mirror
+    else:
+        mirror = open_mirror(odata_mirror, read_only=True) if odata_mirror else None
     if create_id:
         id = generate_nbs_id(filename)
     else:
         id = None
-    try:
-
-        if json_metadata:
-            print("Extracting metadata from JSON")
-            metadata, id = get_metadata_from_json(json_metadata)
-        elif filename.startswith("S5"):
-            print("Extracting metadata from NetCDF file")
-            metadata = get_metadata_from_netcdf(filepath)
-        elif filename.startswith("S3"):
-            print("Extracting metadata from SEN3 file")
-            metadata = get_metadata_from_sen3(filepath)
-        elif filename[:2] in ["S1", "S2"]:
-            print("Extracting metadata from SAFE file")
-            metadata = get_metadata_from_safe(filepath)
-        else:
-            metadata = {}
+    local_metadata, local_id = extract_metadata(filename, filepath, json_metadata, id, swath_footprint)
+    query_options = {}
+    if odata_budget is not None:
+        query_options['deadline'] = time.monotonic() + odata_budget
+    metadata, id = get_fallback_metadata(local_metadata, local_id, basename, filepath, mirror, odata_url, **query_options)
 
-    except Exception as e:
-        print(f"Error: Couldn't extract metadata from source file. Reason: {e}")
-        metadata = {}
+    if mirror and mirror is not odata_mirror:
+        mirror.close()
 
-    if not check_metadata(metadata, id):
-        print("Insufficient metadata, so querying")
-        metadata, id = get_metadata_from_odata(basename)
+    provisional = not metadata and odata_budget is not None and filepath is not None
+    if provisional:
+        # Written from the local metadata now and completed from OData later, under the same identifier
+        logger.warning(f"No OData metadata for {filename} within the budget, writing a provisional MMD file")
+        metadata = provisional_metadata(local_metadata or {}, filename)
+        fill_storage_information(metadata, filepath)
+        id = local_id or generate_nbs_id(filename)
+    elif not metadata:
+        raise ValueError(f"No metadata found for {filename}")
 
     # Load configurations
     global_attributes = load_config(global_attributes_config)
@@ -64,10 +81,37 @@ def generate_mmd(
 
     # Create XML
     mmd_xml = create_xml(script_dir, metadata, id, global_attributes, platform_metadata, product_metadata_df, filename, filepath)
+    if provisional:
+        mark_provisional(mmd_xml)
 
     # Save XML to the output path
-    save_xml_to_file(mmd_xml, output_path)
-    print(f"MMD XML file saved to {output_path}")
+    outputs = write_outputs(formats or ['mmd'], mmd_xml, metadata, output_path, update=update)
+    for output_format, (path, output_written) in outputs.items():
+        name = 'MMD XML' if output_format == 'mmd' else output_format.upper()
+        if output_written:
+            print(f"{name} file saved to {path}")
+        else:
+            print(f"{name} file {path} is unchanged, not rewritten")
+    written = any(output_written for _, output_written in outputs.values())
+    if update and 'mmd' in outputs and not outputs['mmd'][1]:
+        keep_current(outputs['mmd'][0], filepath)
+
+    if catalogue is not None:
+        catalogue.append(catalogue_record(metadata, id, filename, mmd_xml))
+
+    if extraction_store is not None:
+        extraction_store.put(filename, id, filepath, output_path, metadata, mmd_xml)
+
+    if parent_aggregates is not None:
+        parent_aggregates.add(mmd_xml)
+
+    if spatial_index is not None:
+        spatial_index.add(filename, id, metadata)
+
+    if provisional and enrichment_queue is not None:
+        enrichment_queue.put({'filename': filename, 'filepath': filepath, 'mmd_path': output_path, 'id': id}, metadata)
+
+    return written
 
 def main():
     """
@@ -97,7 +141,7 @@ def main():
     )
     parser.add_argument(
         "-f", "--filepath", type=str, required=False,
-        help="Path to the data file (e.g., .zip, .SAFE, .nc) for metadata extraction."
+        help="Path or HTTP(S) URL of the data file (e.g., .zip, .SAFE, .nc) for metadata extraction. URLs are read with range requests."
     )
     parser.add_argument(
         "--json_metadata", "-j", type=str, required=False,
@@ -105,14 +149,76 @@ def main():
     )
     parser.add_argument('--create_id', '-id', action='store_true',
         help='If present, a metadata identifier will be created unique to NBS instead. If not, the tracking ID provided by ESA is used.')
+    parser.add_argument(
+        "--odata_mirror", "-o", type=str, required=False,
+        help="Path to a local SQLite mirror of OData records, looked up before querying the OData API."
+    )
+    parser.add_argument(
+        "--odata_url", type=str, default=ODATA_URL,
+        help="OData Products endpoint queried when the metadata is insufficient, e.g. a local mock server for testing."
+    )
+    parser.add_argument(
+        "--catalogue", "-c", type=str, required=False,
+        help="Root directory of a Parquet catalogue to append the extracted metadata to."
+    )
+    parser.add_argument(
+        "--extraction_store", "-e", type=str, required=False,
+        help="Path to an SQLite store of extraction results, used to re-render MMD files without the source files."
+    )
+    parser.add_argument(
+        "--parent_aggregates", type=str, required=False,
+        help="Path to an SQLite database of parent dataset extents, updated with each MMD file generated."
+    )
+    parser.add_argument(
+        "--spatial_index", type=str, required=False,
+        help="Path to an SQLite spatial index of product footprints and temporal extents, updated with each MMD file generated."
+    )
+    parser.add_argument('--update', '-u', action='store_true',
+        help='If present, an existing MMD file is only rewritten if its content changed, and its update history is kept.')
+    parser.add_argument(
+        "--formats", nargs="+", choices=list(WRITERS), default=["mmd"],
+        help="Metadata formats to write from the same extraction: mmd, stac (STAC Item) and/or iso19139. Written next to the MMD path."
+    )
+    parser.add_argument(
+        "--io_limit", type=float, required=False,
+        help="Read budget for product files in MB/s, shared by all workers of this process."
+    )
+    parser.add_argument(
+        "--io_limit_per_worker", type=float, required=False,
+        help="Read budget for product files in MB/s for each worker thread."
+    )
+    parser.add_argument('--fadvise', action='store_true',
+        help='If present, sequential reads are hinted to the kernel and checksummed files are dropped from the page cache.')
+    parser.add_argument('--swath_footprint', action='store_true',
+        help='If present, the footprint of S5P products is derived from the edges of the swath in their geolocation arrays.')
+    parser.add_argument(
+        "--odata_budget", type=float, required=False,
+        help="Seconds the OData fallback may take. If OData has not answered by then, a provisional MMD file is written from the local metadata."
+    )
+    parser.add_argument(
+        "--enrichment_queue", type=str, required=False,
+        help="Path to an SQLite queue of provisional MMD files, completed from OData later with 'batch_mmd.py enrich'."
+    )
 
     # Parse the command-line arguments
     args = parser.parse_args()
+    configure_logging()
+    configure_io(args.io_limit, args.io_limit_per_worker, args.fadvise)
 
     if os.path.isdir(args.mmd_path):
         print(f"Error: Output path is a directory, not a file: {args.mmd_path}")
         sys.exit(1)
 
+    if args.odata_mirror and not os.path.exists(args.odata_mirror):
+        print(f"Error: OData mirror not found: {args.odata_mirror}")
+        sys.exit(1)
+
+    catalogue = MetadataCatalogue(args.catalogue) if args.catalogue else None
+    extraction_store = ExtractionStore(args.extraction_store) if args.extraction_store else None
+    parent_aggregates = ParentAggregates(args.parent_aggregates) if args.parent_aggregates else None
+    spatial_index = SpatialIndex(args.spatial_index) if args.spatial_index else None
+    enrichment_queue = EnrichmentQueue(args.enrichment_queue) if args.enrichment_queue else None
+
     # Call the generate_mmd function
     generate_mmd(
         filename=args.product,
@@ -122,8 +228,30 @@ def main():
         output_path=args.mmd_path,
         filepath=args.filepath,
         json_metadata=args.json_metadata,
-        create_id=args.create_id
+        create_id=args.create_id,
+        odata_mirror=args.odata_mirror,
+        odata_url=args.odata_url,
+        catalogue=catalogue,
+        extraction_store=extraction_store,
+        parent_aggregates=parent_aggregates,
+        spatial_index=spatial_index,
+        update=args.update,
+        formats=args.formats,
+        swath_footprint=args.swath_footprint,
+        odata_budget=args.odata_budget,
+        enrichment_queue=enrichment_queue
     )
 
+    if catalogue is not None:
+        catalogue.close()
+    if extraction_store is not None:
+        extraction_store.close()
+    if parent_aggregates is not None:
+        parent_aggregates.close()
+    if spatial_index is not None:
+        spatial_index.close()
+    if enrichment_queue is not None:
+        enrichment_queue.close()
+
 if __name__ == "__main__":
     main()
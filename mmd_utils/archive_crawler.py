@@ -0,0 +1,137 @@
+import calendar
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import date
+from mmd_utils.filename_parser import parse_product_name
+from mmd_utils.archive_inventory import PRODUCT_SUFFIXES, mirrored_mmd_path
+from mmd_utils.batch import make_work_item
+
+logger = logging.getLogger(__name__)
+
+# Directory levels of the nbsArchive layout: platform/YYYY/MM/DD/[mode|product_type]/file
+PLATFORM_LEVEL = 1
+YEAR_LEVEL = 2
+MONTH_LEVEL = 3
+DAY_LEVEL = 4
+TYPE_LEVEL = 5
+
+
+class ArchiveFilter:
+    """
+    Which parts of the archive to crawl.
+
+    platforms: platform directory names or prefixes, e.g. S1A or S1
+    start, end: inclusive range of dates (datetime.date) of the day directories
+    product_types: names of the directories below the day (S1 mode, e.g. EW, or
+        the product type of S3/S5, e.g. OL-L1-EFR). S2 products, which are stored
+        directly in the day directory, are matched on the ESA product type, e.g. MSIL1C.
+    """
+
+    def __init__(self, platforms=None, start=None, end=None, product_types=None):
+        self.platforms = tuple(platforms) if platforms else None
+        self.start = start
+        self.end = end
+        self.product_types = set(product_types) if product_types else None
+
+    def _date_in_range(self, parts):
+        # parts is (year,), (year, month) or (year, month, day); compare on that precision
+        precision = len(parts)
+        if self.start and parts < (self.start.year, self.start.month, self.start.day)[:precision]:
+            return False
+        if self.end and parts > (self.end.year, self.end.month, self.end.day)[:precision]:
+            return False
+        return True
+
+    def keep_directory(self, level, name, date_parts):
+        """
+        Whether to descend into a directory. Returns (keep, date_parts) with the
+        date parts read so far from the path.
+        """
+        if level == PLATFORM_LEVEL:
+            return (not self.platforms or name.startswith(self.platforms)), date_parts
+        if level in (YEAR_LEVEL, MONTH_LEVEL, DAY_LEVEL):
+            if not name.isdigit():
+                return not (self.start or self.end), date_parts
+            date_parts = date_parts + (int(name),)
+            return self._date_in_range(date_parts), date_parts
+        if level == TYPE_LEVEL:
+            return (not self.product_types or name in self.product_types), date_parts
+        return True, date_parts
+
+    def keep_file(self, level, name):
+        product = parse_product_name(name)
+        if product is None:
+            # Not a Sentinel product
+            return False
+        if self.product_types and level == TYPE_LEVEL:
+            # Products stored in the day directory (S2) have no type directory to prune on
+            return product.product_type in self.product_types
+        return True
+
+
+def _scan(directory, level, date_parts, archive_filter, suffixes):
+    files = []
+    subdirs = []
+    names = set()
+    try:
+        with os.scandir(directory) as entries:
+            entries = list(entries)
+    except OSError as e:
+        logger.warning(f"Warning: could not list {directory}: {e}")
+        return files, subdirs
+
+    for entry in entries:
+        names.add(entry.name)
+    for entry in entries:
+        if entry.name.endswith(suffixes):
+            if archive_filter.keep_file(level, entry.name):
+                sidecar_name = entry.name.split('.')[0] + '.json'
+                sidecar = os.path.join(directory, sidecar_name) if sidecar_name in names else None
+                files.append((entry.name, entry.path, sidecar))
+        elif entry.is_dir(follow_symlinks=False):
+            keep, subdir_date = archive_filter.keep_directory(level, entry.name, date_parts)
+            if keep:
+                subdirs.append((entry.path, level + 1, subdir_date))
+    return files, subdirs
+
+
+def crawl_archive(archive_root, archive_filter=None, workers=16, suffixes=PRODUCT_SUFFIXES):
+    """
+    Walk the archive in parallel with os.scandir, skipping platform, date and
+    product type directories outside the filter. Yields (filename, path, sidecar)
+    tuples as directories are listed, where sidecar is the path of a JSON file
+    with the same name next to the product, or None. Order is not preserved.
+    """
+    archive_filter = archive_filter or ArchiveFilter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(_scan, archive_root, PLATFORM_LEVEL, (), archive_filter, suffixes)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                for path, level, date_parts in subdirs:
+                    pending.add(pool.submit(_scan, path, level, date_parts, archive_filter, suffixes))
+                yield from files
+
+
+def crawl_worklist(archive_root, mmd_root, archive_filter=None, workers=16):
+    """
+    Yield work items for the products found by the archive crawler, with the
+    sidecar JSON (if any) as json_metadata. Items are yielded while the crawl
+    is still running.
+    """
+    for filename, path, sidecar in crawl_archive(archive_root, archive_filter, workers):
+        yield make_work_item(path, mirrored_mmd_path(path, archive_root, mmd_root), json_metadata=sidecar)
+
+
+def parse_date(value, end=False):
+    """
+    Parse a date given as YYYY-MM-DD, or as YYYY-MM for the first day of the
+    month (or the last day if end is True).
+    """
+    if len(value) == 7:
+        year, month = (int(part) for part in value.split('-'))
+        day = calendar.monthrange(year, month)[1] if end else 1
+        return date(year, month, day)
+    return date.fromisoformat(value)
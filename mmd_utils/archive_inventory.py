@@ -0,0 +1,135 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+from mmd_utils.filename_parser import parse_product_names
+from mmd_utils.mmd_helpers import generate_nbs_id
+from mmd_utils.batch import make_work_item
+from mmd_utils.json_stream import iter_json_records
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_SUFFIXES = ('.zip', '.nc')
+
+
+def scan_tree(root, suffixes, workers=16):
+    """
+    List all files under root ending with one of the suffixes, scanning
+    directories in parallel with os.scandir.
+    Returns a DataFrame with name, path and mtime columns.
+    """
+    names, paths, mtimes = [], [], []
+
+    def scan(directory):
+        files, subdirs = [], []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(suffixes):
+                        files.append((entry.name, entry.path, entry.stat().st_mtime))
+                    elif entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+        except OSError as e:
+            logger.warning(f"Warning: could not list {directory}: {e}")
+        return files, subdirs
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(scan, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                for name, path, mtime in files:
+                    names.append(name)
+                    paths.append(path)
+                    mtimes.append(mtime)
+                for subdir in subdirs:
+                    pending.add(pool.submit(scan, subdir))
+
+    return pd.DataFrame({'name': names, 'path': paths, 'mtime': mtimes})
+
+
+def reconcile(archive_root, mmd_root, workers=16):
+    """
+    Compare the data archive with the MMD output tree.
+
+    Products and MMD files are matched on the identifier from generate_nbs_id.
+    Returns three DataFrames:
+        missing: products without an MMD file
+        orphaned: MMD files without a product in the archive
+        outdated: MMD files older than their product
+    """
+    products = scan_tree(archive_root, PRODUCT_SUFFIXES, workers)
+    mmds = scan_tree(mmd_root, ('.xml',), workers)
+    logger.info(f"Found {len(products)} products in {archive_root} and {len(mmds)} MMD files in {mmd_root}")
+
+    parsed = parse_product_names(products['name'].tolist())
+    unknown = parsed['mission'].isna().to_numpy()
+    if unknown.any():
+        logger.info(f"Skipping {unknown.sum()} files that are not Sentinel products")
+    products = products[~unknown].reset_index(drop=True)
+    parsed = parsed[~unknown].reset_index(drop=True)
+    products['platform'] = parsed['platform']
+    products['product_type'] = parsed['product_type']
+    products['start'] = parsed['start']
+
+    products['id'] = [generate_nbs_id(name) for name in products['name']]
+    mmds['id'] = [generate_nbs_id(name) for name in mmds['name']]
+
+    merged = products.merge(
+        mmds[['id', 'path', 'mtime']].rename(columns={'path': 'mmd_path', 'mtime': 'mmd_mtime'}),
+        on='id', how='outer', indicator=True
+    )
+
+    missing = merged[merged['_merge'] == 'left_only'].drop(columns=['mmd_path', 'mmd_mtime', '_merge'])
+    orphaned = mmds[mmds['id'].isin(merged.loc[merged['_merge'] == 'right_only', 'id'])]
+    both = merged[merged['_merge'] == 'both']
+    outdated = both[both['mtime'] > both['mmd_mtime']].drop(columns=['_merge'])
+
+    return missing, orphaned, outdated
+
+
+def mirrored_mmd_path(product_path, archive_root, mmd_root):
+    """
+    Path of the MMD file for a product, mirroring the directory layout of the archive.
+    """
+    relative_dir = os.path.relpath(os.path.dirname(product_path), archive_root)
+    name = os.path.basename(product_path)
+    return os.path.normpath(os.path.join(mmd_root, relative_dir, name.split('.')[0] + '.xml'))
+
+
+def reconciliation_worklist(missing, outdated, archive_root, mmd_root):
+    """
+    Yield work items for the batch generator. New MMD files mirror the
+    directory layout of the archive; outdated MMD files are regenerated in place.
+    """
+    for row in missing.itertuples(index=False):
+        mmd_path = mirrored_mmd_path(row.path, archive_root, mmd_root)
+        yield make_work_item(row.path, mmd_path, id=row.id, reason='missing')
+
+    for row in outdated.itertuples(index=False):
+        yield make_work_item(row.path, row.mmd_path, id=row.id, reason='outdated')
+
+
+def json_worklist(json_paths, archive_root, mmd_root, workers=16):
+    """
+    Yield work items for the OData records in JSON/JSONL dumps, matched by Name
+    to the product files in the archive. The dumps are streamed, so only the
+    archive listing is held in memory. The record itself is the work item's
+    json_metadata.
+    """
+    products = scan_tree(archive_root, PRODUCT_SUFFIXES, workers)
+    paths = dict(zip([name.split('.')[0] for name in products['name']], products['path']))
+    logger.info(f"Found {len(paths)} products in {archive_root}")
+
+    unmatched = 0
+    for json_path in json_paths:
+        for record in iter_json_records(json_path):
+            path = paths.get(record.get('Name', '').split('.')[0])
+            if path is None:
+                unmatched += 1
+                continue
+            yield make_work_item(path, mirrored_mmd_path(path, archive_root, mmd_root), json_metadata=record)
+    if unmatched:
+        logger.info(f"Skipped {unmatched} OData records without a product file in {archive_root}")
+
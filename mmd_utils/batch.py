@@ -0,0 +1,81 @@
+import json
+import os
+from functools import lru_cache
+from mmd_utils.json_stream import iter_json_record_offsets, read_json_record
+
+
+def make_work_item(filepath, mmd_path, json_metadata=None, **extra):
+    """
+    A work item describes one product for the batch generator.
+    Extra keys (e.g. id, reason) are kept for bookkeeping.
+    """
+    item = {
+        'filename': os.path.basename(filepath),
+        'filepath': filepath,
+        'mmd_path': mmd_path,
+    }
+    if json_metadata:
+        item['json_metadata'] = json_metadata
+    item.update(extra)
+    return item
+
+
+def write_worklist(items, worklist_path):
+    """
+    Write work items as JSONL, one product per line. Returns the number of items written.
+    """
+    count = 0
+    with open(worklist_path, 'w', encoding='utf-8') as fh:
+        for item in items:
+            fh.write(json.dumps(item) + '\n')
+            count += 1
+    return count
+
+
+def read_worklist(worklist_path):
+    """
+    Yield work items from a JSONL work list.
+    """
+    with open(worklist_path, 'r', encoding='utf-8') as fh:
+        for line in fh:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _json_offsets(json_path):
+    return _json_offsets_at(json_path, os.stat(json_path).st_mtime_ns)
+
+
+@lru_cache(maxsize=2)
+def _json_offsets_at(json_path, mtime_ns):
+    # Byte offsets of the records of a JSON file by product name, so the file is
+    # scanned once however many items refer to it, without keeping the records
+    return {
+        record.get('Name', '').split('.')[0]: (start, end)
+        for record, start, end in iter_json_record_offsets(json_path)
+    }
+
+
+def resolve_json_metadata(item):
+    """
+    Replace the path of a JSON file in the item's json_metadata by the record
+    of the product, so a file shared by many items is scanned once rather than
+    once per product. Only the offsets of the records are kept in memory, and
+    each record is read on its own. The path is kept if the file has no
+    matching record, and create_mmd reports the problem.
+    """
+    json_path = item.get('json_metadata')
+    if not json_path or isinstance(json_path, dict):
+        return item
+    try:
+        offsets = _json_offsets(json_path)
+        span = offsets.get(item['filename'].split('.')[0])
+        if span is None and len(offsets) == 1:
+            span = next(iter(offsets.values()))
+        if span is None:
+            return item
+        record = read_json_record(json_path, *span)
+    except (OSError, ValueError):
+        return item
+    return dict(item, json_metadata=record)
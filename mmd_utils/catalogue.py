@@ -0,0 +1,207 @@
+import uuid
+from datetime import datetime, timezone
+import pandas as pd
+from mmd_utils.filename_parser import parse_product_name
+from mmd_utils.product_metadata import as_product_metadata
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+MMD_NS = {'mmd': 'http://www.met.no/schema/mmd'}
+
+PARTITION_COLUMNS = ['platform', 'year', 'month']
+
+
+def catalogue_schema():
+    return pa.schema([
+        ('id', pa.string()),
+        ('filename', pa.string()),
+        ('mission', pa.string()),
+        ('platform', pa.string()),
+        ('esa_product_type', pa.string()),
+        ('product_type', pa.string()),
+        ('start_date', pa.timestamp('us', tz='UTC')),
+        ('end_date', pa.timestamp('us', tz='UTC')),
+        ('north', pa.float64()),
+        ('south', pa.float64()),
+        ('east', pa.float64()),
+        ('west', pa.float64()),
+        ('footprint_wkb', pa.binary()),
+        ('orbit_number', pa.int64()),
+        ('relative_orbit_number', pa.int64()),
+        ('orbit_direction', pa.string()),
+        ('cloud_cover', pa.float64()),
+        ('sensor_mode', pa.string()),
+        ('polarisation', pa.string()),
+        ('md5_checksum', pa.string()),
+        ('file_size_mb', pa.float64()),
+        ('sios', pa.bool_()),
+        ('created', pa.timestamp('us', tz='UTC')),
+        ('year', pa.int16()),
+        ('month', pa.int8()),
+    ])
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_datetime(value):
+    if value is None:
+        return None
+    timestamp = pd.to_datetime(value, utc=True, errors='coerce')
+    if pd.isna(timestamp):
+        return None
+    return timestamp.to_pydatetime()
+
+
+def _mmd_text(root, path):
+    element = root.find(path, MMD_NS)
+    if element is None:
+        return None
+    return element.text
+
+
+def catalogue_record(metadata, id, filename, mmd_xml):
+    """
+    Build a flat catalogue record from the extracted metadata and the MMD element
+    tree created from it. Checksum, file size, product type and SIOS membership
+    are read back from the MMD so they are not computed twice.
+    """
+    product = parse_product_name(filename)
+    metadata = as_product_metadata(metadata)
+    start_date = _to_datetime(metadata.get('startDate'))
+
+    return {
+        'id': id,
+        'filename': filename,
+        'mission': product.mission if product else None,
+        'platform': product.platform if product else filename.split('_')[0],
+        'esa_product_type': product.product_type if product else None,
+        'product_type': _mmd_text(mmd_xml, 'mmd:platform/mmd:instrument/mmd:product_type'),
+        'start_date': start_date,
+        'end_date': _to_datetime(metadata.get('completionDate')),
+        'north': _to_float(metadata.get('north')),
+        'south': _to_float(metadata.get('south')),
+        'east': _to_float(metadata.get('east')),
+        'west': _to_float(metadata.get('west')),
+        'footprint_wkb': metadata.footprint_wkb,
+        'orbit_number': _to_int(metadata.get('orbitNumber')),
+        'relative_orbit_number': _to_int(metadata.get('relativeOrbitNumber')),
+        'orbit_direction': metadata.get('orbitDirection'),
+        'cloud_cover': _to_float(metadata.get('cloudCover')),
+        'sensor_mode': metadata.get('sensorMode'),
+        'polarisation': metadata.get('polarisation'),
+        'md5_checksum': _mmd_text(mmd_xml, 'mmd:storage_information/mmd:checksum'),
+        'file_size_mb': _to_float(_mmd_text(mmd_xml, 'mmd:storage_information/mmd:file_size')),
+        'sios': any(c.text == 'SIOS' for c in mmd_xml.findall('mmd:collection', MMD_NS)),
+        'created': datetime.now(timezone.utc),
+        'year': start_date.year if start_date else None,
+        'month': start_date.month if start_date else None,
+    }
+
+
+class MetadataCatalogue:
+    """
+    Append-only Parquet catalogue of extracted metadata, partitioned by
+    platform, year and month. Records are buffered and written in batches,
+    one Parquet file per batch and partition.
+    """
+
+    def __init__(self, root, batch_size=1000):
+        if pa is None:
+            raise ImportError("pyarrow is required to write the metadata catalogue")
+        self.root = root
+        self.batch_size = batch_size
+        self.records = []
+
+    def append(self, record):
+        self.records.append(record)
+        if len(self.records) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.records:
+            return
+        table = pa.Table.from_pylist(self.records, schema=catalogue_schema())
+        pq.write_to_dataset(
+            table,
+            self.root,
+            partition_cols=PARTITION_COLUMNS,
+            basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+        )
+        self.records = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_catalogue_dataset(root):
+    if pa is None:
+        raise ImportError("pyarrow is required to read the metadata catalogue")
+    schema = catalogue_schema()
+    partitioning = ds.partitioning(
+        pa.schema([schema.field(name) for name in PARTITION_COLUMNS]), flavor='hive'
+    )
+    return ds.dataset(root, format='parquet', partitioning=partitioning, schema=schema)
+
+
+def catalogue_filter(mission=None, platform=None, product_type=None, year=None, month=None, sios=None):
+    """
+    Build a pyarrow filter expression. Filters on platform, year and month only
+    touch the matching partitions.
+    """
+    conditions = []
+    if mission:
+        conditions.append(ds.field('mission') == mission)
+    if platform:
+        conditions.append(ds.field('platform') == platform)
+    if product_type:
+        conditions.append(
+            (ds.field('product_type') == product_type) | (ds.field('esa_product_type') == product_type)
+        )
+    if year is not None:
+        conditions.append(ds.field('year') == year)
+    if month is not None:
+        conditions.append(ds.field('month') == month)
+    if sios is not None:
+        conditions.append(ds.field('sios') == sios)
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def count_products(root, group_by=None, **filters):
+    """
+    Count catalogued products matching the filters, optionally grouped by columns.
+    Products catalogued more than once are counted once.
+    """
+    dataset = open_catalogue_dataset(root)
+    columns = ['id'] + list(group_by or [])
+    table = dataset.to_table(columns=columns, filter=catalogue_filter(**filters))
+    df = table.to_pandas().drop_duplicates(subset='id')
+    if not group_by:
+        return len(df)
+    return df.groupby(list(group_by)).size()
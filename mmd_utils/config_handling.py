@@ -1,15 +1,43 @@
+import logging
+import os
+import sys
 import yaml
 from lxml import etree as ET
+from mmd_utils.mmd_update import load_mmd, mmd_changed, carry_update_history
+
+
+def configure_logging(level=logging.INFO):
+    '''
+    Print the progress messages of mmd_utils to stdout, as the command line
+    tools do. Library users get no messages below warnings unless they
+    configure logging themselves.
+    '''
+    logging.basicConfig(level=level, format='%(message)s', stream=sys.stdout)
 
 
 def load_config(yaml_path):
     with open(yaml_path, 'r') as file:
         return yaml.safe_load(file)    
 
-def save_xml_to_file(xml_element, output_path):
+def save_xml_to_file(xml_element, output_path, update=False):
+    '''
+    Write the MMD element to output_path (with an .xml suffix).
+    In update mode an existing MMD file is only rewritten if its content changed,
+    ignoring timestamps; its update history is kept and a 'Minor modification'
+    entry is appended. Returns True if the file was written.
+    '''
+
+    # Only strip suffixes from the file name, directories may contain dots
+    output_path = os.path.join(os.path.dirname(output_path), os.path.basename(output_path).split('.')[0]+'.xml')
+
+    if update and os.path.exists(output_path):
+        existing = load_mmd(output_path)
+        if not mmd_changed(existing, xml_element):
+            return False
+        xml_element = carry_update_history(existing, xml_element)
 
     tree = ET.ElementTree(xml_element)
-    output_path = output_path.split('.')[0]+'.xml'
     tree.write(output_path, encoding='utf-8', xml_declaration=True, pretty_print=True)
+    return True
 
 
@@ -0,0 +1,74 @@
+import re
+import warnings
+import numpy as np
+import shapely
+
+WKT_PREFIX = re.compile(r'^\s*(?:SRID=\d+;)?\s*POLYGON\s*\(\s*\(', re.IGNORECASE)
+WKT_RING_SEPARATOR = re.compile(r'\)\s*,\s*\(')
+
+
+def parse_numbers(text):
+    """
+    Parse numbers separated by whitespace and/or commas into a 1D float array,
+    in one pass in C instead of a float() call per number.
+    """
+    with warnings.catch_warnings():
+        # np.fromstring warns and stops at the first token that is not a number
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(text.replace(',', ' '), dtype=np.float64, sep=' ')
+        except (DeprecationWarning, ValueError):
+            raise ValueError(f"Invalid coordinate list: {text[:80]!r}")
+
+
+def parse_pairs(text, lat_first=False):
+    """
+    Parse a coordinate list into an (N, 2) array of (lon, lat). Accepts
+    'lat,lon lat,lon' (S1 gml:coordinates), 'lat lon lat lon' (S2 gml:coordinates,
+    S3 gml:posList) and 'x,y x,y' (OData GML). With lat_first the axes are
+    swapped to (lon, lat).
+    """
+    numbers = parse_numbers(text)
+    if numbers.size % 2:
+        raise ValueError(f"Odd number of values in coordinate list: {numbers.size}")
+    pairs = numbers.reshape(-1, 2)
+    if lat_first:
+        pairs = pairs[:, ::-1]
+    return pairs
+
+
+def parse_wkt_polygon(text):
+    """
+    Parse a WKT POLYGON (optionally with an SRID= prefix) into a list of
+    (N, 2) arrays, the exterior ring first and then the interior rings.
+    """
+    match = WKT_PREFIX.match(text)
+    end = text.rfind('))')
+    if not match or end < match.end():
+        raise ValueError("Expected WKT POLYGON")
+    inner = text[match.end():end]
+    return [parse_pairs(ring) for ring in WKT_RING_SEPARATOR.split(inner)]
+
+
+def polygon_from_rings(rings):
+    """
+    Build a shapely Polygon from (N, 2) arrays of the exterior and interior
+    rings, without going through lists of tuples.
+    """
+    return shapely.polygons(rings[0], holes=rings[1:] or None)
+
+
+def polygon_from_pairs(text, lat_first=False):
+    """
+    Build a shapely Polygon from a single-ring coordinate list, see parse_pairs.
+    """
+    return shapely.polygons(parse_pairs(text, lat_first))
+
+
+def polygon_rings(polygon):
+    """
+    Return the rings of a shapely Polygon as (N, 2) arrays, exterior first.
+    """
+    return [shapely.get_coordinates(polygon.exterior)] + [
+        shapely.get_coordinates(interior) for interior in polygon.interiors
+    ]
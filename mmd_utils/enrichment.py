@@ -0,0 +1,196 @@
+import json
+import logging
+import sqlite3
+import time
+from datetime import datetime, timezone
+from lxml import etree as ET
+from mmd_utils.extraction_store import serialize_metadata, deserialize_metadata
+from mmd_utils.filename_parser import parse_product_name
+from mmd_utils.mmd_helpers import create_xml
+from mmd_utils.mmd_utils import get_bounding_box
+from mmd_utils.odata_mirror import get_fallback_metadata
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS enrichment (
+    filename TEXT PRIMARY KEY,
+    item TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    polygon BLOB,
+    queued TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    last_error TEXT
+)
+"""
+
+UPSERT = """
+INSERT INTO enrichment (filename, item, metadata, polygon, queued, attempts, not_before, last_error)
+VALUES (?, ?, ?, ?, ?, 0, 0, NULL)
+ON CONFLICT(filename) DO UPDATE SET
+    item = excluded.item,
+    metadata = excluded.metadata,
+    polygon = excluded.polygon,
+    queued = excluded.queued
+"""
+
+# Keys of a work item kept in the queue
+ITEM_KEYS = ('filename', 'filepath', 'mmd_path', 'id')
+
+
+def provisional_metadata(metadata, filename):
+    """
+    Complete local metadata with what the product name gives (the start and
+    end times) and a bounding box from the footprint, so a provisional MMD can
+    be built without OData.
+    """
+    if 'polygon' in metadata and not {'north', 'south', 'east', 'west'}.issubset(metadata):
+        (
+            metadata['north'],
+            metadata['south'],
+            metadata['east'],
+            metadata['west']
+        ) = get_bounding_box(metadata['polygon'])
+    product = parse_product_name(filename)
+    if product is not None and product.start is not None:
+        if 'startDate' not in metadata:
+            metadata['startDate'] = product.start.strftime(DATE_FORMAT)
+        if 'completionDate' not in metadata:
+            stop = product.stop if product.stop is not None else product.start
+            metadata['completionDate'] = stop.strftime(DATE_FORMAT)
+    return metadata
+
+
+class EnrichmentQueue:
+    """
+    Persistent SQLite queue of products written with a provisional MMD, with
+    the local metadata they were built from, so they can be completed from
+    OData later without reading the product files again. Products that are
+    still not found are retried with exponential backoff. Use one queue per
+    node: SQLite on shared storage is not safe for concurrent writers.
+    """
+
+    def __init__(self, db_path, base_delay=300, max_delay=6 * 3600):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def put(self, item, metadata):
+        """
+        Queue a product, or refresh its metadata if it is already queued.
+        """
+        metadata_json, polygon_wkb = serialize_metadata(metadata)
+        with self.conn:
+            self.conn.execute(UPSERT, (
+                item['filename'],
+                json.dumps({key: item.get(key) for key in ITEM_KEYS}),
+                metadata_json,
+                polygon_wkb,
+                datetime.now(timezone.utc).strftime(DATE_FORMAT),
+            ))
+
+    def due(self, limit=None, now=None):
+        """
+        Return (item, local metadata) of the products due for an attempt,
+        longest waiting first.
+        """
+        now = time.time() if now is None else now
+        rows = self.conn.execute(
+            'SELECT item, metadata, polygon FROM enrichment WHERE not_before <= ? ORDER BY not_before, queued LIMIT ?',
+            (now, -1 if limit is None else limit)
+        ).fetchall()
+        return [(json.loads(item), deserialize_metadata(metadata_json, polygon_wkb))
+                for item, metadata_json, polygon_wkb in rows]
+
+    def done(self, filename):
+        with self.conn:
+            self.conn.execute('DELETE FROM enrichment WHERE filename = ?', (filename,))
+
+    def retry(self, filename, error, now=None):
+        """
+        Record a failed attempt and wait longer before the next one.
+        """
+        now = time.time() if now is None else now
+        with self.conn:
+            attempts = self.conn.execute(
+                'SELECT attempts FROM enrichment WHERE filename = ?', (filename,)
+            ).fetchone()
+            if attempts is None:
+                return
+            delay = min(self.base_delay * 2 ** attempts[0], self.max_delay)
+            self.conn.execute(
+                'UPDATE enrichment SET attempts = attempts + 1, not_before = ?, last_error = ? WHERE filename = ?',
+                (now + delay, error, filename)
+            )
+
+    def status(self, now=None):
+        now = time.time() if now is None else now
+        total, due = self.conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(not_before <= ?), 0) FROM enrichment', (now,)
+        ).fetchone()
+        return {'queued': total, 'due': due}
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM enrichment').fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def enrich_item(item, local_metadata, config, mirror=None, odata_url=None, **query_options):
+    """
+    Complete a provisional product from the OData mirror or API, keeping its
+    identifier and the file size and checksum computed from the product file.
+    Returns the work item ready for write_mmd, or None if OData still has no
+    record.
+    """
+    basename = item['filename'].split('.')[0]
+    fallback_options = dict(query_options, odata_url=odata_url) if odata_url else query_options
+    # An empty identifier makes get_fallback_metadata go to OData
+    metadata, _ = get_fallback_metadata(None, None, basename, item['filepath'], mirror, **fallback_options)
+    if not metadata:
+        return None
+    for key in ('size', 'md5_checksum'):
+        if metadata.get(key) is None and local_metadata.get(key) is not None:
+            metadata[key] = local_metadata[key]
+    mmd_xml = create_xml(
+        None, metadata, item['id'], config.global_attributes, config.platform_metadata, config.product_metadata_df,
+        item['filename'], item['filepath'], parent_mapping=config.parent_mapping
+    )
+    return dict(item, metadata=metadata, mmd_bytes=ET.tostring(mmd_xml))
+
+
+def drain(queue, enrich, write, limit=None):
+    """
+    Attempt every product due in the queue: enrich returns the completed work
+    item or None, write writes it. Returns the numbers of products enriched
+    and still pending.
+    """
+    enriched = pending = 0
+    for item, local_metadata in queue.due(limit):
+        try:
+            completed = enrich(item, local_metadata)
+            if completed is None:
+                raise LookupError('No OData record yet')
+            write(completed)
+        except Exception as e:
+            logger.warning(f"Could not enrich {item['filename']} yet. Reason: {e}")
+            queue.retry(item['filename'], str(e))
+            pending += 1
+            continue
+        queue.done(item['filename'])
+        logger.info(f"Enriched {item['mmd_path']}")
+        enriched += 1
+    return enriched, pending
@@ -0,0 +1,206 @@
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+import pandas as pd
+from mmd_utils.config_handling import load_config, save_xml_to_file
+from mmd_utils.mmd_helpers import create_xml
+from mmd_utils.product_metadata import ProductMetadata, as_product_metadata
+
+MMD_NS = {'mmd': 'http://www.met.no/schema/mmd'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS extractions (
+    filename TEXT PRIMARY KEY,
+    id TEXT,
+    filepath TEXT,
+    mmd_path TEXT,
+    metadata TEXT NOT NULL,
+    polygon BLOB,
+    md5_checksum TEXT,
+    file_size_mb REAL,
+    updated TEXT
+)
+"""
+
+UPSERT = """
+INSERT OR REPLACE INTO extractions (filename, id, filepath, mmd_path, metadata, polygon, md5_checksum, file_size_mb, updated)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def serialize_metadata(metadata):
+    """
+    Split the metadata into JSON text and a WKB polygon. Numbers in a
+    ProductMetadata record are already plain int or float (not numpy scalars).
+    """
+    metadata = as_product_metadata(metadata)
+    return json.dumps(metadata.to_dict(polygon=False)), metadata.footprint_wkb
+
+
+def deserialize_metadata(metadata_json, polygon_wkb):
+    metadata = ProductMetadata.from_dict(json.loads(metadata_json))
+    if polygon_wkb is not None:
+        # Kept as WKB, the footprint is only decoded when it is read
+        metadata.footprint_wkb = bytes(polygon_wkb)
+    return metadata
+
+
+class ExtractionStore:
+    """
+    SQLite store of per-product extraction results: the metadata dictionary,
+    the polygon as WKB, the checksum and the file size. MMD files can be
+    re-rendered from the store without opening the source files again.
+    """
+
+    def __init__(self, db_path, commit_every=100):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+        self.commit_every = commit_every
+        self.pending = 0
+
+    def put(self, filename, id, filepath, mmd_path, metadata, mmd_xml):
+        """
+        Store the extraction result of a product. Checksum and file size are read
+        from the MMD element tree, where they have already been computed.
+        """
+        checksum = mmd_xml.find('mmd:storage_information/mmd:checksum', MMD_NS)
+        file_size = mmd_xml.find('mmd:storage_information/mmd:file_size', MMD_NS)
+        metadata_json, polygon_wkb = serialize_metadata(metadata)
+        self.conn.execute(UPSERT, (
+            filename,
+            id,
+            filepath,
+            mmd_path,
+            metadata_json,
+            polygon_wkb,
+            checksum.text if checksum is not None else None,
+            float(file_size.text) if file_size is not None and file_size.text else None,
+            datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        ))
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def iter_rows(self, chunk_size=500):
+        """
+        Yield lists of stored rows, chunk_size rows at a time.
+        """
+        cursor = self.conn.execute(
+            'SELECT filename, id, filepath, mmd_path, metadata, polygon, md5_checksum, file_size_mb FROM extractions'
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM extractions').fetchone()[0]
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def restore_metadata(row):
+    """
+    Rebuild the metadata passed to create_xml from a stored row,
+    with the checksum and size filled in so create_xml does not touch the file.
+    """
+    filename, id, filepath, mmd_path, metadata_json, polygon_wkb, md5_checksum, file_size_mb = row
+    metadata = deserialize_metadata(metadata_json, polygon_wkb)
+    if md5_checksum is not None:
+        metadata['md5_checksum'] = md5_checksum
+    if file_size_mb is not None:
+        metadata['size'] = f'{file_size_mb} MB'
+    return metadata
+
+
+_worker_configs = {}
+
+
+def _init_rerender_worker(script_dir, global_attributes_config, platform_metadata_config, product_metadata_csv, mmd_dir, update):
+    _worker_configs['script_dir'] = script_dir
+    _worker_configs['update'] = update
+    _worker_configs['global_attributes'] = load_config(global_attributes_config)
+    _worker_configs['platform_metadata'] = load_config(platform_metadata_config)
+    _worker_configs['product_metadata_df'] = pd.read_csv(product_metadata_csv)
+    _worker_configs['mmd_dir'] = mmd_dir
+
+
+def _rerender_rows(rows):
+    written = 0
+    unchanged = 0
+    failed = []
+    for row in rows:
+        filename, id, filepath, mmd_path = row[:4]
+        try:
+            metadata = restore_metadata(row)
+            mmd_xml = create_xml(
+                _worker_configs['script_dir'],
+                metadata,
+                id,
+                _worker_configs['global_attributes'],
+                _worker_configs['platform_metadata'],
+                _worker_configs['product_metadata_df'],
+                filename,
+                filepath
+            )
+            if _worker_configs['mmd_dir']:
+                mmd_path = os.path.join(_worker_configs['mmd_dir'], filename.split('.')[0] + '.xml')
+            if os.path.dirname(mmd_path):
+                os.makedirs(os.path.dirname(mmd_path), exist_ok=True)
+            if save_xml_to_file(mmd_xml, mmd_path, update=_worker_configs['update']):
+                written += 1
+            else:
+                unchanged += 1
+        except Exception as e:
+            failed.append((filename, str(e)))
+    return written, unchanged, failed
+
+
+def rerender(store, script_dir, global_attributes_config, platform_metadata_config, product_metadata_csv,
+             mmd_dir=None, workers=None, chunk_size=500, update=False):
+    """
+    Re-create MMD files for every product in the store with create_xml only,
+    across a pool of worker processes. The configuration files are loaded once
+    per worker. Returns the number of MMD files written, the number left
+    unchanged (in update mode) and a list of failures.
+    """
+    totals = [0, 0]
+    failed = []
+
+    def collect(future):
+        chunk_written, chunk_unchanged, chunk_failed = future.result()
+        totals[0] += chunk_written
+        totals[1] += chunk_unchanged
+        failed.extend(chunk_failed)
+
+    workers = workers or os.cpu_count()
+    initargs = (script_dir, global_attributes_config, platform_metadata_config, product_metadata_csv, mmd_dir, update)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_rerender_worker, initargs=initargs) as pool:
+        # Keep a bounded number of chunks in flight so the store is not read into memory at once
+        pending = set()
+        for rows in store.iter_rows(chunk_size):
+            pending.add(pool.submit(_rerender_rows, rows))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+        for future in pending:
+            collect(future)
+    return totals[0], totals[1], failed
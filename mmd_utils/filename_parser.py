@@ -0,0 +1,239 @@
+import os
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import NamedTuple, Optional
+import numpy as np
+import pandas as pd
+
+TIME_FORMAT = '%Y%m%dT%H%M%S'
+
+# One compiled pattern per mission. Group names are shared between the patterns
+# so that single and batch parsing produce the same fields.
+PATTERNS = {
+    'S1': re.compile(
+        r'^(?P<platform>S1[A-D])_(?P<mode>[A-Z0-9]{2})_(?P<type>[A-Z_]{4})_'
+        r'(?P<level>[0-9])(?P<product_class>[A-Z])(?P<polarisation>[A-Z]{2})_'
+        r'(?P<start>\d{8}T\d{6})_(?P<stop>\d{8}T\d{6})_(?P<orbit>\d{6})_'
+        r'(?P<datatake>[0-9A-F]{6})_(?P<unique_id>[0-9A-F]{4})'
+    ),
+    'S2': re.compile(
+        r'^(?P<platform>S2[A-D])_(?P<type>MSI[A-Z0-9_]{3})_(?P<start>\d{8}T\d{6})_'
+        r'(?P<baseline>N\d{4})_R(?P<relative_orbit>\d{3})_T(?P<tile>[0-9A-Z]{5})_'
+        r'(?P<discriminator>\d{8}T\d{6})'
+    ),
+    'S3': re.compile(
+        r'^(?P<platform>S3[A-D_])_(?P<type>(?P<mode>[A-Z]{2})_(?P<level>[0-9])_[A-Z0-9_]{6})_'
+        r'(?P<start>\d{8}T\d{6})_(?P<stop>\d{8}T\d{6})_(?P<creation>\d{8}T\d{6})_'
+        r'(?P<instance>.{9}(?P<relative_orbit>.{3}).{5})_(?P<centre>[A-Z0-9_]{3})_'
+        r'(?P<product_class>[A-Z_])_(?P<timeliness>[A-Z_]{2})_(?P<baseline>[A-Z0-9_]{3})'
+    ),
+    'S5': re.compile(
+        r'^(?P<platform>S5P)_(?P<timeliness>[A-Z]{4})_(?P<type>[A-Z0-9_]{10})_'
+        r'(?P<start>\d{8}T\d{6})_(?P<stop>\d{8}T\d{6})_(?P<orbit>\d{5})_'
+        r'(?P<baseline>\d{2})_(?P<processor>\d{6})_(?P<production>\d{8}T\d{6})'
+    ),
+}
+
+FIELDS = [
+    'name', 'mission', 'platform', 'mode', 'product_type', 'start', 'stop',
+    'orbit', 'relative_orbit', 'timeliness', 'baseline'
+]
+
+
+class ProductName(NamedTuple):
+    """
+    Fields decoded from a Sentinel product name.
+    product_type is the ESA product type alias used in product_types.csv.
+    """
+    name: str
+    mission: str
+    platform: str
+    mode: Optional[str]
+    product_type: str
+    start: datetime
+    stop: Optional[datetime]
+    orbit: Optional[int]
+    relative_orbit: Optional[int]
+    timeliness: Optional[str]
+    baseline: Optional[str]
+
+
+def strip_product_name(filename):
+    """
+    Return the product name without directory and suffixes (.zip, .SAFE, .nc, ...).
+    """
+    return os.path.basename(filename).split('.')[0]
+
+
+def _product_type_alias(mission, groups):
+    if mission == 'S1':
+        # Stripmap products are catalogued with the full type, e.g. S1_GRDH_1S
+        if groups['mode'].startswith('S'):
+            return f"{groups['mode']}_{groups['type']}_{groups['level']}{groups['product_class']}"
+        return f"{groups['mode']}_{groups['type'].rstrip('_')}"
+    return groups['type']
+
+
+def _to_int(value):
+    if value is None or not value.isdigit():
+        return None
+    return int(value)
+
+
+def _to_time(value):
+    if value is None:
+        return None
+    return datetime.strptime(value, TIME_FORMAT)
+
+
+@lru_cache(maxsize=65536)
+def parse_product_name(filename):
+    """
+    Parse a Sentinel product name or path into a ProductName.
+    Returns None if the name does not follow a known naming convention.
+    Results are memoized, as the same name is decoded several times per product.
+    """
+    name = strip_product_name(filename)
+    mission = name[0:2]
+    pattern = PATTERNS.get(mission)
+    if pattern is None:
+        return None
+    match = pattern.match(name)
+    if match is None:
+        return None
+    groups = match.groupdict()
+
+    return ProductName(
+        name=name,
+        mission=mission,
+        platform=groups['platform'].rstrip('_'),
+        mode=groups.get('mode'),
+        product_type=_product_type_alias(mission, groups),
+        start=_to_time(groups['start']),
+        stop=_to_time(groups.get('stop')),
+        orbit=_to_int(groups.get('orbit')),
+        relative_orbit=_to_int(groups.get('relative_orbit')),
+        timeliness=groups.get('timeliness'),
+        baseline=groups.get('baseline'),
+    )
+
+
+def _column(chars, start, stop):
+    """
+    Return a fixed-width byte string column from the character matrix.
+    """
+    return np.ascontiguousarray(chars[:, start:stop]).view(f'S{stop - start}').ravel()
+
+
+def _int_column(chars, start, stop):
+    digits = chars[:, start:stop].astype(np.int64) - ord('0')
+    valid = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    values = digits @ (10 ** np.arange(stop - start - 1, -1, -1))
+    return pd.arrays.IntegerArray(np.where(valid, values, 0), mask=~valid)
+
+
+def _time_column(chars, start):
+    # Rearrange YYYYMMDDTHHMMSS into YYYY-MM-DDTHH:MM:SS and let numpy parse it
+    iso = np.full((len(chars), 19), ord('-'), dtype=np.uint8)
+    iso[:, 0:4] = chars[:, start:start + 4]
+    iso[:, 5:7] = chars[:, start + 4:start + 6]
+    iso[:, 8:10] = chars[:, start + 6:start + 8]
+    iso[:, 10] = ord('T')
+    iso[:, 11:13] = chars[:, start + 9:start + 11]
+    iso[:, 13] = ord(':')
+    iso[:, 14:16] = chars[:, start + 11:start + 13]
+    iso[:, 16] = ord(':')
+    iso[:, 17:19] = chars[:, start + 13:start + 15]
+    return iso.view('S19').ravel().astype('datetime64[s]')
+
+
+# Fixed-width layout of each naming convention, used by the batch parser.
+# Positions are (start, stop) offsets into the product name.
+LAYOUTS = {
+    'S1': {
+        'length': 67, 'separators': [3, 6, 11, 16, 32, 48, 55, 62],
+        'platform': (0, 3), 'mode': (4, 6), 'start': (17, 32), 'stop': (33, 48), 'orbit': (49, 55),
+    },
+    'S2': {
+        'length': 60, 'separators': [3, 10, 26, 32, 37, 44],
+        'platform': (0, 3), 'product_type': (4, 10), 'start': (11, 26), 'baseline': (27, 32),
+        'relative_orbit': (34, 37),
+    },
+    'S3': {
+        'length': 94, 'separators': [3, 15, 31, 47, 63, 81, 85, 87, 90],
+        'platform': (0, 3), 'mode': (4, 6), 'product_type': (4, 15), 'start': (16, 31), 'stop': (32, 47),
+        'relative_orbit': (73, 76), 'timeliness': (88, 90), 'baseline': (91, 94),
+    },
+    'S5': {
+        'length': 83, 'separators': [3, 8, 19, 35, 51, 57, 60, 67],
+        'platform': (0, 3), 'timeliness': (4, 8), 'product_type': (9, 19), 'start': (20, 35),
+        'stop': (36, 51), 'orbit': (52, 57), 'baseline': (58, 60),
+    },
+}
+
+
+def parse_product_names(filenames):
+    """
+    Parse many product names at once into a columnar pandas DataFrame with the
+    ProductName fields as columns. Intended for archive listings with millions
+    of entries, so names are decoded with fixed-width slicing of a byte matrix
+    instead of one regex match per name. Only the length and separators of each
+    naming convention are checked; names that do not fit have a missing mission.
+    """
+    names = [filename.rpartition('/')[2].partition('.')[0] for filename in filenames]
+    count = len(names)
+    lengths = np.fromiter(map(len, names), dtype=np.int64, count=count)
+    encoded = np.array(names, dtype='S') if count else np.empty(0, dtype='S1')
+    width = encoded.dtype.itemsize
+    chars = encoded.view(np.uint8).reshape(count, width)
+
+    result = pd.DataFrame({'name': pd.Series(names, dtype=object)})
+    for field in FIELDS[1:]:
+        result[field] = pd.Series(None, index=result.index, dtype=object)
+    result['start'] = pd.Series(pd.NaT, index=result.index, dtype='datetime64[s]')
+    result['stop'] = pd.Series(pd.NaT, index=result.index, dtype='datetime64[s]')
+    for field in ['orbit', 'relative_orbit']:
+        result[field] = pd.arrays.IntegerArray(np.zeros(count, dtype=np.int64), mask=np.ones(count, dtype=bool))
+
+    for mission, layout in LAYOUTS.items():
+        if width < layout['length']:
+            continue
+        rows = (
+            (chars[:, 0] == ord(mission[0]))
+            & (chars[:, 1] == ord(mission[1]))
+            & (lengths == layout['length'])
+        )
+        for position in layout['separators']:
+            rows &= chars[:, position] == ord('_')
+        index = np.flatnonzero(rows)
+        if len(index) == 0:
+            continue
+        subset = chars[index]
+
+        result.loc[index, 'mission'] = mission
+        result.loc[index, 'platform'] = np.char.rstrip(_column(subset, *layout['platform']), b'_').astype('U')
+
+        if mission == 'S1':
+            # Stripmap products are catalogued with the full type, e.g. S1_GRDH_1S
+            stripmap = subset[:, 4] == ord('S')
+            alias = np.where(
+                stripmap,
+                _column(subset, 4, 14),
+                np.char.rstrip(_column(subset, 4, 11), b'_')
+            )
+            result.loc[index, 'product_type'] = alias.astype('U')
+        else:
+            result.loc[index, 'product_type'] = _column(subset, *layout['product_type']).astype('U')
+
+        for field in ['mode', 'timeliness', 'baseline']:
+            if field in layout:
+                result.loc[index, field] = _column(subset, *layout[field]).astype('U')
+        for field in ['start', 'stop']:
+            if field in layout:
+                result.loc[index, field] = _time_column(subset, layout[field][0])
+        for field in ['orbit', 'relative_orbit']:
+            if field in layout:
+                result.loc[index, field] = _int_column(subset, *layout[field])
+
+    return result
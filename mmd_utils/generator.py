@@ -0,0 +1,168 @@
+import collections
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from lxml import etree as ET
+from mmd_utils.config_handling import load_config
+from mmd_utils.metadata_extraction import ODATA_URL, extract_metadata, get_odata_product
+from mmd_utils.mmd_helpers import (
+    create_xml,
+    fill_storage_information,
+    generate_nbs_id,
+    load_parent_mapping,
+    parent_mapping_file,
+)
+from mmd_utils.odata_mirror import get_fallback_metadata, get_mirror_record, open_mirror
+from mmd_utils.odata_sync import archive_filename, record_metadata
+from mmd_utils.remote_access import is_remote
+
+PARENT_MAPPING_CONFIG = parent_mapping_file(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_thread_state = threading.local()
+# Every mirror connection opened by _mirror, so close_mirrors can close them from any thread
+_open_mirrors = []
+_mirrors_lock = threading.Lock()
+_mirrors_generation = 0
+
+
+class MMDConfig:
+    """
+    The configuration MMD files are generated from, loaded once and shared
+    read-only by all calls and threads.
+    """
+
+    def __init__(self, global_attributes, platform_metadata, product_metadata_df, parent_mapping):
+        self.global_attributes = global_attributes
+        self.platform_metadata = platform_metadata
+        self.product_metadata_df = product_metadata_df
+        self.parent_mapping = parent_mapping
+
+    @classmethod
+    def load(cls, global_attributes_config, platform_metadata_config, product_metadata_csv,
+             parent_mapping_config=PARENT_MAPPING_CONFIG):
+        return cls(
+            load_config(global_attributes_config),
+            load_config(platform_metadata_config),
+            pd.read_csv(product_metadata_csv),
+            load_parent_mapping(parent_mapping_config),
+        )
+
+
+def _mirror(odata_mirror):
+    # One connection per thread and mirror, as SQLite connections are not shared between threads
+    if not odata_mirror:
+        return None
+    mirrors = getattr(_thread_state, 'mirrors', None)
+    if mirrors is None or _thread_state.generation != _mirrors_generation:
+        # Connections of this thread were closed by close_mirrors
+        mirrors = _thread_state.mirrors = {}
+        _thread_state.generation = _mirrors_generation
+    if odata_mirror not in mirrors:
+        conn = open_mirror(odata_mirror, read_only=True, check_same_thread=False)
+        with _mirrors_lock:
+            _open_mirrors.append(conn)
+        mirrors[odata_mirror] = conn
+    return mirrors[odata_mirror]
+
+
+def close_mirrors():
+    """
+    Close the OData mirror connections opened by all threads. Later calls
+    open new ones, so call this once the generator is no longer used.
+    """
+    global _mirrors_generation
+    with _mirrors_lock:
+        _mirrors_generation += 1
+        while _open_mirrors:
+            _open_mirrors.pop().close()
+
+
+def product_metadata(product, create_id=False, odata_mirror=None, odata_url=ODATA_URL, swath_footprint=False):
+    """
+    Return the filename, file path, metadata and identifier of a product given
+    as an expanded OData record (a dictionary), a path or URL of the product
+    file, or a product name. Metadata is read from the file if there is one,
+    falling back to the OData mirror and API, and otherwise taken from the
+    product's OData record, without a file size.
+    """
+    mirror = _mirror(odata_mirror)
+    if isinstance(product, dict):
+        record = product
+    elif is_remote(product) or os.path.exists(product):
+        filename = os.path.basename(product)
+        basename = filename.split('.')[0]
+        id = generate_nbs_id(filename) if create_id else None
+        metadata, id = extract_metadata(filename, product, None, id, swath_footprint)
+        metadata, id = get_fallback_metadata(metadata, id, basename, product, mirror, odata_url)
+        if not metadata:
+            raise ValueError(f"No metadata found for {filename}")
+        fill_storage_information(metadata, product)
+        return filename, product, metadata, id
+    else:
+        basename = os.path.basename(product).split('.')[0]
+        record = get_mirror_record(mirror, basename) if mirror else None
+        if record is None:
+            record = get_odata_product(basename, odata_url)
+        if record is None:
+            raise ValueError(f"No OData record found for {product}")
+
+    filename = archive_filename(record['Name'])
+    metadata, id = record_metadata(record)
+    if create_id:
+        id = generate_nbs_id(filename)
+    return filename, filename, metadata, id
+
+
+def build_mmd(config, product, create_id=False, odata_mirror=None, odata_url=ODATA_URL, swath_footprint=False):
+    """
+    Build the MMD element of a product (an OData record, a file path or URL, or
+    a product name, see product_metadata) from a preloaded MMDConfig. Nothing
+    is written, and calls may run concurrently on threads.
+    """
+    filename, filepath, metadata, id = product_metadata(product, create_id, odata_mirror, odata_url, swath_footprint)
+    return create_xml(
+        None, metadata, id, config.global_attributes, config.platform_metadata, config.product_metadata_df,
+        filename, filepath, parent_mapping=config.parent_mapping, read_file=False
+    )
+
+
+def serialize_mmd(mmd_xml):
+    """
+    The bytes of an MMD element as written to MMD files.
+    """
+    return ET.tostring(mmd_xml, encoding='UTF-8', xml_declaration=True, pretty_print=True)
+
+
+def build_mmd_bytes(config, product, **options):
+    """
+    Build the MMD of a product as the bytes of an MMD file, see build_mmd.
+    """
+    return serialize_mmd(build_mmd(config, product, **options))
+
+
+def build_mmd_batch(config, products, workers=8, serialize=True, **options):
+    """
+    Build the MMD of each product of an iterable on a pool of threads, and
+    yield (product, MMD, error) in input order: the MMD as bytes (or the
+    element, without serialize) and None, or None and the exception raised.
+    Products are consumed as results are yielded, so the iterable may be long.
+    """
+    build = build_mmd_bytes if serialize else build_mmd
+
+    def build_one(product):
+        try:
+            return build(config, product, **options), None
+        except Exception as e:
+            return None, e
+
+    in_flight = collections.deque()
+    with ThreadPoolExecutor(workers) as executor:
+        for product in products:
+            in_flight.append((product, executor.submit(build_one, product)))
+            if len(in_flight) >= 2 * workers:
+                done, future = in_flight.popleft()
+                yield (done, *future.result())
+        while in_flight:
+            done, future = in_flight.popleft()
+            yield (done, *future.result())
@@ -0,0 +1,136 @@
+import io
+import os
+import threading
+import time
+
+MB = 1024 * 1024
+CHUNK_SIZE = MB
+# Drop hashed pages from the page cache in steps of this size
+DONTNEED_STEP = 64 * MB
+
+
+class TokenBucket:
+    """
+    Token bucket limiting a byte rate. A read larger than the available tokens
+    puts the bucket in debt and the reader sleeps until it is paid off, so
+    concurrent readers share the rate without busy waiting.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class IOBudget:
+    """
+    Read budget of this process: an overall rate shared by all threads and a
+    rate for each thread (worker), in MB/s, and whether to give the kernel
+    posix_fadvise hints when reading product files sequentially.
+    """
+
+    def __init__(self, total_mb_per_s=None, worker_mb_per_s=None, fadvise=False):
+        self.total = TokenBucket(total_mb_per_s * MB) if total_mb_per_s else None
+        self.worker_rate = worker_mb_per_s * MB if worker_mb_per_s else None
+        self.workers = threading.local()
+        self.fadvise = fadvise and hasattr(os, 'posix_fadvise')
+
+    @property
+    def limited(self):
+        return self.total is not None or self.worker_rate is not None
+
+    def consume(self, amount):
+        if self.worker_rate:
+            bucket = getattr(self.workers, 'bucket', None)
+            if bucket is None:
+                bucket = self.workers.bucket = TokenBucket(self.worker_rate)
+            bucket.consume(amount)
+        if self.total is not None:
+            self.total.consume(amount)
+
+
+_budget = IOBudget()
+
+
+def configure_io(total_mb_per_s=None, worker_mb_per_s=None, fadvise=False):
+    """
+    Set the read budget of this process. Without limits reads are not throttled.
+    """
+    global _budget
+    _budget = IOBudget(total_mb_per_s, worker_mb_per_s, fadvise)
+
+
+class ThrottledFileIO(io.FileIO):
+    """
+    File whose reads are charged to the process read budget.
+    """
+
+    def readinto(self, buffer):
+        count = super().readinto(buffer)
+        if count:
+            _budget.consume(count)
+        return count
+
+    def readall(self):
+        data = super().readall()
+        _budget.consume(len(data))
+        return data
+
+
+def open_throttled(path):
+    """
+    Open a local file for binary reading, throttled if a read budget is set.
+    """
+    if not _budget.limited:
+        return open(path, 'rb')
+    return io.BufferedReader(ThrottledFileIO(path, 'r'))
+
+
+def _fadvise(fd, offset, length, advice):
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        # Not supported on this file system
+        pass
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """
+    Yield the content of a file in chunks, sequentially, within the read budget.
+    With fadvise enabled the kernel is told the file is read sequentially, and
+    pages already read are dropped from the page cache, so hashing a whole
+    archive does not evict the data other services are serving.
+    """
+    budget = _budget
+    with open(path, 'rb', buffering=0) as f:
+        fd = f.fileno()
+        if budget.fadvise:
+            _fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        dropped = 0
+        offset = 0
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            if budget.limited:
+                budget.consume(len(chunk))
+            offset += len(chunk)
+            if budget.fadvise and offset - dropped >= DONTNEED_STEP:
+                _fadvise(fd, dropped, offset - dropped, os.POSIX_FADV_DONTNEED)
+                dropped = offset
+            yield chunk
+        if budget.fadvise and offset > dropped:
+            _fadvise(fd, dropped, offset - dropped, os.POSIX_FADV_DONTNEED)
+
@@ -0,0 +1,89 @@
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+
+class RunJournal:
+    """
+    Append-only JSONL journal of per-product outcomes of a batch run.
+    Records are written as they happen and fsynced in groups, every
+    fsync_every records or fsync_seconds seconds, so a crash loses at most
+    one group of records.
+    """
+
+    def __init__(self, journal_path, fsync_every=100, fsync_seconds=5):
+        self.journal_path = journal_path
+        self.fh = open(journal_path, 'a', encoding='utf-8')
+        if self.fh.tell() > 0:
+            with open(journal_path, 'rb') as existing:
+                existing.seek(-1, os.SEEK_END)
+                if existing.read(1) != b'\n':
+                    # Terminate a record left partly written by a crash
+                    self.fh.write('\n')
+        self.fsync_every = fsync_every
+        self.fsync_seconds = fsync_seconds
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def record(self, item, status, reason=None):
+        entry = {
+            'filename': item['filename'],
+            'mmd_path': item.get('mmd_path'),
+            'status': status,
+            'time': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        }
+        if reason is not None:
+            entry['reason'] = reason
+        self.fh.write(json.dumps(entry) + '\n')
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every or time.monotonic() - self.last_sync >= self.fsync_seconds:
+            self.sync()
+
+    def sync(self):
+        self.fh.flush()
+        os.fsync(self.fh.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def load_journal(journal_path):
+    """
+    Read a journal into a dictionary of the last outcome per filename.
+    A partly written last line from a crash is ignored.
+    """
+    outcomes = {}
+    if not os.path.exists(journal_path):
+        return outcomes
+    with open(journal_path, 'r', encoding='utf-8') as fh:
+        for line in fh:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            outcomes[entry['filename']] = entry['status']
+    return outcomes
+
+
+def filter_worklist(items, outcomes, retry_failed=False):
+    """
+    Skip work items that already have an outcome in the journal.
+    With retry_failed, only yield the items whose last outcome was a failure.
+    """
+    for item in items:
+        status = outcomes.get(item['filename'])
+        if retry_failed:
+            if status == 'failed':
+                yield item
+        elif status is None:
+            yield item
@@ -0,0 +1,187 @@
+import json
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = ' \t\n\r'
+
+
+class _Reader:
+    """
+    Buffered reader for decoding JSON values one at a time from a large file.
+    The buffer only holds the value being decoded plus one chunk.
+    """
+
+    def __init__(self, fh, chunk_size=CHUNK_SIZE):
+        self.fh = fh
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        # Offset in the file of the start of the buffer
+        self.offset = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.fh.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop what has been consumed before growing the buffer
+        self.offset += self.pos
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Return the next non-whitespace character without consuming it, or '' at the end.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def tell(self):
+        """
+        Return the offset in the file of the current position.
+        """
+        return self.offset + self.pos
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos} of the JSON buffer")
+        self.pos += 1
+
+    def value(self):
+        """
+        Decode the next JSON value, reading more of the file until it is complete.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk,
+            # e.g. 1500 of 1500.25
+            number = isinstance(value, (int, float)) and not isinstance(value, bool)
+            if (number and not self.eof and (end == len(self.buffer) or self.buffer[end] in '.eE')
+                    and self._fill()):
+                continue
+            self.pos = end
+            return value
+
+    def array(self):
+        """
+        Yield (element, start, end) for the elements of the JSON array at the
+        current position, with the offsets of each element in the file.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            self.peek()
+            start = self.tell()
+            yield self.value(), start, self.tell()
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect(']')
+            return
+
+
+def _object_records(reader):
+    # An object is either a response page, whose 'value' array is streamed,
+    # or a single record, which is collected key by key
+    reader.peek()
+    start = reader.tell()
+    reader.expect('{')
+    record = {}
+    paged = False
+    if reader.peek() == '}':
+        reader.pos += 1
+    else:
+        while True:
+            key = reader.value()
+            reader.expect(':')
+            if key == 'value' and reader.peek() == '[':
+                paged = True
+                yield from reader.array()
+            else:
+                record[key] = reader.value()
+            if reader.peek() == ',':
+                reader.pos += 1
+                continue
+            reader.expect('}')
+            break
+    if not paged:
+        yield record, start, reader.tell()
+
+
+def _reader_records(reader):
+    # (record, start, end) for each record of the top-level values, in turn
+    while True:
+        first = reader.peek()
+        if first == '':
+            return
+        if first == '[':
+            yield from reader.array()
+        elif first == '{':
+            yield from _object_records(reader)
+        else:
+            raise ValueError(f"Unexpected '{first}' at offset {reader.tell()} of the JSON file, expected a record")
+
+
+def iter_json_records(json_path, chunk_size=CHUNK_SIZE):
+    """
+    Yield OData product records from a JSON or JSONL file without loading it
+    into memory. Supports a single expanded record, an OData response page
+    ({"value": [...]}), a JSON array of records, or JSONL with one record per
+    line. Files with several top-level values, such as JSONL without the
+    .jsonl extension, yield the records of each value in turn.
+    """
+    with open(json_path, 'r', encoding='utf-8') as fh:
+        if json_path.endswith('.jsonl'):
+            for line in fh:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+            return
+
+        for record, _, _ in _reader_records(_Reader(fh, chunk_size)):
+            yield record
+
+
+def iter_json_record_offsets(json_path, chunk_size=CHUNK_SIZE):
+    """
+    Yield (record, start, end) for the records of a JSON or JSONL file (see
+    iter_json_records), with the byte offsets of each record in the file, to
+    be read again with read_json_record. Only ASCII values of the records, such
+    as the product name, are decoded correctly.
+    """
+    if json_path.endswith('.jsonl'):
+        with open(json_path, 'rb') as fh:
+            start = 0
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line), start, start + len(line)
+                start += len(line)
+        return
+
+    # Latin-1 maps each byte to one character, so character offsets are byte offsets
+    with open(json_path, 'r', encoding='latin-1') as fh:
+        yield from _reader_records(_Reader(fh, chunk_size))
+
+
+def read_json_record(json_path, start, end):
+    """
+    Read the record between byte offsets given by iter_json_record_offsets.
+    """
+    with open(json_path, 'rb') as fh:
+        fh.seek(start)
+        return json.loads(fh.read(end - start))
@@ -1,6 +1,6 @@
+import logging
 import requests
 import zipfile
-import json
 import h5py
 from lxml import etree as ET
 import os
@@ -9,39 +9,46 @@ import pandas as pd
 import uuid
 import random
 import time
-from shapely.geometry import Polygon
+from mmd_utils.coordinates import polygon_from_pairs
 from mmd_utils.mmd_utils import extract_polygon, get_bounding_box
+from mmd_utils.remote_access import open_source
+from mmd_utils.filename_parser import parse_product_name
+from mmd_utils.json_stream import iter_json_records
+from mmd_utils.product_metadata import ProductMetadata
+from mmd_utils.swath_footprint import read_swath_footprint
 
-def generate_http_url(filepath, product_type):
+logger = logging.getLogger(__name__)
 
-    filename = os.path.basename(filepath)
+ODATA_URL = "https://catalogue.dataspace.copernicus.eu/odata/v1/Products"
 
-    root_path = "https://nbstds.met.no/thredds/fileServer/nbsArchive/"
-    platform = filename.split('_')[0]
-    mission = filename[0:2]
-
-    if mission == 'S1':
-        date = filename[17:25]
-        mode = filename[4:6]
-    elif mission == 'S2':
-        date = filename[11:19]
-    elif mission == 'S3':
-        date = filename[16:24]
-    elif mission == 'S5':
-        date = filename[20:28]
-
-    year = date[:4]
-    month = date[4:6]
-    day = date[6:]
-
-    if mission in ['S3', 'S5']:
-        url = f'{root_path}{platform}/{year}/{month}/{day}/{product_type}/{filename}'
-    elif mission == 'S1':
-        url = f'{root_path}{platform}/{year}/{month}/{day}/{mode}/{filename}'
-    elif mission == 'S2':
-        url = f'{root_path}{platform}/{year}/{month}/{day}/{filename}'
+def archive_relative_path(filename, product_type):
+    '''
+    Path of a product file relative to the root of the NBS archive
+    '''
 
-    return url
+    product = parse_product_name(filename)
+    if product is None:
+        raise ValueError(f'Could not parse product name: {filename}')
+
+    platform = product.platform
+    date = product.start
+
+    year = f'{date.year:04d}'
+    month = f'{date.month:02d}'
+    day = f'{date.day:02d}'
+
+    if product.mission in ['S3', 'S5']:
+        return f'{platform}/{year}/{month}/{day}/{product_type}/{filename}'
+    elif product.mission == 'S1':
+        return f'{platform}/{year}/{month}/{day}/{product.mode}/{filename}'
+    elif product.mission == 'S2':
+        return f'{platform}/{year}/{month}/{day}/{filename}'
+    raise ValueError(f'No archive layout for mission {product.mission}')
+
+def generate_http_url(filepath, product_type):
+
+    root_path = "https://nbstds.met.no/thredds/fileServer/nbsArchive/"
+    return root_path + archive_relative_path(os.path.basename(filepath), product_type)
 
 def generate_opendap_url(filepath, product_type):
     '''
@@ -51,14 +58,17 @@ def generate_opendap_url(filepath, product_type):
     '''
 
     filename = os.path.basename(filepath)
+    product = parse_product_name(filename)
+    if product is None:
+        raise ValueError(f'Could not parse product name: {filename}')
 
     root_path = "https://nbstds.met.no/thredds/dodsC/NBS/"
-    platform = filename.split('_')[0]
-    date = filename[20:28]
+    platform = product.platform
+    date = product.start
 
-    year = date[:4]
-    month = date[4:6]
-    day = date[6:]
+    year = f'{date.year:04d}'
+    month = f'{date.month:02d}'
+    day = f'{date.day:02d}'
     url = f'{root_path}{platform}/{year}/{month}/{day}/{product_type}/{filename}'
 
     return url
@@ -85,31 +95,32 @@ def is_valid_id(identifier: str) -> bool:
 
     return False
 
-def check_metadata(metadata: dict, id: str) -> bool:
+REQUIRED_FIELDS = ("north", "south", "east", "west", "orbitNumber", "completionDate", "startDate")
+
+def check_metadata(metadata: ProductMetadata, id: str) -> bool:
     """
-    Checks if the metadata dictionary contains the required keys
+    Checks if the metadata has the required fields
     and if the id variable is a valid UUID.
 
     Parameters:
-    metadata (dict): The metadata dictionary to check.
+    metadata (ProductMetadata): The metadata to check.
     id (str): The identifier to validate as a UUID.
 
     Returns:
     bool: True if all checks pass, False otherwise.
     """
     if not id:
-        print("Missing ID")
+        logger.info("Missing ID")
         return False
     if not metadata:
-        print("No metadata found")
+        logger.info("No metadata found")
         return False
 
-    required_keys = {"north", "south", "east", "west", "orbitNumber", "completionDate", "startDate"}
-
-    missing_keys = required_keys - metadata.keys()  # Find keys that are in required_keys but not in metadata
+    # Presence checks only, no values are read
+    missing_keys = [key for key in REQUIRED_FIELDS if key not in metadata]
 
     if missing_keys:
-        print("Missing keys:", missing_keys)
+        logger.info("Missing keys: %s", missing_keys)
         return False
 
     # Check if id is a valid UUID
@@ -117,10 +128,10 @@ def check_metadata(metadata: dict, id: str) -> bool:
         if is_valid_id(id):
             return True
         else:
-            print("Invalid ID")
+            logger.info("Invalid ID")
             return False
     except ValueError:
-        print("Invalid ID")
+        logger.info("Invalid ID")
         return False
 
 def get_product_metadata(product_metadata_df, esa_product_type):
@@ -159,6 +170,11 @@ def get_collection_from_filename(filename):
         raise ValueError('Unknown filename prefix; unable to determine collection')
 
 def get_metadata_from_safe(zip_file):
+    '''
+    Extract metadata from the manifest of a zipped SAFE product.
+    zip_file can be a local path or an HTTP(S) URL, in which case only the
+    zip central directory and the members that are read are fetched.
+    '''
 
     base = os.path.basename(zip_file)
     source_file = base.split('.')[0] + '.SAFE'
@@ -166,10 +182,10 @@ def get_metadata_from_safe(zip_file):
     xml_file = 'manifest.safe'
     xml_file_path = os.path.join(source_file, xml_file)
 
-    metadata = {}
+    metadata = ProductMetadata()
 
     # Open the ZIP file and read the manifest.safe file
-    with zipfile.ZipFile(zip_file, 'r') as z:
+    with open_source(zip_file) as fh, zipfile.ZipFile(fh, 'r') as z:
         if xml_file_path in z.namelist():
             with z.open(xml_file_path) as f:
 
@@ -210,22 +226,9 @@ def get_metadata_from_safe(zip_file):
                 gml_element = root.xpath("//gml:coordinates", namespaces=namespaces)
                 if gml_element:
                     coords_str = gml_element[0].text
-                    if base.startswith('S2'):
-                        # coordinates in S2 are space separated, e.g. lat lon lat lon lat lon
-                        # Split into floats
-                        numbers = list(map(float, coords_str.split()))
-
-                        # Group into (lon, lat) tuples
-                        coords = [(numbers[i+1], numbers[i]) for i in range(0, len(numbers), 2)]
-
-                    elif base.startswith('S1'):
-                        pairs = coords_str.split()
-
-                        # Convert to (lon, lat) tuples
-                        coords = [(float(lon), float(lat)) for lat, lon in (pair.split(",") for pair in pairs)]
-
-                    # Create Shapely Polygon
-                    metadata['polygon'] = Polygon(coords)
+                    # coordinates are lat,lon pairs in S1 and space separated in S2,
+                    # e.g. lat lon lat lon; both are parsed into (lon, lat) in one pass
+                    metadata['polygon'] = polygon_from_pairs(coords_str, lat_first=True)
 
                     try:
                         (
@@ -235,7 +238,7 @@ def get_metadata_from_safe(zip_file):
                             metadata['west']
                         ) = get_bounding_box(metadata['polygon'])
                     except:
-                        print('Failed to compute bounding box from GML')
+                        logger.warning('Failed to compute bounding box from GML')
 
                 if base.startswith('S1'):
 
@@ -271,19 +274,23 @@ def get_metadata_from_safe(zip_file):
     return metadata
 
 def get_metadata_from_sen3(sen3_file):
-
-    zip_file = sen3_file.split('.')[0] + '.zip'
+    '''
+    Extract metadata from the manifest of a zipped SEN3 product.
+    sen3_file can be a local path or an HTTP(S) URL.
+    '''
 
     base = os.path.basename(sen3_file)
     source_file = base.split('.')[0] + '.SEN3'
 
+    zip_file = os.path.join(os.path.dirname(sen3_file), base.split('.')[0] + '.zip')
+
     xml_file = 'xfdumanifest.xml'
     xml_file_path = os.path.join(source_file, xml_file)
 
-    metadata = {}
+    metadata = ProductMetadata()
 
     # Open the ZIP file and read the manifest.safe file
-    with zipfile.ZipFile(zip_file, 'r') as z:
+    with open_source(zip_file) as fh, zipfile.ZipFile(fh, 'r') as z:
         if xml_file_path in z.namelist():
             with z.open(xml_file_path) as f:
                 tree = ET.parse(f)
@@ -313,14 +320,8 @@ def get_metadata_from_sen3(sen3_file):
                 gml_element = root.xpath("//gml:posList", namespaces=namespaces)
                 if gml_element:
                     coords_str = gml_element[0].text
-                    # Split into floats
-                    numbers = list(map(float, coords_str.split()))
-
-                    # Group into (lon, lat) tuples
-                    coords = [(numbers[i+1], numbers[i]) for i in range(0, len(numbers), 2)]
-
-                    # Create Shapely Polygon
-                    metadata['polygon'] = Polygon(coords)
+                    # posList is space separated, e.g. lat lon lat lon
+                    metadata['polygon'] = polygon_from_pairs(coords_str, lat_first=True)
                     try:
                         (
                             metadata['north'],
@@ -329,7 +330,7 @@ def get_metadata_from_sen3(sen3_file):
                             metadata['west']
                         ) = get_bounding_box(metadata['polygon'])
                     except:
-                        print('Failed to compute bounding box from GML')
+                        logger.warning('Failed to compute bounding box from GML')
 
                 cloud_cover_element = root.xpath("//sentinel3:cloudyPixels", namespaces=namespaces)
                 if cloud_cover_element:
@@ -337,10 +338,18 @@ def get_metadata_from_sen3(sen3_file):
 
     return metadata
 
-def get_metadata_from_netcdf(netcdf_file):
+def get_metadata_from_netcdf(netcdf_file, footprint=False):
+    '''
+    Extract metadata from the global attributes of a NetCDF product.
+    netcdf_file can be a local path or an HTTP(S) URL. With footprint, the
+    footprint is derived from the swath edges in the geolocation arrays.
+    '''
 
-    with h5py.File(netcdf_file, "r") as f:
+    polygon = None
+    with open_source(netcdf_file) as fh, h5py.File(fh, "r") as f:
         global_attrs = dict(f.attrs)
+        if footprint:
+            polygon = read_swath_footprint(f)
 
     mapping = {
         'startDate': 'time_coverage_start',
@@ -352,7 +361,7 @@ def get_metadata_from_netcdf(netcdf_file):
         'orbitNumber': 'orbit'
     }
 
-    metadata = {}
+    metadata = ProductMetadata()
 
     for key, val in mapping.items():
         if val in global_attrs.keys():
@@ -365,43 +374,80 @@ def get_metadata_from_netcdf(netcdf_file):
         else:
             pass
 
+    if polygon is not None:
+        metadata['polygon'] = polygon
+        if not {'north', 'south', 'east', 'west'}.issubset(metadata):
+            (
+                metadata['north'],
+                metadata['south'],
+                metadata['east'],
+                metadata['west']
+            ) = get_bounding_box(polygon)
+    elif footprint:
+        logger.warning('No geolocation found for the footprint, using the bounding box')
+
     return metadata
 
-def query_api(url, params, access_token=None, max_retries=5, base_delay=5):
+def query_api(url, params, access_token=None, max_retries=5, base_delay=5, timeout=15, deadline=None):
     """
     Helper function to query the API with exponential backoff and jitter.
+    A Retry-After header on a 429 response is respected. With a deadline
+    (time.monotonic()), no request or wait goes past it and None is returned
+    once it has passed.
     """
 
     headers = {}
     if access_token:
         headers['Authorization'] = f'Bearer {access_token}'
     for attempt in range(1, max_retries + 1):
+        request_timeout = timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning('Time budget for the API exhausted.')
+                return None
+            request_timeout = min(timeout, remaining)
         try:
-            print(f'Attempt {attempt} of {max_retries}: Querying API...')
-            response = requests.get(url, params=params, headers=headers, timeout=15)
+            logger.info(f'Attempt {attempt} of {max_retries}: Querying API...')
+            response = requests.get(url, params=params, headers=headers, timeout=request_timeout)
             response.raise_for_status()  # Raise HTTPError for bad responses
             return response.json()
         except requests.exceptions.RequestException as e:
             wait = min(base_delay * (2 ** (attempt - 1)), 300)  # cap at 5 min
             wait = wait * (0.5 + random.random())  # add jitter
-            print(f'API request failed (attempt {attempt}): {e}')
+            retry_after = e.response.headers.get('Retry-After') if e.response is not None else None
+            if retry_after and retry_after.isdigit():
+                wait = max(wait, int(retry_after))
+            logger.warning(f'API request failed (attempt {attempt}): {e}')
             if attempt < max_retries:
-                print(f'Retrying in {wait:.1f} seconds...')
+                if deadline is not None and time.monotonic() + wait >= deadline:
+                    logger.warning('Time budget for the API exhausted.')
+                    return None
+                logger.info(f'Retrying in {wait:.1f} seconds...')
                 time.sleep(wait)
             else:
-                print('All retry attempts failed.')
+                logger.warning('All retry attempts failed.')
                 return None
 
-def get_metadata_from_odata(basename):
-
-    base_url = "https://catalogue.dataspace.copernicus.eu/odata/v1/Products"
-
+def get_odata_name(basename):
+    """
+    Return the product Name as it is catalogued in OData.
+    """
     if basename.startswith('S1') or basename.startswith('S2'):
-        filename = basename + '.SAFE'
+        return basename + '.SAFE'
     elif basename.startswith('S3'):
-        filename = basename + '.SEN3'
+        return basename + '.SEN3'
     else:
-        filename = basename + '.nc'
+        return basename + '.nc'
+
+def get_odata_product(basename, base_url=ODATA_URL, **query_options):
+    """
+    Query OData for a single product by name and return the expanded record,
+    or None if the product could not be found.
+    query_options (max_retries, base_delay, timeout) are passed to query_api.
+    """
+
+    filename = get_odata_name(basename)
 
     params = {
         "$filter": f"Name eq '{filename}'",
@@ -409,24 +455,51 @@ def get_metadata_from_odata(basename):
         "$top": 1
     }
 
-    data = query_api(base_url, params)
+    data = query_api(base_url, params, **query_options)
+
+    if data and 'value' in data and len(data['value']) > 0:
+        return data['value'][0]
+    else:
+        logger.warning(f"Warning: Issue querying OData for metadata for {filename}.")
+        return None
+
+def get_metadata_from_odata(basename, base_url=ODATA_URL, **query_options):
 
-    if 'value' in data and len(data['value']) > 0:
-        json_data = data['value'][0]
+    json_data = get_odata_product(basename, base_url, **query_options)
+
+    if json_data:
         metadata, id = get_metadata_from_odata_dict(json_data)
         return metadata, id
     else:
-        print(f"Warning: Issue querying OData for metadata for {filename}.")
         return None, None
 
+def get_md5_from_odata(basename, base_url=ODATA_URL, **query_options):
+    """
+    Return the MD5 checksum that OData publishes for the product, so that
+    remote products do not need to be downloaded to be checksummed.
+    """
+    json_data = get_odata_product(basename, base_url, **query_options)
+    if not json_data:
+        return None
+    return get_md5_checksum(json_data)
+
+def get_md5_checksum(data):
+    """
+    Return the MD5 checksum from an OData product record, or None.
+    """
+    return next(
+        (c["Value"] for c in data.get("Checksum", []) if c.get("Algorithm") == "MD5"),
+        None
+    )
+
 def get_metadata_from_odata_dict(data):
     attributes = data.get('Attributes', [])
     if attributes:
         attr_dict = {attr['Name']: attr['Value'] for attr in attributes}
     else:
-        attributes = {}
+        attr_dict = {}
 
-    metadata = {}
+    metadata = ProductMetadata()
 
     # Extract orbit numbers
     for attr in ['orbitNumber','relativeOrbitNumber', 'orbitDirection', 'cloudCover']:
@@ -436,17 +509,12 @@ def get_metadata_from_odata_dict(data):
     if "polarisationChannels" in attr_dict and attr_dict["polarisationChannels"] is not None:
         metadata["polarisation"] = attr_dict['polarisationChannels']
 
-    metadata['md5_checksum'] = next(
-        (c["Value"] for c in data.get("Checksum", []) if c.get("Algorithm") == "MD5"),
-        None
-    )
+    metadata['md5_checksum'] = get_md5_checksum(data)
 
     tracking_id = data["Id"]
     metadata['startDate'] = data['ContentDate']['Start']
     metadata['completionDate'] = data['ContentDate']['End']
-    metadata['gmlgeometry'] = data['Footprint']
-
-    metadata['polygon'] = extract_polygon(metadata['gmlgeometry'])
+    metadata['polygon'] = extract_polygon(data['Footprint'])
     (
         metadata['north'],
         metadata['south'],
@@ -454,15 +522,59 @@ def get_metadata_from_odata_dict(data):
         metadata['west']
     ) = get_bounding_box(metadata['polygon'])
 
-    print('Found required metadata using OData')
+    logger.info('Found required metadata using OData')
     return metadata, tracking_id
 
-def get_metadata_from_json(json_file):
+def get_metadata_from_json(json_file, basename=None):
     '''
-    Extract metadata from json/dictionary from an expanded OData query
+    Extract metadata from json/dictionary from an expanded OData query.
+    The file can hold a single record, an OData response page or one record per
+    line (JSONL); in the latter cases the record whose Name matches basename is used.
+    The file is read incrementally.
     '''
 
-    with open(json_file, "r", encoding="utf-8") as fh:
-        json_data = json.load(fh)
+    first_record = None
+    count = 0
+    for record in iter_json_records(json_file):
+        if basename and record.get('Name', '').split('.')[0] == basename:
+            return get_metadata_from_odata_dict(record)
+        if first_record is None:
+            first_record = record
+        count += 1
+
+    if count == 1:
+        return get_metadata_from_odata_dict(first_record)
+    raise ValueError(f"No record for {basename} in {json_file}")
+
+def extract_metadata(filename, filepath, json_metadata=None, id=None, swath_footprint=False):
+    '''
+    Extract metadata from an expanded OData record (a dictionary, or a JSON file
+    holding it), or else from the product file itself depending on the mission. Returns the metadata and
+    the identifier, which is only replaced when read from JSON. With swath_footprint, the footprint
+    of S5P products is derived from their geolocation arrays.
+    '''
+    try:
+
+        if isinstance(json_metadata, dict):
+            logger.info("Extracting metadata from OData record")
+            metadata, id = get_metadata_from_odata_dict(json_metadata)
+        elif json_metadata:
+            logger.info("Extracting metadata from JSON")
+            metadata, id = get_metadata_from_json(json_metadata, filename.split('.')[0])
+        elif filename.startswith("S5"):
+            logger.info("Extracting metadata from NetCDF file")
+            metadata = get_metadata_from_netcdf(filepath, footprint=swath_footprint)
+        elif filename.startswith("S3"):
+            logger.info("Extracting metadata from SEN3 file")
+            metadata = get_metadata_from_sen3(filepath)
+        elif filename[:2] in ["S1", "S2"]:
+            logger.info("Extracting metadata from SAFE file")
+            metadata = get_metadata_from_safe(filepath)
+        else:
+            metadata = ProductMetadata()
+
+    except Exception as e:
+        logger.error(f"Error: Couldn't extract metadata from source file. Reason: {e}")
+        metadata = ProductMetadata()
 
-    return get_metadata_from_odata_dict(json_data)
\ No newline at end of file
+    return metadata, id
@@ -1,6 +1,8 @@
+import logging
 import os
 import yaml
 import uuid
+from functools import lru_cache
 from shapely.geometry import Polygon, MultiPolygon
 from lxml import etree as ET
 from datetime import datetime
@@ -10,18 +12,45 @@ from mmd_utils.metadata_extraction import (
     generate_opendap_url
 )
 from mmd_utils.xml_creation import prepend_mmd,prepend_xml,prepend_gml
+from mmd_utils.coordinates import parse_wkt_polygon, polygon_rings
+from mmd_utils.filename_parser import parse_product_name
 from mmd_utils.mmd_utils import (
     within_sios,get_size_mb,
     get_netcdf_checksum,
     get_zip_checksum
 )
 
+logger = logging.getLogger(__name__)
 
-def get_parent_id(script_dir, platform, product_type):
-    mapping_file = os.path.join(script_dir, "config", "parent_id_mapping.yaml")
+NAMESPACES = {
+    'mmd': 'http://www.met.no/schema/mmd',
+    'gml': 'http://www.opengis.net/gml'
+}
+# Registered once: the registry is global to lxml and shared by all threads
+for _prefix, _uri in NAMESPACES.items():
+    ET.register_namespace(_prefix, _uri)
+
+
+def parent_mapping_file(script_dir):
+    return os.path.join(script_dir, "config", "parent_id_mapping.yaml")
+
+def load_parent_mapping(mapping_file):
+    '''
+    Parent dataset identifiers by platform and product type, read again only
+    when the file is modified, so long-running loops see edits to it.
+    The returned mapping is shared, do not modify it.
+    '''
+    return _load_parent_mapping(mapping_file, os.stat(mapping_file).st_mtime_ns)
+
+@lru_cache(maxsize=8)
+def _load_parent_mapping(mapping_file, mtime_ns):
     with open(mapping_file, "r") as file:
-        mapping = yaml.safe_load(file)
-    parent_id = mapping[platform][product_type]
+        return yaml.safe_load(file)
+
+def get_parent_id(script_dir, platform, product_type, parent_mapping=None):
+    if parent_mapping is None:
+        parent_mapping = load_parent_mapping(parent_mapping_file(script_dir))
+    parent_id = parent_mapping[platform][product_type]
     return parent_id
 
 def generate_nbs_id(filename):
@@ -36,33 +65,52 @@ def generate_nbs_id(filename):
     nbs_id = rdn + str(nbs_uuid)
     return nbs_id
 
-def create_xml(script_dir, metadata, id, global_attributes, platform_metadata, product_metadata_df, filename, filepath=None):
-
-    filename_platform = filename.split('_')[0]
-    filename_mission = filename[0:2]
-    if filename.startswith('S1'):
-        filename_product_type = filename.split('_')[1] + '_' + filename.split('_')[2]
-        if filename_product_type.startswith('S'):
-            filename_product_type = filename[4:14]
-    elif filename.startswith('S2'):
-        filename_product_type = filename.split('_')[1]
-    elif filename.startswith('S3'):
-        filename_product_type = filename[4:15]
-    elif filename.startswith('S5'):
-        filename_product_type = filename[9:19]
-    else:
+def get_checksum(filepath):
+    '''
+    MD5 checksum of a product file as written to the MMD, or a description of the problem.
+    '''
+    if not filepath:
+        return 'File not found'
+    file_extension = os.path.splitext(filepath)[1].lower()
+    try:
+        if file_extension == '.zip':
+            return get_zip_checksum(filepath)
+        elif file_extension == '.nc':
+            return get_netcdf_checksum(filepath)
+        else:
+            return 'Unsupported file type'
+    except Exception as e:
+        return str(e)
+
+def fill_storage_information(metadata, filepath):
+    '''
+    Add the file size and checksum to the metadata, so that create_xml does not
+    read the product file. Values that are already present are kept.
+    '''
+    if 'size' not in metadata:
+        metadata['size'] = f'{get_size_mb(filepath)} MB'
+    if metadata.get('md5_checksum') is None:
+        metadata['md5_checksum'] = get_checksum(filepath)
+    return metadata
+
+def create_xml(script_dir, metadata, id, global_attributes, platform_metadata, product_metadata_df, filename, filepath=None,
+               parent_mapping=None, read_file=True):
+    '''
+    Build the MMD element of a product. The parent dataset is looked up in
+    parent_mapping, or else in config/parent_id_mapping.yaml under script_dir.
+    A file size or checksum missing from metadata is computed from the product
+    file, or left out with read_file False (when the file is not there yet).
+    '''
+
+    product = parse_product_name(filename)
+    if product is None:
         raise ValueError(f'Could not identify product type from filename')
-    product_metadata = get_product_metadata(product_metadata_df,filename_product_type)
+    filename_platform = product.platform
+    filename_mission = product.mission
+    product_metadata = get_product_metadata(product_metadata_df, product.product_type)
 
     # TODO: The SAFE filepath will later be predictable so use this predictable filepath instead of passing an argument
-    namespaces = {
-        'mmd': 'http://www.met.no/schema/mmd',
-        'gml': 'http://www.opengis.net/gml'
-    }
-    for prefix, uri in namespaces.items():
-        ET.register_namespace(prefix, uri)
-
-    root = ET.Element(f'{{{namespaces["mmd"]}}}mmd', nsmap=namespaces)
+    root = ET.Element(f'{{{NAMESPACES["mmd"]}}}mmd', nsmap=NAMESPACES)
 
     metadata_identifier = ET.SubElement(root, prepend_mmd('metadata_identifier'))
     metadata_identifier.text = id
@@ -102,7 +150,7 @@ def create_xml(script_dir, metadata, id, global_attributes, platform_metadata, p
         else:
             pass
     else:
-        print("Coordinates not present so could not compute whether data fall within SIOS AOI")
+        logger.info("Coordinates not present so could not compute whether data fall within SIOS AOI")
         pass
 
     last_metadata_update = ET.SubElement(root, prepend_mmd('last_metadata_update'))
@@ -181,43 +229,27 @@ def create_xml(script_dir, metadata, id, global_attributes, platform_metadata, p
             # Case 1: WKT string
             if isinstance(poly_data, str):
                 wkt = poly_data.strip()
-                if not wkt.upper().startswith("POLYGON"):
-                    raise ValueError("Expected WKT POLYGON")
-
-                inner = wkt[wkt.find("((") + 2 : wkt.rfind("))")]
-                rings = inner.split("), (")
-
-                def parse_coords(ring):
-                    coords = ring.replace(",", "").split()
-                    return [(float(coords[i]), float(coords[i+1])) for i in range(0, len(coords), 2)]
-
-                exterior_coords = parse_coords(rings[0])
-                interior_coords_list = [parse_coords(r) for r in rings[1:]]
-                polygons = [(exterior_coords, interior_coords_list)]
+                rings = parse_wkt_polygon(wkt)
+                polygons = [(rings[0], rings[1:])]
 
             # Case 2: Shapely Polygon
             elif isinstance(poly_data, Polygon):
-                polygons = [(
-                    list(poly_data.exterior.coords),
-                    [list(interior.coords) for interior in poly_data.interiors]
-                )]
+                rings = polygon_rings(poly_data)
+                polygons = [(rings[0], rings[1:])]
 
             # Case 3: Shapely MultiPolygon
             elif isinstance(poly_data, MultiPolygon):
-                polygons = [
-                    (
-                        list(polygon.exterior.coords),
-                        [list(interior.coords) for interior in polygon.interiors]
-                    )
-                    for polygon in poly_data.geoms
-                ]
+                polygons = []
+                for polygon in poly_data.geoms:
+                    rings = polygon_rings(polygon)
+                    polygons.append((rings[0], rings[1:]))
             else:
                 raise TypeError(f"Unsupported polygon type: {type(poly_data)}")
 
             # --- XML writing ---
             polygon_elem = ET.SubElement(geographic_extent, prepend_mmd("polygon"))
 
-            if isinstance(poly_data, Polygon) or (isinstance(poly_data, str) and wkt.upper().startswith("POLYGON")):
+            if isinstance(poly_data, (Polygon, str)):
                 # Single Polygon case
                 exterior_coords, interior_coords_list = polygons[0]
                 sub_poly = ET.SubElement(polygon_elem, prepend_gml("Polygon"))
@@ -227,7 +259,7 @@ def create_xml(script_dir, metadata, id, global_attributes, platform_metadata, p
                 # Exterior
                 exterior = ET.SubElement(sub_poly, prepend_gml("exterior"))
                 linear_ring = ET.SubElement(exterior, prepend_gml("LinearRing"))
-                for lon, lat in exterior_coords:
+                for lon, lat in exterior_coords.tolist():
                     pos = ET.SubElement(linear_ring, prepend_gml("pos"))
                     pos.text = f"{lat} {lon}"
 
@@ -235,7 +267,7 @@ def create_xml(script_dir, metadata, id, global_attributes, platform_metadata, p
                 for interior_coords in interior_coords_list:
                     interior = ET.SubElement(sub_poly, prepend_gml("interior"))
                     linear_ring = ET.SubElement(interior, prepend_gml("LinearRing"))
-                    for lon, lat in interior_coords:
+                    for lon, lat in interior_coords.tolist():
                         pos = ET.SubElement(linear_ring, prepend_gml("pos"))
                         pos.text = f"{lat} {lon}"
 
@@ -251,7 +283,7 @@ def create_xml(script_dir, metadata, id, global_attributes, platform_metadata, p
                     # Exterior
                     exterior = ET.SubElement(sub_poly, prepend_gml("exterior"))
                     linear_ring = ET.SubElement(exterior, prepend_gml("LinearRing"))
-                    for lon, lat in exterior_coords:
+                    for lon, lat in exterior_coords.tolist():
                         pos = ET.SubElement(linear_ring, prepend_gml("pos"))
                         pos.text = f"{lat} {lon}"
 
@@ -259,15 +291,15 @@ def create_xml(script_dir, metadata, id, global_attributes, platform_metadata, p
                     for interior_coords in interior_coords_list:
                         interior = ET.SubElement(sub_poly, prepend_gml("interior"))
                         linear_ring = ET.SubElement(interior, prepend_gml("LinearRing"))
-                        for lon, lat in interior_coords:
+                        for lon, lat in interior_coords.tolist():
                             pos = ET.SubElement(linear_ring, prepend_gml("pos"))
                             pos.text = f"{lat} {lon}"
 
         except Exception as e:
-            print(f"⚠️ Failed to write polygon from metadata: {e}")
+            logger.warning(f"⚠️ Failed to write polygon from metadata: {e}")
 
     else:
-        print('Warning: polygon is None. Geographic extent will not be included in the XML.')
+        logger.warning('Warning: polygon is None. Geographic extent will not be included in the XML.')
 
     dataset_lang = ET.SubElement(root, prepend_mmd('dataset_language'))
     dataset_lang.text = global_attributes['dataset_language']
@@ -319,32 +351,24 @@ def create_xml(script_dir, metadata, id, global_attributes, platform_metadata, p
             file_format.text = 'SAFE'
     elif file_extension == '.nc':
         file_format.text = 'NetCDF'
-    file_size = ET.SubElement(storage_information, prepend_mmd('file_size'))
-    file_size.attrib['unit'] = 'MB'
-    if 'size' not in metadata:
-        file_size_conv = get_size_mb(filepath)
-    else:
-        file_size_conv = float(metadata['size'].split(' ')[0])
-    file_size.text = f'{file_size_conv:.2f}'
+    if 'size' in metadata or read_file:
+        file_size = ET.SubElement(storage_information, prepend_mmd('file_size'))
+        file_size.attrib['unit'] = 'MB'
+        if 'size' not in metadata:
+            file_size_conv = get_size_mb(filepath)
+        else:
+            file_size_conv = float(metadata['size'].split(' ')[0])
+        file_size.text = f'{file_size_conv:.2f}'
 
     # Compute checksum for file
-    checksum = ET.SubElement(storage_information, prepend_mmd('checksum'))
-    checksum.attrib['type'] = 'md5sum'
+    if metadata.get('md5_checksum') is not None or read_file:
+        checksum = ET.SubElement(storage_information, prepend_mmd('checksum'))
+        checksum.attrib['type'] = 'md5sum'
 
-    if 'md5_checksum' in metadata and metadata['md5_checksum'] is not None:
-        checksum.text = metadata['md5_checksum']
-    elif filepath:
-        try:
-            if file_extension == '.zip':
-                checksum.text = get_zip_checksum(filepath)
-            elif file_extension == '.nc':
-                checksum.text = get_netcdf_checksum(filepath)
-            else:
-                checksum.text = 'Unsupported file type'
-        except Exception as e:
-            checksum.text = str(e)
-    else:
-        checksum.text = 'File not found'
+        if 'md5_checksum' in metadata and metadata['md5_checksum'] is not None:
+            checksum.text = metadata['md5_checksum']
+        else:
+            checksum.text = get_checksum(filepath)
 
     project = ET.SubElement(root, prepend_mmd('project'))
     project_s_name = ET.SubElement(project, prepend_mmd('short_name'))
@@ -445,7 +469,7 @@ def create_xml(script_dir, metadata, id, global_attributes, platform_metadata, p
         da_resource = ET.SubElement(data_access,prepend_mmd('resource'))
         da_resource.text = generate_opendap_url(filepath,product_metadata['product_type'])
 
-    parent_ID = get_parent_id(script_dir, filename_platform, product_metadata['product_type'])
+    parent_ID = get_parent_id(script_dir, filename_platform, product_metadata['product_type'], parent_mapping)
     related_dataset = ET.SubElement(root,prepend_mmd('related_dataset'))
     related_dataset.attrib['relation_type'] = "parent"
     related_dataset.text = str(parent_ID)
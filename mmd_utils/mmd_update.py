@@ -0,0 +1,96 @@
+import copy
+from datetime import datetime
+from lxml import etree as ET
+from mmd_utils.xml_creation import prepend_mmd
+
+PROVISIONAL_NOTE = 'Provisional: generated from local metadata only, to be completed from the Copernicus catalogue.'
+
+
+def canonical_mmd(root):
+    """
+    Serialize an MMD tree for comparison. The update history is removed and
+    whitespace between elements is ignored, so two MMD files compare equal
+    when only their timestamps or formatting differ.
+    """
+    root = copy.deepcopy(root)
+    for element in root.findall(prepend_mmd('last_metadata_update')):
+        root.remove(element)
+    for element in root.iter():
+        if element.text is not None and not element.text.strip() and len(element):
+            element.text = None
+        if element.tail is not None and not element.tail.strip():
+            element.tail = None
+    return ET.tostring(root, method='c14n')
+
+
+def load_mmd(mmd_path):
+    parser = ET.XMLParser(remove_blank_text=True)
+    return ET.parse(mmd_path, parser).getroot()
+
+
+def _latest_note(root):
+    notes = root.findall(f"{prepend_mmd('last_metadata_update')}/{prepend_mmd('update')}/{prepend_mmd('note')}")
+    return notes[-1].text if notes else None
+
+
+def mark_provisional(mmd_xml):
+    """
+    Mark an MMD element as provisional in the note of its latest update.
+    """
+    updates = mmd_xml.findall(f"{prepend_mmd('last_metadata_update')}/{prepend_mmd('update')}")
+    note = updates[-1].find(prepend_mmd('note'))
+    if note is None:
+        note = ET.SubElement(updates[-1], prepend_mmd('note'))
+    note.text = PROVISIONAL_NOTE
+    return mmd_xml
+
+
+def is_provisional(mmd_xml):
+    """
+    True if the latest update of an MMD element is a provisional record.
+    """
+    return _latest_note(mmd_xml) == PROVISIONAL_NOTE
+
+
+def mmd_changed(existing_root, new_root):
+    """
+    Whether the new MMD tree differs from the existing one, ignoring the
+    update history except for a provisional record becoming final or the
+    other way round.
+    """
+    if is_provisional(existing_root) != is_provisional(new_root):
+        return True
+    return canonical_mmd(existing_root) != canonical_mmd(new_root)
+
+
+def carry_update_history(existing_root, new_root, update_type='Minor modification', note=None):
+    """
+    Replace the update history of the new MMD tree with the history of the
+    existing MMD file, followed by one new update entry. Without a note, the
+    note of the new tree's own update is kept, e.g. the provisional mark.
+    The existing file should be parsed with remove_blank_text so that the
+    history is indented correctly when written.
+    """
+    if note is None:
+        note = _latest_note(new_root)
+    existing_history = existing_root.find(prepend_mmd('last_metadata_update'))
+    if existing_history is None:
+        return new_root
+
+    history = copy.deepcopy(existing_history)
+
+    update = ET.SubElement(history, prepend_mmd('update'))
+    update_datetime = ET.SubElement(update, prepend_mmd('datetime'))
+    update_datetime.text = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+    type_element = ET.SubElement(update, prepend_mmd('type'))
+    type_element.text = update_type
+    note_element = ET.SubElement(update, prepend_mmd('note'))
+    if note:
+        note_element.text = note
+
+    new_history = new_root.find(prepend_mmd('last_metadata_update'))
+    if new_history is not None:
+        new_root.replace(new_history, history)
+    else:
+        new_root.append(history)
+    return new_root
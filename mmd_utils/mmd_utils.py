@@ -5,6 +5,9 @@ import zipfile
 from shapely.geometry import Polygon, MultiPolygon, box
 from shapely import wkt
 from lxml import etree as ET
+from mmd_utils.remote_access import is_remote, HTTPRangeFile
+from mmd_utils.io_throttle import read_chunks
+from mmd_utils.coordinates import parse_pairs, polygon_from_rings
 
 def extract_polygon(gmlgeometry: str):
     gmlgeometry = gmlgeometry.strip()
@@ -26,23 +29,12 @@ def extract_polygon(gmlgeometry: str):
             root = ET.fromstring(gmlgeometry.encode("utf-8"))
             ns = {"gml": "http://www.opengis.net/gml"}
 
-            def parse_coords(coords_text):
-                coords = []
-                for pair in coords_text.strip().split():
-                    x, y = pair.split(",")
-                    coords.append((float(x), float(y)))
-                return coords
-
-            # Exterior
-            exterior_elem = root.find(".//gml:outerBoundaryIs/gml:LinearRing/gml:coordinates", ns)
-            exterior_coords = parse_coords(exterior_elem.text)
-
-            # Interiors
-            interior_coords_list = []
+            # Exterior ring first, then the interiors, each as an (N, 2) array of x,y pairs
+            rings = [parse_pairs(root.find(".//gml:outerBoundaryIs/gml:LinearRing/gml:coordinates", ns).text)]
             for interior_elem in root.findall(".//gml:innerBoundaryIs/gml:LinearRing/gml:coordinates", ns):
-                interior_coords_list.append(parse_coords(interior_elem.text))
+                rings.append(parse_pairs(interior_elem.text))
 
-            polygon = Polygon(shell=exterior_coords, holes=interior_coords_list)
+            polygon = polygon_from_rings(rings)
             return polygon
 
         except Exception as e:
@@ -71,9 +63,8 @@ def extract_coordinates(xml_string):
 def get_zip_checksum(zip_filepath):
     md5_check = hashlib.md5()
     try:
-        with open(zip_filepath, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                md5_check.update(chunk)
+        for chunk in read_chunks(zip_filepath):
+            md5_check.update(chunk)
         return md5_check.hexdigest()
     except FileNotFoundError:
         return 'File not found'
@@ -83,9 +74,8 @@ def get_zip_checksum(zip_filepath):
 def get_netcdf_checksum(netcdf_filepath):
     md5_check = hashlib.md5()
     try:
-        with open(netcdf_filepath, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                md5_check.update(chunk)
+        for chunk in read_chunks(netcdf_filepath):
+            md5_check.update(chunk)
         return md5_check.hexdigest()
     except FileNotFoundError:
         return 'File not found'
@@ -94,6 +84,16 @@ def get_netcdf_checksum(netcdf_filepath):
 
 def get_size_mb(path):
     """Returns the size of a file or the uncompressed size of a ZIP in MB."""
+    if is_remote(path):
+        # Only the zip central directory is fetched for remote products
+        with HTTPRangeFile(path) as fh:
+            if path.lower().endswith('.zip'):
+                with zipfile.ZipFile(fh, 'r') as zip_ref:
+                    size_bytes = sum(file.file_size for file in zip_ref.infolist())
+            else:
+                size_bytes = fh.size
+        return size_bytes / (1024 * 1024)
+
     if not os.path.exists(path):
         raise FileNotFoundError(f"The path '{path}' does not exist.")
 
@@ -110,15 +110,18 @@ def get_size_mb(path):
     return size_bytes / (1024 * 1024)  # Convert to MB
 
 
+# The SIOS polygon (rough bounding box around Svalbard/Arctic region)
+SIOS_POLYGON = Polygon([
+    (-20, 70),
+    (-20, 90),
+    (40, 90),
+    (40, 70),
+    (-20, 70)
+])
+
+
 def within_sios(polygon=None, north=None, south=None, east=None, west=None):
-    # Define the SIOS polygon (rough bounding box around Svalbard/Arctic region)
-    sios_polygon = Polygon([
-        (-20, 70),
-        (-20, 90),
-        (40, 90),
-        (40, 70),
-        (-20, 70)
-    ])
+    sios_polygon = SIOS_POLYGON
 
     if polygon:
         # Ensure input is a Shapely Polygon or MultiPolygon
@@ -0,0 +1,172 @@
+import logging
+import json
+import sqlite3
+from pathlib import Path
+from mmd_utils.metadata_extraction import (
+    get_odata_name,
+    get_metadata_from_odata_dict,
+    get_metadata_from_odata,
+    get_md5_from_odata,
+    get_md5_checksum,
+    check_metadata,
+    ODATA_URL,
+)
+from mmd_utils.remote_access import is_remote
+from mmd_utils.json_stream import iter_json_records
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    Name TEXT PRIMARY KEY,
+    Id TEXT NOT NULL,
+    ContentStart TEXT,
+    ContentEnd TEXT,
+    Footprint TEXT,
+    Checksum TEXT,
+    Attributes TEXT,
+    ContentLength INTEGER,
+    ModificationDate TEXT
+)
+"""
+
+UPSERT = """
+INSERT INTO products (Name, Id, ContentStart, ContentEnd, Footprint, Checksum, Attributes, ContentLength, ModificationDate)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(Name) DO UPDATE SET
+    Id = excluded.Id,
+    ContentStart = excluded.ContentStart,
+    ContentEnd = excluded.ContentEnd,
+    Footprint = excluded.Footprint,
+    Checksum = excluded.Checksum,
+    Attributes = excluded.Attributes,
+    ContentLength = excluded.ContentLength,
+    ModificationDate = excluded.ModificationDate
+WHERE products.ModificationDate IS NULL
+    OR excluded.ModificationDate IS NULL
+    OR excluded.ModificationDate >= products.ModificationDate
+"""
+
+
+def open_mirror(db_path, read_only=False, check_same_thread=True):
+    """
+    Open (and create if needed) the local SQLite mirror of OData product records.
+    For lookups, open it read_only: the mirror must exist and is not written,
+    so it may be on read-only storage.
+    """
+    if read_only:
+        return sqlite3.connect(
+            f'{Path(db_path).resolve().as_uri()}?mode=ro', uri=True, check_same_thread=check_same_thread
+        )
+    conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+    conn.execute(SCHEMA)
+    conn.commit()
+    return conn
+
+
+def record_to_row(record):
+    content_date = record.get('ContentDate') or {}
+    return (
+        record['Name'],
+        record['Id'],
+        content_date.get('Start'),
+        content_date.get('End'),
+        record.get('Footprint'),
+        json.dumps(record.get('Checksum', [])),
+        json.dumps(record.get('Attributes', [])),
+        record.get('ContentLength'),
+        record.get('ModificationDate'),
+    )
+
+
+def row_to_record(row):
+    """
+    Rebuild an expanded OData record from a mirror row, so it can be passed
+    straight to get_metadata_from_odata_dict.
+    """
+    name, id, start, end, footprint, checksum, attributes, content_length, modification_date = row
+    return {
+        'Name': name,
+        'Id': id,
+        'ContentDate': {'Start': start, 'End': end},
+        'Footprint': footprint,
+        'Checksum': json.loads(checksum) if checksum else [],
+        'Attributes': json.loads(attributes) if attributes else [],
+        'ContentLength': content_length,
+        'ModificationDate': modification_date,
+    }
+
+
+def ingest_records(conn, records, batch_size=5000):
+    """
+    Insert or update records in the mirror. Existing records are only replaced
+    by records with the same or a newer ModificationDate, so dumps can be
+    ingested repeatedly and in any order.
+    Returns the number of records read.
+    """
+    count = 0
+    batch = []
+    for record in records:
+        batch.append(record_to_row(record))
+        if len(batch) >= batch_size:
+            with conn:
+                conn.executemany(UPSERT, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        with conn:
+            conn.executemany(UPSERT, batch)
+        count += len(batch)
+    return count
+
+
+def ingest_dump(conn, dump_path):
+    return ingest_records(conn, iter_json_records(dump_path))
+
+
+def get_mirror_record(conn, basename):
+    """
+    Return the expanded OData record for the product, or None if it is not mirrored.
+    """
+    row = conn.execute(
+        'SELECT Name, Id, ContentStart, ContentEnd, Footprint, Checksum, Attributes, ContentLength, ModificationDate '
+        'FROM products WHERE Name = ?',
+        (get_odata_name(basename),)
+    ).fetchone()
+    if row is None:
+        return None
+    return row_to_record(row)
+
+
+def get_metadata_from_mirror(conn, basename):
+    record = get_mirror_record(conn, basename)
+    if record is None:
+        logger.info(f"Product {basename} not found in local OData mirror")
+        return None, None
+    return get_metadata_from_odata_dict(record)
+
+
+def get_fallback_metadata(metadata, id, basename, filepath, mirror=None, odata_url=ODATA_URL, **query_options):
+    """
+    Fall back to the local mirror and then to the OData API when the extracted
+    metadata is insufficient. For remote products the MD5 checksum is taken from
+    OData, as they are not downloaded. Returns the metadata and the identifier.
+    """
+    if not check_metadata(metadata, id):
+        metadata = None
+        if mirror:
+            logger.info("Insufficient metadata, so looking up local OData mirror")
+            metadata, id = get_metadata_from_mirror(mirror, basename)
+        if not metadata:
+            logger.info("Insufficient metadata, so querying")
+            metadata, id = get_metadata_from_odata(basename, odata_url, **query_options)
+
+    if metadata and is_remote(filepath) and not metadata.get('md5_checksum'):
+        # Remote products are not downloaded, so the checksum comes from OData
+        record = get_mirror_record(mirror, basename) if mirror else None
+        if record:
+            metadata['md5_checksum'] = get_md5_checksum(record)
+        else:
+            metadata['md5_checksum'] = get_md5_from_odata(basename, odata_url, **query_options)
+
+    return metadata, id
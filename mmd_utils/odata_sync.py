@@ -0,0 +1,279 @@
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from lxml import etree as ET
+from mmd_utils.metadata_extraction import (
+    ODATA_URL,
+    archive_relative_path,
+    get_metadata_from_odata_dict,
+    get_product_metadata,
+    query_api,
+)
+from mmd_utils.filename_parser import parse_product_name
+from mmd_utils.mmd_helpers import create_xml, generate_nbs_id
+from mmd_utils.odata_mirror import ingest_records
+from mmd_utils.pipeline import write_mmd
+
+logger = logging.getLogger(__name__)
+
+# CDSE collection of each mission in product names
+COLLECTIONS = {
+    'S1': 'SENTINEL-1',
+    'S2': 'SENTINEL-2',
+    'S3': 'SENTINEL-3',
+    'S5': 'SENTINEL-5P',
+}
+
+SYNC_FIELDS = ('ModificationDate', 'PublicationDate')
+
+SYNC_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync_state (
+    scope TEXT PRIMARY KEY,
+    watermark TEXT NOT NULL,
+    updated TEXT
+)
+"""
+
+# Products whose MMD file was written (or skipped on purpose) by a sync, by
+# ModificationDate. Kept apart from the products table, which also holds
+# records ingested from dumps and records whose MMD file failed.
+SYNCED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS synced (
+    Name TEXT PRIMARY KEY,
+    ModificationDate TEXT,
+    synced TEXT
+)
+"""
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+def format_odata_time(value):
+    return value.astimezone(timezone.utc).strftime(DATE_FORMAT)[:-4] + 'Z'
+
+
+def parse_odata_time(value):
+    timestamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def archive_filename(odata_name):
+    """
+    Name of the product file in the archive for an OData product Name:
+    SAFE and SEN3 products are archived as zip files.
+    """
+    base, extension = os.path.splitext(odata_name)
+    if extension in ('.SAFE', '.SEN3'):
+        return base + '.zip'
+    return odata_name
+
+
+def change_filter(collection, watermark, field='ModificationDate', aoi_wkt=None):
+    """
+    OData $filter for the products of a collection published or modified
+    (field) after the watermark, optionally intersecting an AOI (WKT).
+    """
+    clauses = [f"Collection/Name eq '{collection}'", f"{field} gt {watermark}"]
+    if aoi_wkt:
+        clauses.append(f"OData.CSC.Intersects(area=geography'SRID=4326;{aoi_wkt}')")
+    return ' and '.join(clauses)
+
+
+class ChangeFeed:
+    """
+    Pages through the OData products of a collection published or modified
+    after a watermark, oldest first. Watermarks are kept per collection, field
+    and AOI in the sync_state table of the OData mirror, and each page of
+    records is ingested into the mirror. The caller marks the records it has
+    synced; the watermark does not pass a record that was not.
+    """
+
+    def __init__(self, mirror, base_url=ODATA_URL, field='ModificationDate', aoi_wkt=None, page_size=100,
+                 lookback_minutes=10, **query_options):
+        if field not in SYNC_FIELDS:
+            raise ValueError(f'Cannot sync on {field}, use one of {", ".join(SYNC_FIELDS)}')
+        self.mirror = mirror
+        self.mirror.execute(SYNC_SCHEMA)
+        self.mirror.execute(SYNCED_SCHEMA)
+        self.mirror.commit()
+        self.base_url = base_url
+        self.field = field
+        self.aoi_wkt = aoi_wkt
+        self.page_size = page_size
+        self.lookback = timedelta(minutes=lookback_minutes)
+        self.query_options = query_options
+
+    def scope(self, collection):
+        return f'{collection}|{self.field}|{self.aoi_wkt or ""}'
+
+    def watermark(self, collection):
+        row = self.mirror.execute(
+            'SELECT watermark FROM sync_state WHERE scope = ?', (self.scope(collection),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, collection, watermark):
+        with self.mirror:
+            self.mirror.execute(
+                'INSERT OR REPLACE INTO sync_state (scope, watermark, updated) VALUES (?, ?, ?)',
+                (self.scope(collection), watermark, format_odata_time(datetime.now(timezone.utc)))
+            )
+
+    def mark_synced(self, record):
+        """
+        Record that the MMD file of a record was written, or skipped on purpose.
+        """
+        with self.mirror:
+            self.mirror.execute(
+                'INSERT OR REPLACE INTO synced (Name, ModificationDate, synced) VALUES (?, ?, ?)',
+                (record['Name'], record.get('ModificationDate'), format_odata_time(datetime.now(timezone.utc)))
+            )
+
+    def _seen(self, record):
+        # Records are seen again in the lookback window; skip those already synced in this version
+        row = self.mirror.execute(
+            'SELECT ModificationDate FROM synced WHERE Name = ?', (record['Name'],)
+        ).fetchone()
+        return row is not None and row[0] == record.get('ModificationDate')
+
+    def pages(self, collection, since):
+        """
+        Yield lists of new or changed records of a collection, after the stored
+        watermark (or since, a datetime, if there is none) less the lookback.
+        The watermark is advanced once the caller has consumed each page, up to
+        the first record the caller did not mark as synced, so that record is
+        queried again on the next sync.
+        """
+        watermark = self.watermark(collection)
+        start = parse_odata_time(watermark) if watermark else since
+        params = {
+            '$filter': change_filter(collection, format_odata_time(start - self.lookback), self.field, self.aoi_wkt),
+            '$orderby': f'{self.field} asc',
+            '$top': self.page_size,
+            '$expand': 'Attributes',
+        }
+        url = self.base_url
+        skip = 0
+        held = False
+        while True:
+            data = query_api(url, params, **self.query_options)
+            if data is None:
+                raise RuntimeError(f'OData query for {collection} changes failed')
+            records = data.get('value', [])
+            new_records = [record for record in records if not self._seen(record)]
+            if new_records:
+                yield new_records
+            # Only recorded once the page is processed, so an interrupted sync repeats it
+            ingest_records(self.mirror, records)
+            if not held:
+                latest = watermark
+                for record in records:
+                    if not self._seen(record):
+                        # Hold the watermark before a failed record for the rest of this sync
+                        held = True
+                        break
+                    value = record.get(self.field)
+                    if value and (latest is None or parse_odata_time(value) > parse_odata_time(latest)):
+                        latest = value
+                if latest != watermark:
+                    watermark = latest
+                    self.set_watermark(collection, watermark)
+
+            next_link = data.get('@odata.nextLink')
+            if next_link:
+                url, params = next_link, None
+            elif len(records) < self.page_size:
+                break
+            else:
+                skip += len(records)
+                params = dict(params, **{'$skip': skip})
+
+
+def record_metadata(record):
+    """
+    Metadata and identifier of a product from its expanded OData record alone.
+    The file size is not set: the record's ContentLength is the size of the
+    download, not the size of the product the MMD files of local files give.
+    """
+    return get_metadata_from_odata_dict(record)
+
+
+def prepare_record(record, script_dir, global_attributes, platform_metadata, product_metadata_df, mmd_dir,
+                   archive_root=None, create_id=False):
+    """
+    Build a work item with the MMD of a product from its expanded OData record
+    alone, before the product file is downloaded. The checksum is the record's
+    MD5; the file size, and the checksum of records without one, are left out
+    until the MMD is generated from the file. Returns None for products of a
+    type not in product_types.csv.
+    """
+    filename = archive_filename(record['Name'])
+    product = parse_product_name(filename)
+    if product is None:
+        return None
+    product_metadata = get_product_metadata(product_metadata_df, product.product_type)
+    if not product_metadata:
+        return None
+    relative_path = archive_relative_path(filename, product_metadata['product_type'])
+    filepath = os.path.join(archive_root, relative_path) if archive_root else relative_path
+    mmd_path = os.path.join(mmd_dir, os.path.dirname(relative_path), filename.split('.')[0] + '.xml')
+
+    metadata, id = record_metadata(record)
+    if create_id:
+        id = generate_nbs_id(filename)
+
+    mmd_xml = create_xml(script_dir, metadata, id, global_attributes, platform_metadata, product_metadata_df,
+                         filename, filepath, read_file=False)
+    return {
+        'filename': filename,
+        'filepath': filepath,
+        'mmd_path': mmd_path,
+        'id': id,
+        'metadata': metadata,
+        'mmd_bytes': ET.tostring(mmd_xml),
+    }
+
+
+def sync_changes(feed, collections, since, prepare, update=False, catalogue=None, extraction_store=None,
+                 formats=None, parent_aggregates=None, spatial_index=None):
+    """
+    Write MMD files for the products of each collection published or modified
+    since the last sync. prepare builds the work item of a record, see
+    prepare_record. Failed records are queried again on the next sync. Returns the numbers of products written, unchanged,
+    skipped (types not configured) and failed.
+    """
+    written = unchanged = skipped = failed = 0
+    for collection in collections:
+        for records in feed.pages(collection, since):
+            for record in records:
+                try:
+                    item = prepare(record)
+                    if item is None:
+                        skipped += 1
+                        feed.mark_synced(record)
+                        continue
+                    if write_mmd(item, update, catalogue, extraction_store, formats, parent_aggregates, spatial_index):
+                        written += 1
+                        logger.info(f"Prepared {item['mmd_path']}")
+                    else:
+                        unchanged += 1
+                    feed.mark_synced(record)
+                except Exception as e:
+                    logger.error(f"Error: Failed to prepare MMD for {record.get('Name')}. Reason: {e}")
+                    failed += 1
+        watermark = feed.watermark(collection)
+        logger.info(f"{collection}: synced to {watermark}" if watermark else f"{collection}: no products since {since}")
+    return written, unchanged, skipped, failed
+
+
+def poll(interval_minutes, sync):
+    """
+    Call sync every interval_minutes until interrupted.
+    """
+    while True:
+        started = time.monotonic()
+        sync()
+        time.sleep(max(0.0, interval_minutes * 60 - (time.monotonic() - started)))
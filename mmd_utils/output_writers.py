@@ -0,0 +1,440 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from lxml import etree as ET
+from shapely.geometry import mapping, box
+from mmd_utils.config_handling import save_xml_to_file
+
+MMD_NS = {'mmd': 'http://www.met.no/schema/mmd'}
+
+GMD = 'http://www.isotc211.org/2005/gmd'
+GCO = 'http://www.isotc211.org/2005/gco'
+GML = 'http://www.opengis.net/gml/3.2'
+ISO_NSMAP = {'gmd': GMD, 'gco': GCO, 'gml': GML}
+ISO_CODELISTS = 'http://standards.iso.org/iso/19139/resources/gmxCodelists.xml'
+
+OUTPUT_SUFFIXES = {
+    'mmd': '.xml',
+    'stac': '.stac.json',
+    'iso19139': '.iso.xml',
+}
+
+PROGRESS_CODES = {
+    'Planned': 'planned',
+    'In Work': 'onGoing',
+    'Complete': 'completed',
+    'Obsolete': 'obsolete',
+}
+
+FILE_MEDIA_TYPES = {
+    'SAFE': 'application/zip',
+    'SEN3': 'application/zip',
+    'NetCDF': 'application/netcdf',
+}
+
+
+def output_path_for(output_path, output_format):
+    """
+    Path of the file for an output format, next to the MMD file.
+    """
+    basename = os.path.basename(output_path).split('.')[0]
+    return os.path.join(os.path.dirname(output_path), basename + OUTPUT_SUFFIXES[output_format])
+
+
+def _text(root, path):
+    element = root.find(path, MMD_NS)
+    if element is None or element.text is None:
+        return None
+    return element.text
+
+
+def _float(value):
+    return float(value) if value not in (None, '') else None
+
+
+def _rfc3339(value):
+    if value and not value.endswith('Z') and '+' not in value[10:]:
+        return value + 'Z'
+    return value
+
+
+def mmd_summary(mmd_xml):
+    """
+    Read the fields shared by all output formats from the MMD element tree into
+    a dictionary, so other formats are rendered from exactly what the MMD holds.
+    """
+    updates = mmd_xml.findall('mmd:last_metadata_update/mmd:update/mmd:datetime', MMD_NS)
+    return {
+        'id': _text(mmd_xml, 'mmd:metadata_identifier'),
+        'title': _text(mmd_xml, 'mmd:title'),
+        'abstract': _text(mmd_xml, 'mmd:abstract'),
+        'production_status': _text(mmd_xml, 'mmd:dataset_production_status'),
+        'collections': [c.text for c in mmd_xml.findall('mmd:collection', MMD_NS)],
+        'updated': updates[-1].text if updates else None,
+        'start': _text(mmd_xml, 'mmd:temporal_extent/mmd:start_date'),
+        'end': _text(mmd_xml, 'mmd:temporal_extent/mmd:end_date'),
+        'iso_topics': [t.text for t in mmd_xml.findall('mmd:iso_topic_category', MMD_NS)],
+        'keywords': [
+            (k.get('vocabulary'), [kw.text for kw in k.findall('mmd:keyword', MMD_NS)])
+            for k in mmd_xml.findall('mmd:keywords', MMD_NS)
+        ],
+        'north': _float(_text(mmd_xml, 'mmd:geographic_extent/mmd:rectangle/mmd:north')),
+        'south': _float(_text(mmd_xml, 'mmd:geographic_extent/mmd:rectangle/mmd:south')),
+        'east': _float(_text(mmd_xml, 'mmd:geographic_extent/mmd:rectangle/mmd:east')),
+        'west': _float(_text(mmd_xml, 'mmd:geographic_extent/mmd:rectangle/mmd:west')),
+        'access_constraint': _text(mmd_xml, 'mmd:access_constraint'),
+        'license_text': _text(mmd_xml, 'mmd:use_constraint/mmd:license_text'),
+        'personnel': [
+            {
+                'role': _text(p, 'mmd:role'),
+                'name': _text(p, 'mmd:name'),
+                'email': _text(p, 'mmd:email'),
+                'organisation': _text(p, 'mmd:organisation'),
+            }
+            for p in mmd_xml.findall('mmd:personnel', MMD_NS)
+        ],
+        'data_center': _text(mmd_xml, 'mmd:data_center/mmd:data_center_name/mmd:long_name'),
+        'data_center_url': _text(mmd_xml, 'mmd:data_center/mmd:data_center_url'),
+        'file_name': _text(mmd_xml, 'mmd:storage_information/mmd:file_name'),
+        'file_format': _text(mmd_xml, 'mmd:storage_information/mmd:file_format'),
+        'file_size_mb': _float(_text(mmd_xml, 'mmd:storage_information/mmd:file_size')),
+        'checksum': _text(mmd_xml, 'mmd:storage_information/mmd:checksum'),
+        'platform': _text(mmd_xml, 'mmd:platform/mmd:short_name'),
+        'orbit_relative': _text(mmd_xml, 'mmd:platform/mmd:orbit_relative'),
+        'orbit_absolute': _text(mmd_xml, 'mmd:platform/mmd:orbit_absolute'),
+        'orbit_direction': _text(mmd_xml, 'mmd:platform/mmd:orbit_direction'),
+        'instrument': _text(mmd_xml, 'mmd:platform/mmd:instrument/mmd:short_name'),
+        'instrument_mode': _text(mmd_xml, 'mmd:platform/mmd:instrument/mmd:mode'),
+        'polarisation': _text(mmd_xml, 'mmd:platform/mmd:instrument/mmd:polarisation'),
+        'product_type': _text(mmd_xml, 'mmd:platform/mmd:instrument/mmd:product_type'),
+        'data_access': [
+            (_text(d, 'mmd:type'), _text(d, 'mmd:description'), _text(d, 'mmd:resource'))
+            for d in mmd_xml.findall('mmd:data_access', MMD_NS)
+        ],
+        'parent_id': _text(mmd_xml, 'mmd:related_dataset[@relation_type="parent"]'),
+    }
+
+
+def _write_bytes(path, data, update, unchanged):
+    """
+    Write data to path. In update mode an existing file is kept if unchanged(existing_bytes)
+    is True. Returns True if the file was written.
+    """
+    if update and os.path.exists(path):
+        with open(path, 'rb') as fh:
+            if unchanged(fh.read()):
+                return False
+    with open(path, 'wb') as fh:
+        fh.write(data)
+    return True
+
+
+# MMD
+
+def keep_current(mmd_path, product_path):
+    """
+    Give an MMD file left unchanged by an update the modification time of its
+    product file if that is newer, so archive reconciliation does not report
+    it as outdated again. Files already newer than their product are left alone.
+    """
+    try:
+        product_mtime = os.stat(product_path).st_mtime_ns
+        mmd_stat = os.stat(mmd_path)
+    except (OSError, TypeError, ValueError):
+        return
+    if mmd_stat.st_mtime_ns < product_mtime:
+        os.utime(mmd_path, ns=(mmd_stat.st_atime_ns, product_mtime))
+
+
+def write_mmd_output(mmd_xml, summary, metadata, output_path, update=False):
+    return save_xml_to_file(mmd_xml, output_path, update=update)
+
+
+# STAC Item
+
+def mmd_to_stac(summary, metadata):
+    """
+    Render a STAC Item (1.0.0) from the MMD summary, with the footprint from the metadata.
+    """
+    polygon = metadata.get('polygon') if metadata else None
+    bbox = None
+    if None not in (summary['west'], summary['south'], summary['east'], summary['north']):
+        bbox = [summary['west'], summary['south'], summary['east'], summary['north']]
+    if polygon is not None and not isinstance(polygon, str):
+        geometry = mapping(polygon)
+    elif bbox:
+        geometry = mapping(box(*bbox))
+    else:
+        geometry = None
+
+    extensions = []
+    properties = {
+        'title': summary['title'],
+        'description': summary['abstract'],
+        'datetime': _rfc3339(summary['start']),
+        'start_datetime': _rfc3339(summary['start']),
+        'end_datetime': _rfc3339(summary['end']),
+        'updated': _rfc3339(summary['updated']),
+        'platform': summary['platform'].lower() if summary['platform'] else None,
+        'constellation': summary['platform'][:-1].lower() if summary['platform'] else None,
+        'instruments': [summary['instrument'].lower()] if summary['instrument'] else [],
+        'keywords': [keyword for _, keywords in summary['keywords'] for keyword in keywords],
+        'providers': [{
+            'name': summary['data_center'],
+            'roles': ['host', 'processor'],
+            'url': summary['data_center_url'],
+        }],
+        'license': 'proprietary',
+    }
+    if summary['orbit_absolute'] or summary['orbit_relative'] or summary['orbit_direction']:
+        extensions.append('https://stac-extensions.github.io/sat/v1.0.0/schema.json')
+        if summary['orbit_direction']:
+            properties['sat:orbit_state'] = summary['orbit_direction']
+        if summary['orbit_absolute']:
+            properties['sat:absolute_orbit'] = int(summary['orbit_absolute'])
+        if summary['orbit_relative']:
+            properties['sat:relative_orbit'] = int(summary['orbit_relative'])
+    if summary['polarisation']:
+        extensions.append('https://stac-extensions.github.io/sar/v1.0.0/schema.json')
+        properties['sar:instrument_mode'] = summary['instrument_mode']
+        properties['sar:polarizations'] = summary['polarisation'].split('+')
+    if metadata and metadata.get('cloudCover') is not None:
+        extensions.append('https://stac-extensions.github.io/eo/v1.1.0/schema.json')
+        properties['eo:cloud_cover'] = float(metadata['cloudCover'])
+
+    assets = {}
+    for access_type, description, resource in summary['data_access']:
+        if access_type == 'HTTP':
+            asset = {
+                'href': resource,
+                'type': FILE_MEDIA_TYPES.get(summary['file_format']),
+                'title': summary['file_name'],
+                'description': description,
+                'roles': ['data'],
+            }
+            if summary['checksum'] and len(summary['checksum']) == 32:
+                # Multihash of an MD5 digest: function code 0xd5, length 0x10
+                asset['file:checksum'] = 'd510' + summary['checksum']
+            if summary['file_size_mb'] is not None:
+                asset['file:size'] = int(summary['file_size_mb'] * 1024 * 1024)
+            assets['data'] = asset
+            extensions.append('https://stac-extensions.github.io/file/v2.1.0/schema.json')
+        elif resource:
+            assets[access_type.lower().replace(' ', '_')] = {
+                'href': resource,
+                'description': description,
+                'roles': ['visual' if access_type == 'OGC WMS' else 'data'],
+            }
+
+    item = {
+        'type': 'Feature',
+        'stac_version': '1.0.0',
+        'stac_extensions': extensions,
+        'id': summary['id'],
+        'geometry': geometry,
+        'bbox': bbox,
+        'properties': properties,
+        'links': [],
+        'assets': assets,
+    }
+    if summary['parent_id']:
+        item['collection'] = summary['parent_id']
+    return item
+
+
+def _stac_unchanged(item):
+    def unchanged(existing):
+        try:
+            existing_item = json.loads(existing)
+        except ValueError:
+            return False
+        existing_item.get('properties', {}).pop('updated', None)
+        new_item = json.loads(json.dumps(item))
+        new_item['properties'].pop('updated', None)
+        return existing_item == new_item
+    return unchanged
+
+
+def write_stac_output(mmd_xml, summary, metadata, output_path, update=False):
+    item = mmd_to_stac(summary, metadata)
+    data = json.dumps(item, indent=2).encode('utf-8')
+    return _write_bytes(output_path, data, update, _stac_unchanged(item))
+
+
+# ISO 19115/19139
+
+def _iso(tag, ns=GMD):
+    return f'{{{ns}}}{tag}'
+
+
+def _iso_string(parent, tag, text):
+    element = ET.SubElement(parent, _iso(tag))
+    ET.SubElement(element, _iso('CharacterString', GCO)).text = text
+    return element
+
+
+def _iso_code(parent, tag, code_list, value):
+    element = ET.SubElement(parent, _iso(tag))
+    code = ET.SubElement(element, _iso(code_list))
+    code.attrib['codeList'] = f'{ISO_CODELISTS}#{code_list}'
+    code.attrib['codeListValue'] = value
+    code.text = value
+    return element
+
+
+def _iso_party(parent, tag, person, role):
+    element = ET.SubElement(parent, _iso(tag))
+    party = ET.SubElement(element, _iso('CI_ResponsibleParty'))
+    if person.get('name'):
+        _iso_string(party, 'individualName', person['name'])
+    if person.get('organisation'):
+        _iso_string(party, 'organisationName', person['organisation'])
+    if person.get('email'):
+        contact = ET.SubElement(ET.SubElement(party, _iso('contactInfo')), _iso('CI_Contact'))
+        address = ET.SubElement(ET.SubElement(contact, _iso('address')), _iso('CI_Address'))
+        _iso_string(address, 'electronicMailAddress', person['email'])
+    _iso_code(party, 'role', 'CI_RoleCode', role)
+
+
+def _find_person(summary, role):
+    return next((p for p in summary['personnel'] if p['role'] == role), None)
+
+
+def mmd_to_iso19139(summary):
+    """
+    Render ISO 19115 metadata in the ISO 19139 XML encoding from the MMD summary.
+    """
+    root = ET.Element(_iso('MD_Metadata'), nsmap=ISO_NSMAP)
+    _iso_string(root, 'fileIdentifier', summary['id'])
+    _iso_code(root, 'language', 'LanguageCode', 'eng')
+    _iso_code(root, 'characterSet', 'MD_CharacterSetCode', 'utf8')
+    if summary['parent_id']:
+        _iso_string(root, 'parentIdentifier', summary['parent_id'])
+    _iso_code(root, 'hierarchyLevel', 'MD_ScopeCode', 'dataset')
+
+    author = _find_person(summary, 'Metadata author')
+    if author:
+        _iso_party(root, 'contact', author, 'pointOfContact')
+
+    date_stamp = ET.SubElement(root, _iso('dateStamp'))
+    ET.SubElement(date_stamp, _iso('DateTime', GCO)).text = summary['updated']
+    _iso_string(root, 'metadataStandardName', 'ISO 19115:2003/19139')
+    _iso_string(root, 'metadataStandardVersion', '1.0')
+
+    identification = ET.SubElement(ET.SubElement(root, _iso('identificationInfo')), _iso('MD_DataIdentification'))
+    citation = ET.SubElement(ET.SubElement(identification, _iso('citation')), _iso('CI_Citation'))
+    _iso_string(citation, 'title', summary['title'])
+    citation_date = ET.SubElement(ET.SubElement(citation, _iso('date')), _iso('CI_Date'))
+    ET.SubElement(ET.SubElement(citation_date, _iso('date')), _iso('DateTime', GCO)).text = summary['start']
+    _iso_code(citation_date, 'dateType', 'CI_DateTypeCode', 'creation')
+    _iso_string(identification, 'abstract', summary['abstract'])
+    if summary['production_status'] in PROGRESS_CODES:
+        _iso_code(identification, 'status', 'MD_ProgressCode', PROGRESS_CODES[summary['production_status']])
+
+    contact = _find_person(summary, 'Data center contact')
+    if contact:
+        _iso_party(identification, 'pointOfContact', contact, 'distributor')
+
+    for vocabulary, keywords in summary['keywords']:
+        md_keywords = ET.SubElement(ET.SubElement(identification, _iso('descriptiveKeywords')), _iso('MD_Keywords'))
+        for keyword in keywords:
+            _iso_string(md_keywords, 'keyword', keyword)
+        thesaurus = ET.SubElement(ET.SubElement(md_keywords, _iso('thesaurusName')), _iso('CI_Citation'))
+        _iso_string(thesaurus, 'title', vocabulary)
+        thesaurus_date = ET.SubElement(thesaurus, _iso('date'))
+        thesaurus_date.attrib[f'{{{GCO}}}nilReason'] = 'unknown'
+
+    if summary['license_text']:
+        constraints = ET.SubElement(ET.SubElement(identification, _iso('resourceConstraints')), _iso('MD_Constraints'))
+        _iso_string(constraints, 'useLimitation', summary['license_text'])
+    if summary['access_constraint']:
+        legal = ET.SubElement(ET.SubElement(identification, _iso('resourceConstraints')), _iso('MD_LegalConstraints'))
+        _iso_code(legal, 'accessConstraints', 'MD_RestrictionCode', 'otherRestrictions')
+        _iso_string(legal, 'otherConstraints', summary['access_constraint'])
+
+    _iso_code(identification, 'language', 'LanguageCode', 'eng')
+    for topic in summary['iso_topics']:
+        topic_element = ET.SubElement(identification, _iso('topicCategory'))
+        ET.SubElement(topic_element, _iso('MD_TopicCategoryCode')).text = topic
+
+    extent = ET.SubElement(ET.SubElement(identification, _iso('extent')), _iso('EX_Extent'))
+    if None not in (summary['west'], summary['east'], summary['south'], summary['north']):
+        bbox = ET.SubElement(ET.SubElement(extent, _iso('geographicElement')), _iso('EX_GeographicBoundingBox'))
+        for tag, key in [('westBoundLongitude', 'west'), ('eastBoundLongitude', 'east'),
+                         ('southBoundLatitude', 'south'), ('northBoundLatitude', 'north')]:
+            ET.SubElement(ET.SubElement(bbox, _iso(tag)), _iso('Decimal', GCO)).text = str(summary[key])
+    if summary['start']:
+        temporal = ET.SubElement(ET.SubElement(extent, _iso('temporalElement')), _iso('EX_TemporalExtent'))
+        period = ET.SubElement(ET.SubElement(temporal, _iso('extent')), _iso('TimePeriod', GML))
+        period.attrib[f'{{{GML}}}id'] = 'temporal_extent'
+        ET.SubElement(period, _iso('beginPosition', GML)).text = summary['start']
+        end = ET.SubElement(period, _iso('endPosition', GML))
+        if summary['end']:
+            end.text = summary['end']
+        else:
+            end.attrib['indeterminatePosition'] = 'now'
+
+    distribution = ET.SubElement(ET.SubElement(root, _iso('distributionInfo')), _iso('MD_Distribution'))
+    if summary['file_format']:
+        md_format = ET.SubElement(ET.SubElement(distribution, _iso('distributionFormat')), _iso('MD_Format'))
+        _iso_string(md_format, 'name', summary['file_format'])
+        version = ET.SubElement(md_format, _iso('version'))
+        version.attrib[f'{{{GCO}}}nilReason'] = 'unknown'
+    if summary['data_access']:
+        transfer = ET.SubElement(ET.SubElement(distribution, _iso('transferOptions')), _iso('MD_DigitalTransferOptions'))
+        for access_type, description, resource in summary['data_access']:
+            online = ET.SubElement(ET.SubElement(transfer, _iso('onLine')), _iso('CI_OnlineResource'))
+            linkage = ET.SubElement(online, _iso('linkage'))
+            ET.SubElement(linkage, _iso('URL')).text = resource
+            _iso_string(online, 'protocol', access_type)
+            _iso_string(online, 'description', description)
+    return root
+
+
+def _iso_unchanged(iso_xml):
+    def canonical(root):
+        for date_stamp in root.findall(_iso('dateStamp')):
+            root.remove(date_stamp)
+        return ET.tostring(root, method='c14n')
+
+    def unchanged(existing):
+        try:
+            existing_root = ET.fromstring(existing, ET.XMLParser(remove_blank_text=True))
+        except ET.XMLSyntaxError:
+            return False
+        return canonical(existing_root) == canonical(ET.fromstring(ET.tostring(iso_xml)))
+    return unchanged
+
+
+def write_iso19139_output(mmd_xml, summary, metadata, output_path, update=False):
+    iso_xml = mmd_to_iso19139(summary)
+    data = ET.tostring(iso_xml, encoding='utf-8', xml_declaration=True, pretty_print=True)
+    return _write_bytes(output_path, data, update, _iso_unchanged(iso_xml))
+
+
+WRITERS = {
+    'mmd': write_mmd_output,
+    'stac': write_stac_output,
+    'iso19139': write_iso19139_output,
+}
+
+
+def write_outputs(formats, mmd_xml, metadata, output_path, update=False):
+    """
+    Write the product metadata in each of the formats, concurrently. All formats
+    are rendered from the same MMD element tree and metadata, so the product is
+    only read once. Returns a dictionary of format to (path, written).
+    """
+    summary = mmd_summary(mmd_xml)
+    paths = {output_format: output_path_for(output_path, output_format) for output_format in formats}
+    if len(formats) == 1:
+        output_format = formats[0]
+        written = WRITERS[output_format](mmd_xml, summary, metadata, paths[output_format], update)
+        return {output_format: (paths[output_format], written)}
+
+    with ThreadPoolExecutor(max_workers=len(formats)) as pool:
+        futures = {
+            output_format: pool.submit(WRITERS[output_format], mmd_xml, summary, metadata, paths[output_format], update)
+            for output_format in formats
+        }
+        return {output_format: (paths[output_format], future.result()) for output_format, future in futures.items()}
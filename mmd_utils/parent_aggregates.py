@@ -0,0 +1,256 @@
+import os
+import sqlite3
+from datetime import datetime, timezone
+import pandas as pd
+from lxml import etree as ET
+from mmd_utils.config_handling import save_xml_to_file
+from mmd_utils.filename_parser import parse_product_name
+from mmd_utils.mmd_update import load_mmd
+from mmd_utils.xml_creation import prepend_mmd
+
+MMD_NS = {'mmd': 'http://www.met.no/schema/mmd'}
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS parents (
+    parent_id TEXT PRIMARY KEY,
+    platform TEXT,
+    product_type TEXT,
+    start_date TEXT,
+    end_date TEXT,
+    north REAL,
+    south REAL,
+    east REAL,
+    west REAL,
+    child_count INTEGER NOT NULL,
+    total_size_mb REAL NOT NULL,
+    updated TEXT
+);
+CREATE TABLE IF NOT EXISTS children (
+    filename TEXT PRIMARY KEY,
+    parent_id TEXT NOT NULL,
+    file_size_mb REAL
+);
+"""
+
+# Extents only grow: dates and bounds are merged with MIN/MAX, ignoring NULLs.
+# The child count and size are adjusted by the caller for children seen before.
+UPSERT_PARENT = """
+INSERT INTO parents (parent_id, platform, product_type, start_date, end_date, north, south, east, west,
+                     child_count, total_size_mb, updated)
+VALUES (:parent_id, :platform, :product_type, :start_date, :end_date, :north, :south, :east, :west,
+        :count, :size, :updated)
+ON CONFLICT(parent_id) DO UPDATE SET
+    start_date = MIN(COALESCE(start_date, excluded.start_date), COALESCE(excluded.start_date, start_date)),
+    end_date = MAX(COALESCE(end_date, excluded.end_date), COALESCE(excluded.end_date, end_date)),
+    north = MAX(COALESCE(north, excluded.north), COALESCE(excluded.north, north)),
+    south = MIN(COALESCE(south, excluded.south), COALESCE(excluded.south, south)),
+    east = MAX(COALESCE(east, excluded.east), COALESCE(excluded.east, east)),
+    west = MIN(COALESCE(west, excluded.west), COALESCE(excluded.west, west)),
+    child_count = child_count + excluded.child_count,
+    total_size_mb = total_size_mb + excluded.total_size_mb,
+    updated = excluded.updated
+"""
+
+COLUMNS = ['parent_id', 'platform', 'product_type', 'start_date', 'end_date', 'north', 'south', 'east', 'west',
+           'child_count', 'total_size_mb', 'updated']
+
+
+def _text(root, path):
+    element = root.find(path, MMD_NS)
+    if element is None or element.text is None:
+        return None
+    return element.text.strip()
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _date(value):
+    if value is None:
+        return None
+    timestamp = pd.to_datetime(value, utc=True, errors='coerce')
+    if pd.isna(timestamp):
+        return None
+    return timestamp.strftime(DATE_FORMAT)
+
+
+def child_summary(mmd_xml):
+    """
+    Read what the parent aggregates need from a child MMD element tree.
+    Returns None if the MMD has no parent.
+    """
+    parent_id = None
+    for related in mmd_xml.findall('mmd:related_dataset', MMD_NS):
+        if related.get('relation_type') == 'parent':
+            parent_id = related.text
+    if not parent_id:
+        return None
+    filename = _text(mmd_xml, 'mmd:storage_information/mmd:file_name')
+    product = parse_product_name(filename) if filename else None
+    return {
+        'filename': filename,
+        'parent_id': parent_id,
+        'platform': product.platform if product else None,
+        'product_type': _text(mmd_xml, 'mmd:platform/mmd:instrument/mmd:product_type'),
+        'start_date': _date(_text(mmd_xml, 'mmd:temporal_extent/mmd:start_date')),
+        'end_date': _date(_text(mmd_xml, 'mmd:temporal_extent/mmd:end_date')),
+        'north': _float(_text(mmd_xml, 'mmd:geographic_extent/mmd:rectangle/mmd:north')),
+        'south': _float(_text(mmd_xml, 'mmd:geographic_extent/mmd:rectangle/mmd:south')),
+        'east': _float(_text(mmd_xml, 'mmd:geographic_extent/mmd:rectangle/mmd:east')),
+        'west': _float(_text(mmd_xml, 'mmd:geographic_extent/mmd:rectangle/mmd:west')),
+        'size': _float(_text(mmd_xml, 'mmd:storage_information/mmd:file_size')) or 0.0,
+    }
+
+
+class ParentAggregates:
+    """
+    SQLite store of running aggregates per parent dataset (one per platform and
+    product type in parent_id_mapping.yaml): the earliest start and latest end
+    date, the union of the bounding boxes, the number of children and their
+    total size. Each child MMD updates its parent in O(1), and children seen
+    before are only counted once. Extents only grow, so a child whose extent
+    shrinks on regeneration leaves the parent extent as it was.
+    """
+
+    def __init__(self, db_path, commit_every=100):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.commit_every = commit_every
+        self.pending = 0
+
+    def add(self, mmd_xml):
+        """
+        Update the parent of a child MMD element tree. Returns the parent ID,
+        or None if the MMD has no parent.
+        """
+        child = child_summary(mmd_xml)
+        if child is None:
+            return None
+        count = 1
+        size = child['size']
+        if child['filename']:
+            previous = self.conn.execute(
+                'SELECT parent_id, file_size_mb FROM children WHERE filename = ?', (child['filename'],)
+            ).fetchone()
+            if previous is not None and previous[0] == child['parent_id']:
+                count = 0
+                size -= previous[1] or 0.0
+            elif previous is not None:
+                # The child moved to another parent (e.g. a mapping change)
+                self.conn.execute(
+                    'UPDATE parents SET child_count = child_count - 1, total_size_mb = total_size_mb - ? WHERE parent_id = ?',
+                    (previous[1] or 0.0, previous[0])
+                )
+            self.conn.execute(
+                'INSERT OR REPLACE INTO children (filename, parent_id, file_size_mb) VALUES (?, ?, ?)',
+                (child['filename'], child['parent_id'], child['size'])
+            )
+        self.conn.execute(UPSERT_PARENT, dict(
+            child, count=count, size=size, updated=datetime.now(timezone.utc).strftime(DATE_FORMAT)
+        ))
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+        return child['parent_id']
+
+    def add_file(self, mmd_path):
+        return self.add(load_mmd(mmd_path))
+
+    def parents(self):
+        """
+        Return the aggregates of all parents as dictionaries.
+        """
+        cursor = self.conn.execute(f'SELECT {", ".join(COLUMNS)} FROM parents ORDER BY platform, product_type')
+        return [dict(zip(COLUMNS, row)) for row in cursor]
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _set_child_text(parent, tag, text):
+    element = parent.find(prepend_mmd(tag))
+    if element is None:
+        element = ET.SubElement(parent, prepend_mmd(tag))
+    element.text = text
+
+
+def set_parent_extent(root, aggregate):
+    """
+    Set the temporal extent and bounding box of a parent MMD element tree from
+    its aggregate, keeping the rest of the record.
+    """
+    if aggregate['start_date']:
+        temporal_extent = root.find(prepend_mmd('temporal_extent'))
+        if temporal_extent is None:
+            temporal_extent = ET.SubElement(root, prepend_mmd('temporal_extent'))
+        _set_child_text(temporal_extent, 'start_date', aggregate['start_date'])
+        _set_child_text(temporal_extent, 'end_date', aggregate['end_date'])
+
+    if None not in (aggregate['north'], aggregate['south'], aggregate['east'], aggregate['west']):
+        geographic_extent = root.find(prepend_mmd('geographic_extent'))
+        if geographic_extent is None:
+            geographic_extent = ET.SubElement(root, prepend_mmd('geographic_extent'))
+        rectangle = geographic_extent.find(prepend_mmd('rectangle'))
+        if rectangle is None:
+            rectangle = ET.Element(prepend_mmd('rectangle'))
+            geographic_extent.insert(0, rectangle)
+        rectangle.attrib['srsName'] = 'EPSG:4326'
+        for side in ('north', 'south', 'east', 'west'):
+            _set_child_text(rectangle, side, str(aggregate[side]))
+    return root
+
+
+def new_parent_mmd(parent_id):
+    """
+    Minimal parent MMD with only an identifier and an update history, for
+    parents without an existing record.
+    """
+    root = ET.Element(prepend_mmd('mmd'), nsmap=MMD_NS)
+    identifier = ET.SubElement(root, prepend_mmd('metadata_identifier'))
+    identifier.text = parent_id
+    last_metadata_update = ET.SubElement(root, prepend_mmd('last_metadata_update'))
+    update = ET.SubElement(last_metadata_update, prepend_mmd('update'))
+    ET.SubElement(update, prepend_mmd('datetime')).text = datetime.now(timezone.utc).strftime(DATE_FORMAT)
+    ET.SubElement(update, prepend_mmd('type')).text = 'Created'
+    ET.SubElement(update, prepend_mmd('note'))
+    return root
+
+
+def write_parent_extents(aggregates, output_dir, parent_mmd_dir=None):
+    """
+    Write parent MMD files with extents from the aggregates, one per parent, in
+    O(parents). Existing parent records in parent_mmd_dir (<parent_id>.xml) are
+    updated; otherwise a minimal record is written. Files whose extents did not
+    change are left alone. Returns the number of files written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    written = 0
+    for aggregate in aggregates.parents():
+        parent_id = aggregate['parent_id']
+        source = os.path.join(parent_mmd_dir, f'{parent_id}.xml') if parent_mmd_dir else None
+        if source and os.path.exists(source):
+            root = load_mmd(source)
+        else:
+            root = new_parent_mmd(parent_id)
+        set_parent_extent(root, aggregate)
+        if save_xml_to_file(root, os.path.join(output_dir, f'{parent_id}.xml'), update=True):
+            written += 1
+    return written
@@ -0,0 +1,310 @@
+import functools
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import pandas as pd
+from lxml import etree as ET
+from mmd_utils.config_handling import configure_logging, load_config
+from mmd_utils.metadata_extraction import extract_metadata, ODATA_URL
+from mmd_utils.odata_mirror import open_mirror, get_fallback_metadata
+from mmd_utils.mmd_helpers import create_xml, generate_nbs_id, fill_storage_information
+from mmd_utils.catalogue import catalogue_record
+from mmd_utils.output_writers import keep_current, write_outputs
+from mmd_utils.io_throttle import configure_io
+from mmd_utils.enrichment import provisional_metadata
+from mmd_utils.mmd_update import mark_provisional
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class Stage:
+    """
+    One stage of a pipeline: a function applied to each item on its own pool of
+    threads, or of processes for CPU-bound work. At most max_in_flight items
+    are submitted to the pool at a time.
+    """
+
+    def __init__(self, name, function, workers, processes=False, initializer=None, initargs=(), max_in_flight=None):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.processes = processes
+        self.initializer = initializer
+        self.initargs = initargs
+        self.max_in_flight = max_in_flight or 2 * workers
+
+    def executor(self):
+        if self.processes:
+            return ProcessPoolExecutor(self.workers, initializer=self.initializer, initargs=self.initargs)
+        return ThreadPoolExecutor(self.workers, initializer=self.initializer, initargs=self.initargs)
+
+
+def _feed(items, out_queue, stop, errors):
+    try:
+        for item in items:
+            if stop.is_set():
+                break
+            out_queue.put(item)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        # Always end the stream, or every stage would wait forever
+        out_queue.put(_END)
+
+
+def _run_stage(stage, executor, in_queue, out_queue):
+    slots = threading.Semaphore(stage.max_in_flight)
+
+    def done(future, item):
+        try:
+            result = future.result()
+        except Exception as e:
+            result = dict(item, error=f'{stage.name}: {e}')
+        out_queue.put(result)
+        slots.release()
+
+    while True:
+        item = in_queue.get()
+        if item is _END:
+            break
+        if item.get('error'):
+            # Failed items are passed on untouched
+            out_queue.put(item)
+            continue
+        slots.acquire()
+        future = executor.submit(stage.function, item)
+        future.add_done_callback(functools.partial(done, item=item))
+
+    # Wait for the items in flight before signalling the next stage
+    for _ in range(stage.max_in_flight):
+        slots.acquire()
+    out_queue.put(_END)
+
+
+def run_pipeline(items, stages, queue_size=64):
+    """
+    Pass work items (dictionaries) through the stages and yield them as they
+    leave the last stage, not necessarily in input order. Stages are connected
+    by bounded queues, so a slow stage holds back the ones before it and memory
+    stays bounded. An exception in a stage is stored in the item's 'error' key
+    and the item skips the remaining stages. An exception raised by the items
+    iterator is raised once the items before it have left the pipeline. If
+    the caller stops early, no more items are fed and the items in flight are
+    finished and dropped.
+    """
+    queues = [queue.Queue(queue_size) for _ in range(len(stages) + 1)]
+    executors = [stage.executor() for stage in stages]
+    stop = threading.Event()
+    feed_errors = []
+    threads = [threading.Thread(target=_feed, args=(items, queues[0], stop, feed_errors), daemon=True)]
+    for i, (stage, executor) in enumerate(zip(stages, executors)):
+        threads.append(threading.Thread(
+            target=_run_stage, args=(stage, executor, queues[i], queues[i + 1]), daemon=True
+        ))
+    for thread in threads:
+        thread.start()
+    finished = False
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _END:
+                finished = True
+                break
+            yield item
+    finally:
+        if not finished:
+            stop.set()
+            # Take the items in flight off the last queue so the stages can finish
+            while queues[-1].get() is not _END:
+                pass
+        for thread in threads:
+            thread.join()
+        for executor in executors:
+            executor.shutdown()
+    if feed_errors:
+        raise feed_errors[0]
+
+
+# Stages for generating MMD files
+
+_thread_state = threading.local()
+_xml_configs = {}
+
+
+def extract_stage(item, create_id=False, swath_footprint=False):
+    """
+    Read the metadata from the product file (disk or HTTP range reads).
+    """
+    id = generate_nbs_id(item['filename']) if create_id else None
+    metadata, id = extract_metadata(item['filename'], item['filepath'], item.get('json_metadata'), id, swath_footprint)
+    return dict(item, metadata=metadata, id=id)
+
+
+def odata_stage(item, odata_mirror=None, odata_url=ODATA_URL, odata_budget=None):
+    """
+    Fall back to the OData mirror and API when the extracted metadata is insufficient.
+    Each thread keeps its own connection to the mirror. With an odata_budget in
+    seconds, an item OData does not answer for in time is marked provisional
+    and completed from its local metadata, see provisional_item.
+    """
+    mirror = None
+    if odata_mirror:
+        mirror = getattr(_thread_state, 'mirror', None)
+        if mirror is None:
+            mirror = _thread_state.mirror = open_mirror(odata_mirror, read_only=True)
+    basename = item['filename'].split('.')[0]
+    query_options = {}
+    if odata_budget is not None:
+        query_options['deadline'] = time.monotonic() + odata_budget
+    metadata, id = get_fallback_metadata(
+        item['metadata'], item['id'], basename, item['filepath'], mirror, odata_url, **query_options
+    )
+    if not metadata:
+        if odata_budget is not None:
+            return provisional_item(item)
+        raise ValueError(f"No metadata found for {item['filename']}")
+    return dict(item, metadata=metadata, id=id)
+
+
+def provisional_item(item):
+    """
+    Keep the metadata read from the product file, completed from the product
+    name, so a provisional MMD file can be written now and completed from OData
+    later. The identifier is kept through the enrichment, so one is created if
+    the product file has none.
+    """
+    logger.warning(f"No OData metadata for {item['filename']} within the budget, writing a provisional MMD file")
+    metadata = provisional_metadata(item['metadata'] or {}, item['filename'])
+    return dict(item, metadata=metadata, id=item['id'] or generate_nbs_id(item['filename']), provisional=True)
+
+
+def checksum_stage(item):
+    """
+    Compute the file size and MD5 checksum, unless they are already known.
+    """
+    if item['metadata']:
+        fill_storage_information(item['metadata'], item['filepath'])
+    return item
+
+
+def _init_xml_worker(script_dir, global_attributes_config, platform_metadata_config, product_metadata_csv):
+    # Processes that are not forked do not inherit the logging configuration
+    configure_logging()
+    _xml_configs['script_dir'] = script_dir
+    _xml_configs['global_attributes'] = load_config(global_attributes_config)
+    _xml_configs['platform_metadata'] = load_config(platform_metadata_config)
+    _xml_configs['product_metadata_df'] = pd.read_csv(product_metadata_csv)
+
+
+def _init_prepare_worker(io_settings, *xml_args):
+    # Worker processes are spawned, so the read budget of the parent is not inherited
+    configure_io(*io_settings)
+    _init_xml_worker(*xml_args)
+
+
+def xml_stage(item):
+    """
+    Build the MMD element tree in a worker process and return it serialized.
+    """
+    mmd_xml = create_xml(
+        _xml_configs['script_dir'],
+        item['metadata'],
+        item['id'],
+        _xml_configs['global_attributes'],
+        _xml_configs['platform_metadata'],
+        _xml_configs['product_metadata_df'],
+        item['filename'],
+        item['filepath']
+    )
+    if item.get('provisional'):
+        mark_provisional(mmd_xml)
+    return dict(item, mmd_bytes=ET.tostring(mmd_xml))
+
+
+def prepare_item(item, create_id=False, odata_mirror=None, odata_url=ODATA_URL, swath_footprint=False,
+                 odata_budget=None):
+    """
+    Run all stages on one item in the calling process, e.g. a recycled worker
+    process initialized with _init_prepare_worker. The item is ready for write_mmd.
+    """
+    item = extract_stage(item, create_id, swath_footprint)
+    item = odata_stage(item, odata_mirror, odata_url, odata_budget)
+    item = checksum_stage(item)
+    return xml_stage(item)
+
+
+def worker_functions(script_dir, global_attributes_config, platform_metadata_config, product_metadata_csv,
+                     create_id=False, odata_mirror=None, odata_url=ODATA_URL, swath_footprint=False,
+                     odata_budget=None, io_settings=(None, None, False)):
+    """
+    Function, initializer and initargs preparing items in worker processes,
+    for RecycledWorker and run_recycled. io_settings are the arguments of
+    configure_io for each worker process.
+    """
+    return {
+        'function': functools.partial(
+            prepare_item, create_id=create_id, odata_mirror=odata_mirror, odata_url=odata_url,
+            swath_footprint=swath_footprint, odata_budget=odata_budget
+        ),
+        'initializer': _init_prepare_worker,
+        'initargs': (
+            tuple(io_settings), script_dir, global_attributes_config, platform_metadata_config, product_metadata_csv
+        ),
+    }
+
+
+def mmd_stages(script_dir, global_attributes_config, platform_metadata_config, product_metadata_csv,
+               create_id=False, odata_mirror=None, odata_url=ODATA_URL, swath_footprint=False, odata_budget=None,
+               extract_workers=8, odata_workers=16, checksum_workers=4, xml_workers=None):
+    """
+    Stages for generating MMD files: extraction and checksums on threads (zip
+    reads and hashlib release the GIL), the OData fallback on many threads as it
+    mostly waits on the network, and XML building on processes.
+    """
+    return [
+        Stage('extract', functools.partial(extract_stage, create_id=create_id, swath_footprint=swath_footprint), extract_workers),
+        Stage(
+            'odata',
+            functools.partial(odata_stage, odata_mirror=odata_mirror, odata_url=odata_url, odata_budget=odata_budget),
+            odata_workers
+        ),
+        Stage('checksum', checksum_stage, checksum_workers),
+        Stage(
+            'xml', xml_stage, xml_workers or os.cpu_count(), processes=True, initializer=_init_xml_worker,
+            initargs=(script_dir, global_attributes_config, platform_metadata_config, product_metadata_csv)
+        ),
+    ]
+
+
+def write_mmd(item, update=False, catalogue=None, extraction_store=None, formats=None, parent_aggregates=None,
+              spatial_index=None, enrichment_queue=None):
+    """
+    Write the MMD file (and other formats) of an item that passed through the
+    stages, and add it to the catalogue, extraction store, parent aggregates
+    and spatial index. A provisional item is queued for enrichment.
+    Returns True if any file was written.
+    """
+    output_dir = os.path.dirname(item['mmd_path'])
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    mmd_xml = ET.fromstring(item['mmd_bytes'])
+    outputs = write_outputs(formats or ['mmd'], mmd_xml, item['metadata'], item['mmd_path'], update=update)
+    written = any(output_written for _, output_written in outputs.values())
+    if update and 'mmd' in outputs and not outputs['mmd'][1]:
+        keep_current(outputs['mmd'][0], item['filepath'])
+    if catalogue is not None:
+        catalogue.append(catalogue_record(item['metadata'], item['id'], item['filename'], mmd_xml))
+    if extraction_store is not None:
+        extraction_store.put(item['filename'], item['id'], item['filepath'], item['mmd_path'], item['metadata'], mmd_xml)
+    if parent_aggregates is not None:
+        parent_aggregates.add(mmd_xml)
+    if spatial_index is not None:
+        spatial_index.add(item['filename'], item['id'], item['metadata'])
+    if enrichment_queue is not None and item.get('provisional'):
+        enrichment_queue.put(item, item['metadata'])
+    return written
@@ -0,0 +1,304 @@
+from collections.abc import MutableMapping
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import wkb
+from mmd_utils.mmd_utils import SIOS_POLYGON
+
+# Keys of the metadata passed to create_xml and the attributes holding them
+FIELDS = {
+    'startDate': 'start_date',
+    'completionDate': 'end_date',
+    'north': 'north',
+    'south': 'south',
+    'east': 'east',
+    'west': 'west',
+    'orbitNumber': 'orbit_number',
+    'relativeOrbitNumber': 'relative_orbit_number',
+    'orbitDirection': 'orbit_direction',
+    'cloudCover': 'cloud_cover',
+    'sensorMode': 'sensor_mode',
+    'polarisation': 'polarisation',
+    'md5_checksum': 'md5_checksum',
+    'size': 'size',
+}
+NUMBER_FIELDS = {'north', 'south', 'east', 'west', 'orbit_number', 'relative_orbit_number', 'cloud_cover'}
+DATE_FIELDS = {'start_date': 'start_time', 'end_date': 'end_time'}
+
+
+def to_epoch(value):
+    """
+    Seconds since the epoch of a date string or datetime, or None.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        # Fast path for the ISO 8601 dates in the metadata; pandas infers the
+        # format of every single value, which dominates the cost of a record
+        try:
+            timestamp = datetime.fromisoformat(value)
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            return timestamp.timestamp()
+        except ValueError:
+            pass
+    timestamp = pd.to_datetime(value, utc=True, errors='coerce')
+    if pd.isna(timestamp):
+        return None
+    return timestamp.timestamp()
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    if value is None or type(value) is str:
+        return value
+    return str(value)
+
+
+def _number(value):
+    """
+    Normalise a number read from XML, JSON or HDF5 to int or float. numpy
+    scalars are converted through their text so str() gives the same text in
+    the MMD. Text that would not read back the same (e.g. '45.000000') is kept
+    as text, so MMD files do not change when they are regenerated.
+    """
+    if value is None or type(value) in (int, float):
+        return value
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(str(value))
+    if isinstance(value, (int, float)):
+        return value
+    text = _text(value)
+    for number_type in (int, float):
+        try:
+            number = number_type(text)
+        except ValueError:
+            continue
+        if str(number) == text:
+            return number
+    return text
+
+
+class ProductMetadata(MutableMapping):
+    """
+    Metadata of one product as extracted from the product file or OData, with
+    a slot per field instead of a dictionary. Numbers are normalised to int or
+    float and dates are parsed to seconds since the epoch (start_time and
+    end_time) once, when they are set; the footprint is held as WKB.
+
+    The record is also a mapping with the keys create_xml reads ('startDate',
+    'north', 'polygon', ...), so it can be used wherever the metadata
+    dictionary was. Fields that were never set are missing keys.
+    """
+
+    __slots__ = tuple(FIELDS.values()) + tuple(DATE_FIELDS.values()) + ('footprint_wkb',)
+
+    def __init__(self, fields=None):
+        self.footprint_wkb = None
+        if fields:
+            for key, value in fields.items():
+                self[key] = value
+
+    @classmethod
+    def from_dict(cls, fields):
+        """
+        Build a record from a metadata dictionary, ignoring keys that are not
+        fields (e.g. 'gmlgeometry' in extraction stores written before the
+        record existed).
+        """
+        return cls({key: value for key, value in fields.items() if key in FIELDS or key == 'polygon'})
+
+    @property
+    def polygon(self):
+        return wkb.loads(self.footprint_wkb) if self.footprint_wkb is not None else None
+
+    def __getitem__(self, key):
+        if key == 'polygon':
+            if self.footprint_wkb is None:
+                raise KeyError(key)
+            return self.polygon
+        try:
+            return getattr(self, FIELDS[key])
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key == 'polygon':
+            if isinstance(value, str):
+                value = shapely.from_wkt(value)
+            self.footprint_wkb = wkb.dumps(value) if value is not None else None
+            return
+        name = FIELDS[key]
+        if name in NUMBER_FIELDS:
+            value = _number(value)
+        else:
+            value = _text(value)
+        setattr(self, name, value)
+        if name in DATE_FIELDS:
+            setattr(self, DATE_FIELDS[name], to_epoch(value))
+
+    def __delitem__(self, key):
+        if key == 'polygon':
+            if self.footprint_wkb is None:
+                raise KeyError(key)
+            self.footprint_wkb = None
+            return
+        try:
+            name = FIELDS[key]
+            delattr(self, name)
+        except (KeyError, AttributeError):
+            raise KeyError(key) from None
+        if name in DATE_FIELDS:
+            delattr(self, DATE_FIELDS[name])
+
+    def __contains__(self, key):
+        # A presence check only; the footprint is not decoded
+        if key == 'polygon':
+            return self.footprint_wkb is not None
+        return key in FIELDS and hasattr(self, FIELDS[key])
+
+    def __iter__(self):
+        for key, name in FIELDS.items():
+            if hasattr(self, name):
+                yield key
+        if self.footprint_wkb is not None:
+            yield 'polygon'
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self, polygon=True):
+        """
+        Plain dictionary of the set fields, with the footprint as a shapely
+        geometry unless polygon is False.
+        """
+        fields = {key: getattr(self, name) for key, name in FIELDS.items() if hasattr(self, name)}
+        if polygon and self.footprint_wkb is not None:
+            fields['polygon'] = self.polygon
+        return fields
+
+    def __repr__(self):
+        return f'ProductMetadata({self.to_dict(polygon=False)!r})'
+
+
+def as_product_metadata(metadata):
+    """
+    Return metadata as a ProductMetadata record, converting a dictionary.
+    """
+    if metadata is None or isinstance(metadata, ProductMetadata):
+        return metadata
+    return ProductMetadata.from_dict(metadata)
+
+
+def _float_or_nan(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class ProductMetadataBatch:
+    """
+    Column-wise container of the metadata of many products: numbers and times
+    in float64 arrays (NaN when missing), text and footprints (WKB) in object
+    arrays. Holding hundreds of thousands of products this way takes a
+    fraction of the memory of as many dictionaries, and bounds, footprints
+    and area tests are computed for all products at once. Numbers kept as text
+    in a ProductMetadata record are stored as floats.
+    """
+
+    NUMBER_COLUMNS = ('north', 'south', 'east', 'west', 'start_time', 'end_time', 'cloud_cover',
+                      'orbit_number', 'relative_orbit_number')
+    TEXT_COLUMNS = ('filename', 'id', 'start_date', 'end_date', 'orbit_direction', 'sensor_mode', 'polarisation',
+                    'md5_checksum', 'size', 'footprint_wkb')
+
+    def __init__(self, capacity=1024):
+        self.count = 0
+        self.columns = {name: np.full(capacity, np.nan) for name in self.NUMBER_COLUMNS}
+        self.columns.update({name: np.full(capacity, None, dtype=object) for name in self.TEXT_COLUMNS})
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self):
+        for name, column in self.columns.items():
+            grown = np.full(2 * len(column), np.nan if column.dtype != object else None, dtype=column.dtype)
+            grown[:self.count] = column[:self.count]
+            self.columns[name] = grown
+
+    def append(self, filename, id, metadata):
+        metadata = as_product_metadata(metadata)
+        if self.count == len(self.columns['filename']):
+            self._grow()
+        row = self.count
+        self.columns['filename'][row] = filename
+        self.columns['id'][row] = id
+        for name in self.NUMBER_COLUMNS:
+            self.columns[name][row] = _float_or_nan(getattr(metadata, name, None))
+        for name in self.TEXT_COLUMNS[2:]:
+            self.columns[name][row] = getattr(metadata, name, None)
+        self.count += 1
+
+    def extend(self, records):
+        """
+        Append (filename, id, metadata) tuples.
+        """
+        for filename, id, metadata in records:
+            self.append(filename, id, metadata)
+
+    def column(self, name):
+        return self.columns[name][:self.count]
+
+    def __getitem__(self, row):
+        """
+        Return the filename, identifier and ProductMetadata of a row.
+        """
+        if not -self.count <= row < self.count:
+            raise IndexError(row)
+        row %= self.count
+        metadata = ProductMetadata()
+        for key, name in FIELDS.items():
+            value = self.columns[name][row]
+            if name in NUMBER_FIELDS:
+                if not np.isnan(value):
+                    metadata[key] = int(value) if name in ('orbit_number', 'relative_orbit_number') else value
+            elif value is not None:
+                metadata[key] = value
+        metadata.footprint_wkb = self.columns['footprint_wkb'][row]
+        return self.columns['filename'][row], self.columns['id'][row], metadata
+
+    def bounds(self):
+        """
+        (N, 4) array of west, south, east, north.
+        """
+        return np.column_stack([self.column(name) for name in ('west', 'south', 'east', 'north')])
+
+    def footprints(self):
+        """
+        Array of shapely geometries, None where a product has no footprint.
+        """
+        return shapely.from_wkb(self.column('footprint_wkb'))
+
+    def intersects(self, geometry):
+        """
+        Boolean array of the products whose footprint, or else bounding box,
+        intersects the geometry. Products with neither do not intersect.
+        """
+        shapely.prepare(geometry)
+        footprints = self.footprints()
+        boxes = shapely.box(*self.bounds().T)
+        areas = np.where(shapely.is_missing(footprints), boxes, footprints)
+        return shapely.intersects(geometry, areas)
+
+    def within_sios(self):
+        """
+        Boolean array of the products intersecting the SIOS area.
+        """
+        return self.intersects(SIOS_POLYGON)
+
+    def to_frame(self):
+        return pd.DataFrame({name: self.column(name) for name in self.columns})
@@ -0,0 +1,157 @@
+import io
+import threading
+from collections import OrderedDict
+import requests
+from mmd_utils.io_throttle import open_throttled
+
+
+def is_remote(path) -> bool:
+    """
+    Returns True if the path is an HTTP(S) URL rather than a local file.
+    """
+    return isinstance(path, str) and path.startswith(('http://', 'https://'))
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """
+    Read-only, seekable file object backed by HTTP range requests.
+
+    The remote file is split into fixed size blocks that are fetched on demand
+    and kept in a small LRU cache. Consecutive missing blocks are fetched in a
+    single request. This is enough for zipfile and h5py to read the central
+    directory, single members and global attributes of a product without
+    downloading the whole file.
+    """
+
+    def __init__(self, url, block_size=64 * 1024, cache_blocks=32, session=None, timeout=15):
+        super().__init__()
+        self.url = url
+        self.block_size = block_size
+        self.cache_blocks = cache_blocks
+        self.timeout = timeout
+        self._session = session or requests.Session()
+        self._owns_session = session is None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._pos = 0
+        self.bytes_fetched = 0
+        self.requests_made = 0
+        self.size = self._get_size()
+
+    def _get_size(self):
+        response = self._session.head(self.url, allow_redirects=True, timeout=self.timeout)
+        response.raise_for_status()
+        if 'Content-Length' in response.headers:
+            return int(response.headers['Content-Length'])
+
+        # Some servers do not report a length on HEAD, so ask for the first byte instead
+        response = self._session.get(self.url, headers={'Range': 'bytes=0-0'}, timeout=self.timeout)
+        response.raise_for_status()
+        content_range = response.headers.get('Content-Range', '')
+        if response.status_code != 206 or '/' not in content_range:
+            raise IOError(f'Server does not support range requests for {self.url}')
+        return int(content_range.split('/')[-1])
+
+    def _fetch(self, first_block, last_block):
+        start = first_block * self.block_size
+        end = min((last_block + 1) * self.block_size, self.size) - 1
+        response = self._session.get(
+            self.url, headers={'Range': f'bytes={start}-{end}'}, timeout=self.timeout
+        )
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise IOError(f'Server does not support range requests for {self.url}')
+        data = response.content
+        self.requests_made += 1
+        self.bytes_fetched += len(data)
+
+        blocks = {}
+        for index in range(first_block, last_block + 1):
+            offset = (index - first_block) * self.block_size
+            blocks[index] = self._cache[index] = data[offset:offset + self.block_size]
+            self._cache.move_to_end(index)
+        while len(self._cache) > self.cache_blocks:
+            self._cache.popitem(last=False)
+        return blocks
+
+    def _read_range(self, start, end):
+        first_block = start // self.block_size
+        last_block = (end - 1) // self.block_size
+
+        with self._lock:
+            # Fetch each run of missing blocks with a single request. The
+            # blocks are kept here, as a long read may not fit in the cache.
+            blocks = {}
+            index = first_block
+            while index <= last_block:
+                if index in self._cache:
+                    self._cache.move_to_end(index)
+                    blocks[index] = self._cache[index]
+                    index += 1
+                    continue
+                run_end = index
+                while run_end + 1 <= last_block and run_end + 1 not in self._cache:
+                    run_end += 1
+                blocks.update(self._fetch(index, run_end))
+                index = run_end + 1
+
+            chunks = [blocks[index] for index in range(first_block, last_block + 1)]
+
+        data = b''.join(chunks)
+        offset = start - first_block * self.block_size
+        return data[offset:offset + (end - start)]
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._pos + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f'Invalid whence: {whence}')
+        if position < 0:
+            raise ValueError('Negative seek position')
+        self._pos = position
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            end = self.size
+        else:
+            end = min(self._pos + size, self.size)
+        if self._pos >= end:
+            return b''
+        data = self._read_range(self._pos, end)
+        self._pos = end
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._cache.clear()
+            if self._owns_session:
+                self._session.close()
+        super().close()
+
+
+def open_source(path):
+    """
+    Opens a local path or an HTTP(S) URL as a binary, seekable file object.
+    """
+    if is_remote(path):
+        return HTTPRangeFile(path)
+    return open_throttled(path)
@@ -0,0 +1,273 @@
+import calendar
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from mmd_utils.config_handling import load_config
+from mmd_utils.filename_parser import parse_product_name
+from mmd_utils.json_stream import iter_json_records
+from mmd_utils.mmd_utils import extract_polygon, within_sios
+from mmd_utils.odata_mirror import open_mirror, get_mirror_record
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLASSES_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config', 'priority_classes.yaml')
+
+NAME_CRITERIA = {
+    'missions': 'mission',
+    'platforms': 'platform',
+    'modes': 'mode',
+    'product_types': 'product_type',
+    'timeliness': 'timeliness',
+}
+
+
+class PriorityClass:
+    """
+    A class of products with the same priority, deadline and maximum wait.
+    See config/priority_classes.yaml.
+    """
+
+    def __init__(self, name, priority, deadline_minutes=None, max_wait_minutes=None, match=None):
+        self.name = name
+        self.priority = priority
+        self.deadline_minutes = deadline_minutes
+        self.max_wait_minutes = max_wait_minutes
+        self.match = match or {}
+
+    def matches(self, product, item, now, footprint_lookup):
+        for key, field in NAME_CRITERIA.items():
+            if key in self.match and getattr(product, field) not in self.match[key]:
+                return False
+        if 'max_age_hours' in self.match:
+            sensed = product.stop or product.start
+            if now - calendar.timegm(sensed.timetuple()) > self.match['max_age_hours'] * 3600:
+                return False
+        # The footprint is the expensive criterion, so it is checked last
+        if 'sios' in self.match and item_in_sios(item, product, footprint_lookup) != self.match['sios']:
+            return False
+        return True
+
+    def deadline(self, product):
+        """
+        Deadline as seconds since the epoch, counted from the sensing stop time.
+        """
+        if self.deadline_minutes is None:
+            return None
+        sensed = product.stop or product.start
+        return calendar.timegm(sensed.timetuple()) + self.deadline_minutes * 60
+
+
+def load_priority_classes(config_path=DEFAULT_CLASSES_CONFIG):
+    return [PriorityClass(**entry) for entry in load_config(config_path)['classes']]
+
+
+def _odata_record(item, name):
+    json_metadata = item.get('json_metadata')
+    if isinstance(json_metadata, dict):
+        return json_metadata
+    if json_metadata:
+        for record in iter_json_records(json_metadata):
+            if record.get('Name', '').split('.')[0] == name:
+                return record
+    return None
+
+
+def item_in_sios(item, product, footprint_lookup=None):
+    """
+    Whether the product footprint intersects the SIOS area, from the OData record
+    of the work item or from footprint_lookup (a function of the product name
+    returning an OData record, e.g. a mirror lookup). The result is cached in the
+    item's 'sios' key. Returns None if the footprint is unknown.
+    """
+    if 'sios' in item:
+        return item['sios']
+    record = _odata_record(item, product.name)
+    if record is None and footprint_lookup is not None:
+        record = footprint_lookup(product.name)
+    if record is None or not record.get('Footprint'):
+        return None
+    try:
+        item['sios'] = bool(within_sios(polygon=extract_polygon(record['Footprint'])))
+    except Exception as e:
+        logger.warning(f"Warning: could not read the footprint of {product.name}: {e}")
+        return None
+    return item['sios']
+
+
+def classify(item, classes, now=None, footprint_lookup=None):
+    """
+    Return the priority class and deadline (seconds since the epoch, or None)
+    of a work item. Products whose names cannot be parsed get the last class.
+    """
+    now = time.time() if now is None else now
+    product = parse_product_name(item['filename'])
+    if product is None:
+        return classes[-1], None
+    for priority_class in classes:
+        if priority_class.matches(product, item, now, footprint_lookup):
+            return priority_class, priority_class.deadline(product)
+    return classes[-1], classes[-1].deadline(product)
+
+
+class PriorityScheduler:
+    """
+    Orders work items by priority class and, within a class, by deadline
+    (earliest first; items without a deadline in arrival order). A class that
+    has waited longer than its max_wait_minutes since it was last served is
+    served next, so lower classes are not starved while urgent items keep
+    arriving. Items can be added while others are taken out.
+    """
+
+    def __init__(self, classes, footprint_lookup=None):
+        self.classes = classes
+        self.footprint_lookup = footprint_lookup
+        self.heaps = {priority_class.name: [] for priority_class in classes}
+        self.waiting_since = {}
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def __len__(self):
+        with self.condition:
+            return sum(len(heap) for heap in self.heaps.values())
+
+    def put(self, item):
+        priority_class, deadline = classify(item, self.classes, footprint_lookup=self.footprint_lookup)
+        item = dict(item, priority_class=priority_class.name, deadline=deadline)
+        with self.condition:
+            heap = self.heaps[priority_class.name]
+            if not heap:
+                self.waiting_since.setdefault(priority_class.name, time.monotonic())
+            key = deadline if deadline is not None else float('inf')
+            heapq.heappush(heap, (key, next(self.counter), item))
+            self.condition.notify()
+
+    def close(self):
+        """
+        Signal that no more items will be added.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def _next_class(self):
+        now = time.monotonic()
+        waiting = [priority_class for priority_class in self.classes if self.heaps[priority_class.name]]
+        if not waiting:
+            return None
+        starved = [
+            priority_class for priority_class in waiting
+            if priority_class.max_wait_minutes is not None
+            and now - self.waiting_since[priority_class.name] > priority_class.max_wait_minutes * 60
+        ]
+        if starved:
+            return min(starved, key=lambda priority_class: self.waiting_since[priority_class.name])
+        return min(waiting, key=lambda priority_class: (priority_class.priority, self.heaps[priority_class.name][0][:2]))
+
+    def get(self):
+        """
+        Take the next item, waiting for one to be added. Returns None once the
+        scheduler is closed and empty.
+        """
+        with self.condition:
+            while True:
+                priority_class = self._next_class()
+                if priority_class is not None:
+                    break
+                if self.closed:
+                    return None
+                self.condition.wait()
+            heap = self.heaps[priority_class.name]
+            _, _, item = heapq.heappop(heap)
+            if heap:
+                self.waiting_since[priority_class.name] = time.monotonic()
+            else:
+                self.waiting_since.pop(priority_class.name, None)
+            return item
+
+
+def _fill(items, scheduler):
+    try:
+        for item in items:
+            scheduler.put(item)
+    finally:
+        scheduler.close()
+
+
+def scheduled(items, scheduler):
+    """
+    Yield work items in the order of the scheduler. Items are added from a
+    background thread, so a slow source (e.g. an archive crawl) is consumed
+    while earlier items are processed and urgent items found late still jump
+    the queue.
+    """
+    filler = threading.Thread(target=_fill, args=(items, scheduler), daemon=True)
+    filler.start()
+    while True:
+        item = scheduler.get()
+        if item is None:
+            break
+        yield item
+    filler.join()
+
+
+class DeadlineReport:
+    """
+    Count finished items per priority class, and how many missed their deadline.
+    """
+
+    def __init__(self):
+        self.finished = {}
+        self.missed = {}
+
+    def record(self, item, finished_at=None):
+        name = item.get('priority_class')
+        if name is None:
+            return
+        finished_at = time.time() if finished_at is None else finished_at
+        self.finished[name] = self.finished.get(name, 0) + 1
+        if item.get('deadline') is not None and finished_at > item['deadline']:
+            self.missed[name] = self.missed.get(name, 0) + 1
+
+    def lines(self):
+        return [f"  {name}: {count} products, {self.missed.get(name, 0)} after their deadline"
+                for name, count in self.finished.items()]
+
+
+def mirror_footprint_lookup(db_path):
+    """
+    Footprint lookup in the local OData mirror, with a connection per thread.
+    """
+    local = threading.local()
+
+    def lookup(name):
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = local.conn = open_mirror(db_path, read_only=True)
+        return get_mirror_record(conn, name)
+
+    return lookup
+
+
+def enqueue_scheduled(queue, items, classes, batch_size=100, footprint_lookup=None):
+    """
+    Enqueue work items in batches per priority class, in deadline order, so
+    nodes claim the batches of urgent classes first. Returns the number of
+    batches written per class.
+    """
+    by_class = {priority_class.name: [] for priority_class in classes}
+    for item in items:
+        priority_class, deadline = classify(item, classes, footprint_lookup=footprint_lookup)
+        by_class[priority_class.name].append(dict(item, priority_class=priority_class.name, deadline=deadline))
+    batches = {}
+    for priority_class in classes:
+        class_items = sorted(
+            by_class[priority_class.name],
+            key=lambda item: item['deadline'] if item['deadline'] is not None else float('inf')
+        )
+        if class_items:
+            batches[priority_class.name] = queue.enqueue(class_items, batch_size, priority=priority_class.priority)
+    return batches
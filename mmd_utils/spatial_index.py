@@ -0,0 +1,216 @@
+import sqlite3
+import numpy as np
+import shapely
+from shapely import wkt
+from mmd_utils.extraction_store import deserialize_metadata
+from mmd_utils.mmd_utils import get_bounding_box
+from mmd_utils.product_metadata import ProductMetadataBatch, as_product_metadata, to_epoch
+
+# The R*Tree holds the bounding box and the time span of each product. It stores
+# 32-bit floats, rounded outwards, so it is only used to find candidates; the
+# exact bounds are kept in the products table and checked after. Times in the
+# tree are in days, so a day weighs about as much as a degree when nodes are
+# split; in seconds the time axis dominates and area-only queries visit most
+# of the tree.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    rowid INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    id TEXT,
+    start_time REAL,
+    end_time REAL,
+    north REAL,
+    south REAL,
+    east REAL,
+    west REAL,
+    footprint BLOB
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS extents USING rtree(
+    rowid,
+    min_x, max_x,
+    min_y, max_y,
+    min_t, max_t
+);
+"""
+
+UPSERT_PRODUCT = """
+INSERT INTO products (filename, id, start_time, end_time, north, south, east, west, footprint)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(filename) DO UPDATE SET
+    id = excluded.id,
+    start_time = excluded.start_time,
+    end_time = excluded.end_time,
+    north = excluded.north,
+    south = excluded.south,
+    east = excluded.east,
+    west = excluded.west,
+    footprint = excluded.footprint
+"""
+
+UPSERT_EXTENT = """
+INSERT OR REPLACE INTO extents
+VALUES ((SELECT rowid FROM products WHERE filename = ?), ?, ?, ?, ?, ?, ?)
+"""
+
+# Products without a temporal extent cover all time, and products without a
+# footprint the whole globe, so they are never missed by a query
+MIN_TIME = -1e12
+MAX_TIME = 1e12
+DAY = 86400.0
+
+QUERY = """
+SELECT p.filename, p.id,
+       strftime('%Y-%m-%dT%H:%M:%SZ', p.start_time, 'unixepoch'),
+       strftime('%Y-%m-%dT%H:%M:%SZ', p.end_time, 'unixepoch'),
+       p.footprint
+FROM extents e JOIN products p ON p.rowid = e.rowid
+WHERE e.max_x >= :west AND e.min_x <= :east
+  AND e.max_y >= :south AND e.min_y <= :north
+  AND e.max_t >= :start_day AND e.min_t <= :end_day
+  AND COALESCE(p.east, 180) >= :west AND COALESCE(p.west, -180) <= :east
+  AND COALESCE(p.north, 90) >= :south AND COALESCE(p.south, -90) <= :north
+  AND COALESCE(p.end_time, :end) >= :start AND COALESCE(p.start_time, :start) <= :end
+"""
+
+
+def _bounds(metadata):
+    bounds = [metadata.get(side) for side in ('north', 'south', 'east', 'west')]
+    if not all(isinstance(bound, (int, float)) for bound in bounds):
+        polygon = metadata.polygon
+        bounds = list(get_bounding_box(polygon)) if polygon is not None else [None] * 4
+    return bounds
+
+
+def _extent_row(row):
+    filename, _, start_time, end_time, north, south, east, west, _ = row
+    return (
+        filename,
+        west if west is not None else -180.0,
+        east if east is not None else 180.0,
+        south if south is not None else -90.0,
+        north if north is not None else 90.0,
+        start_time / DAY if start_time is not None else MIN_TIME,
+        end_time / DAY if end_time is not None else MAX_TIME,
+    )
+
+
+class SpatialIndex:
+    """
+    SQLite R*Tree index of the bounding box and temporal extent of generated
+    products, with their footprints as WKB, to find the products covering an
+    area and time window without reading any MMD file.
+    """
+
+    def __init__(self, db_path, commit_every=100):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.commit_every = commit_every
+        self.pending = 0
+
+    def _write(self, rows):
+        self.conn.executemany(UPSERT_PRODUCT, rows)
+        self.conn.executemany(UPSERT_EXTENT, [_extent_row(row) for row in rows])
+        self.pending += len(rows)
+        if self.pending >= self.commit_every:
+            self.commit()
+
+    def add(self, filename, id, metadata):
+        """
+        Add or replace the extent of a product from its extracted metadata.
+        """
+        metadata = as_product_metadata(metadata)
+        north, south, east, west = _bounds(metadata)
+        start_time = getattr(metadata, 'start_time', None)
+        end_time = getattr(metadata, 'end_time', None)
+        if end_time is None:
+            end_time = start_time
+        self._write([(filename, id, start_time, end_time, north, south, east, west, metadata.footprint_wkb)])
+
+    def add_batch(self, batch):
+        """
+        Add or replace the extents of all products in a ProductMetadataBatch.
+        Bounding boxes missing from the metadata are taken from the footprints.
+        """
+        bounds = batch.bounds()
+        missing = np.isnan(bounds).any(axis=1)
+        if missing.any():
+            bounds[missing] = shapely.bounds(batch.footprints()[missing])
+        start_time = batch.column('start_time')
+        end_time = np.where(np.isnan(batch.column('end_time')), start_time, batch.column('end_time'))
+        columns = [start_time, end_time, bounds[:, 3], bounds[:, 1], bounds[:, 2], bounds[:, 0]]
+        # NaN is stored as NULL
+        columns = [np.where(np.isnan(column), None, column).tolist() for column in columns]
+        self._write(list(zip(batch.column('filename'), batch.column('id'), *columns, batch.column('footprint_wkb'))))
+
+    def add_from_store(self, extraction_store):
+        """
+        Index all products of an extraction store. Returns the number indexed.
+        """
+        count = 0
+        for rows in extraction_store.iter_rows():
+            batch = ProductMetadataBatch(len(rows))
+            for filename, id, _, _, metadata_json, polygon_wkb, _, _ in rows:
+                batch.append(filename, id, deserialize_metadata(metadata_json, polygon_wkb))
+            self.add_batch(batch)
+            count += len(batch)
+        self.commit()
+        return count
+
+    def query(self, north=90.0, south=-90.0, east=180.0, west=-180.0, start=None, end=None, aoi=None):
+        """
+        Return (filename, id, start, end) of the products whose bounding box
+        intersects the given box and whose temporal extent overlaps start to
+        end (dates or datetimes; open-ended if None). With aoi, a shapely
+        geometry, its bounds are used and products with a footprint must
+        intersect it.
+        """
+        if aoi is not None:
+            west, south, east, north = aoi.bounds
+        start_time = to_epoch(start)
+        start_time = start_time if start_time is not None else MIN_TIME
+        end_time = to_epoch(end)
+        end_time = end_time if end_time is not None else MAX_TIME
+        cursor = self.conn.execute(QUERY, {
+            'north': north, 'south': south, 'east': east, 'west': west,
+            'start': start_time, 'end': end_time, 'start_day': start_time / DAY, 'end_day': end_time / DAY,
+        })
+        rows = cursor.fetchall()
+        if aoi is None or not rows:
+            return [row[:4] for row in rows]
+        # Test the footprints of all candidates against the AOI in one call
+        footprints = shapely.from_wkb(np.array([row[4] for row in rows], dtype=object))
+        shapely.prepare(aoi)
+        keep = shapely.is_missing(footprints) | shapely.intersects(aoi, footprints)
+        return [row[:4] for row, kept in zip(rows, keep) if kept]
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def parse_aoi(text):
+    """
+    Parse an area of interest given as WKT or as 'west,south,east,north'.
+    """
+    parts = text.split(',')
+    if len(parts) == 4:
+        try:
+            return shapely.box(*(float(part) for part in parts))
+        except ValueError:
+            pass
+    return wkt.loads(text)
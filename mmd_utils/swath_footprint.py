@@ -0,0 +1,103 @@
+import numpy as np
+import shapely
+
+# Every this many scanlines of the swath edges are read (about 55 km for S5P)
+ROW_STEP = 10
+# Sampled rows per segment of the swath turned into one polygon
+SEGMENT_ROWS = 20
+# Tolerance in degrees for simplifying the footprint
+TOLERANCE = 0.01
+
+WORLD = shapely.box(-180, -90, 180, 90)
+EAST_OF_WORLD = shapely.box(180, -90, 540, 90)
+
+
+def find_geolocation(f):
+    """
+    Return the latitude and longitude datasets, (time, scanline, ground_pixel),
+    of an open S5P file: under PRODUCT for level 2 products, or under the
+    first band with geolocation for level 1B products. None if there are none.
+    """
+    groups = ['PRODUCT'] + [f'{name}/STANDARD_MODE/GEODATA' for name in f]
+    for group in groups:
+        if f'{group}/latitude' in f and f'{group}/longitude' in f:
+            return f[f'{group}/latitude'], f[f'{group}/longitude']
+    return None
+
+
+def _edge_rows(dataset, column, step):
+    # Strided hyperslab of one ground pixel column, plus the last scanline
+    rows = dataset[0, ::step, column]
+    last = dataset.shape[1] - 1
+    if last % step:
+        rows = np.append(rows, dataset[0, last, column])
+    return rows.astype(np.float64)
+
+
+def read_swath_edges(latitude, longitude, step=ROW_STEP):
+    """
+    Read the first and last ground pixel of every step-th scanline, as (N, 2)
+    arrays of (lon, lat) for the two edges of the swath. Only these columns
+    are read from the file, so memory does not grow with the swath width.
+    Scanlines where either edge is a fill value are dropped.
+    """
+    left = np.column_stack([_edge_rows(longitude, 0, step), _edge_rows(latitude, 0, step)])
+    right = np.column_stack([_edge_rows(longitude, -1, step), _edge_rows(latitude, -1, step)])
+    valid = (
+        np.isfinite(left).all(axis=1) & np.isfinite(right).all(axis=1)
+        & (np.abs(left[:, 1]) <= 90) & (np.abs(right[:, 1]) <= 90)
+        & (np.abs(left[:, 0]) <= 180) & (np.abs(right[:, 0]) <= 180)
+    )
+    return left[valid], right[valid]
+
+
+def swath_footprint(left, right, segment_rows=SEGMENT_ROWS, tolerance=TOLERANCE):
+    """
+    Build the footprint of a swath from its edges, see read_swath_edges. The
+    swath is cut along track into overlapping segments, each a polygon of its
+    two edges, built all at once. Segments crossing the antimeridian are split
+    at it and segments going round a pole are replaced by the polar cap they
+    cover. Returns a Polygon or MultiPolygon, or None for fewer than two rows.
+    """
+    rows = len(left)
+    if rows < 2:
+        return None
+    segment_rows = max(2, min(segment_rows, rows))
+    # Segments share their first row with the last row of the one before
+    starts = np.minimum(np.arange(0, rows - 1, segment_rows - 1), rows - segment_rows)
+    index = starts[:, None] + np.arange(segment_rows)
+    rings = np.concatenate([left[index], right[index][:, ::-1]], axis=1)
+
+    lon = np.unwrap(rings[..., 0], period=360, axis=1)
+    lat = rings[..., 1]
+    closing = (rings[:, 0, 0] - rings[:, -1, 0] + 180) % 360 - 180
+    around_pole = np.abs(lon[:, -1] - lon[:, 0] + closing) > 180
+
+    # Bring each segment's westernmost point into [-180, 180)
+    lon -= np.floor((lon.min(axis=1, keepdims=True) + 180) / 360) * 360
+    segments = shapely.make_valid(shapely.polygons(np.stack([lon, lat], axis=-1)[~around_pole]))
+    parts = [
+        shapely.intersection(segments, WORLD),
+        shapely.transform(shapely.intersection(segments, EAST_OF_WORLD), lambda coords: coords - (360, 0)),
+    ]
+    if around_pole.any():
+        north = lat[around_pole].mean(axis=1) > 0
+        edge = np.where(north, lat[around_pole].min(axis=1), lat[around_pole].max(axis=1))
+        parts.append(shapely.box(-180, np.where(north, edge, -90), 180, np.where(north, 90, edge)))
+
+    footprint = shapely.union_all(np.concatenate(parts))
+    footprint = shapely.simplify(footprint, tolerance, preserve_topology=True)
+    polygons = [part for part in shapely.get_parts(footprint) if part.geom_type == 'Polygon']
+    if not polygons:
+        return None
+    return polygons[0] if len(polygons) == 1 else shapely.MultiPolygon(polygons)
+
+
+def read_swath_footprint(f, step=ROW_STEP):
+    """
+    Footprint of an open S5P file from the edges of its swath, or None.
+    """
+    geolocation = find_geolocation(f)
+    if geolocation is None:
+        return None
+    return swath_footprint(*read_swath_edges(*geolocation, step=step))
@@ -0,0 +1,243 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from mmd_utils.batch import read_worklist, write_worklist
+
+logger = logging.getLogger(__name__)
+
+QUEUE_STATES = ('pending', 'leased', 'done', 'failed')
+LEASE_SEPARATOR = '@'
+DEFAULT_PRIORITY = 50
+
+
+def default_node_name():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class Lease:
+    """
+    A batch claimed by one node. The lease file is renamed into leased/ with the
+    node name appended, and its modification time is the last heartbeat.
+    """
+
+    def __init__(self, queue, batch, path):
+        self.queue = queue
+        self.batch = batch
+        self.path = path
+        self.lost = False
+
+    def items(self):
+        return list(read_worklist(self.path))
+
+    def heartbeat(self):
+        """
+        Renew the lease. Returns False if the lease was reclaimed by another node.
+        """
+        try:
+            os.utime(self.path)
+            return True
+        except FileNotFoundError:
+            self.lost = True
+            return False
+
+
+class WorkQueue:
+    """
+    Work queue on shared storage (e.g. NFS) without an external service.
+
+    Work items are grouped into batch files that move between state directories
+    with os.rename, which is atomic on the file server:
+        pending/<batch>.jsonl            waiting to be claimed, in name order
+        leased/<batch>.jsonl@<node>      claimed by a node, mtime is the last heartbeat
+        done/<batch>.jsonl               finished
+        failed/<batch>.jsonl             items of a finished batch that failed
+    A lease not renewed within lease_seconds is considered abandoned and the batch
+    is moved back to pending/. Node clocks are compared with file modification
+    times, so lease_seconds should be well above the clock skew between nodes.
+
+    Batch names start with a priority (lower is claimed first) and a timestamp
+    (the earliest deadline of the batch, or its creation time). With max_wait_seconds,
+    batches pending for longer than that are claimed first, oldest first, so
+    low-priority batches are not starved.
+    """
+
+    def __init__(self, queue_dir, node=None, lease_seconds=600, max_wait_seconds=None):
+        self.queue_dir = queue_dir
+        self.node = node or default_node_name()
+        self.lease_seconds = lease_seconds
+        self.max_wait_seconds = max_wait_seconds
+        for state in QUEUE_STATES:
+            os.makedirs(self.state_dir(state), exist_ok=True)
+
+    def state_dir(self, state):
+        return os.path.join(self.queue_dir, state)
+
+    def enqueue(self, items, batch_size=100, priority=DEFAULT_PRIORITY):
+        """
+        Split work items into batch files in pending/. Each batch is written under
+        a temporary name and renamed, so other nodes never see a partial batch.
+        Items with a 'deadline' (seconds since the epoch) should be given in
+        deadline order. Returns the number of batches written.
+        """
+        batches = 0
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                self._write_batch(batch, priority)
+                batches += 1
+                batch = []
+        if batch:
+            self._write_batch(batch, priority)
+            batches += 1
+        return batches
+
+    def _write_batch(self, items, priority=DEFAULT_PRIORITY):
+        deadlines = [item['deadline'] for item in items if item.get('deadline') is not None]
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(min(deadlines) if deadlines else None))
+        name = f'{priority:02d}-{stamp}-{uuid.uuid4().hex[:12]}.jsonl'
+        tmp_path = os.path.join(self.queue_dir, f'.{name}.tmp')
+        write_worklist(items, tmp_path)
+        os.rename(tmp_path, os.path.join(self.state_dir('pending'), name))
+
+    def claim(self):
+        """
+        Claim the next pending batch. Returns a Lease, or None if nothing is pending.
+        """
+        self.reclaim_expired()
+        for batch in self._pending_order():
+            pending_path = os.path.join(self.state_dir('pending'), batch)
+            lease_path = os.path.join(self.state_dir('leased'), batch + LEASE_SEPARATOR + self.node)
+            try:
+                # The rename keeps the modification time, so renew it first: a batch
+                # that waited longer than the lease must not look expired once leased
+                os.utime(pending_path)
+                os.rename(pending_path, lease_path)
+                os.utime(lease_path)
+            except FileNotFoundError:
+                # Another node claimed it first, or reclaimed it in between
+                continue
+            return Lease(self, batch, lease_path)
+        return None
+
+    def _pending_order(self):
+        batches = sorted(os.listdir(self.state_dir('pending')))
+        if not self.max_wait_seconds:
+            return batches
+        now = time.time()
+        waited = []
+        for batch in batches:
+            try:
+                age = now - os.stat(os.path.join(self.state_dir('pending'), batch)).st_mtime
+            except FileNotFoundError:
+                continue
+            if age > self.max_wait_seconds:
+                waited.append((-age, batch))
+        overdue = [batch for _, batch in sorted(waited)]
+        overdue_set = set(overdue)
+        return overdue + [batch for batch in batches if batch not in overdue_set]
+
+    def release(self, lease, failed_items=None):
+        """
+        Mark a leased batch as done, writing failed items to failed/.
+        Returns False if the lease had already been reclaimed by another node.
+        """
+        try:
+            os.rename(lease.path, os.path.join(self.state_dir('done'), lease.batch))
+        except FileNotFoundError:
+            # The batch is processed again by whichever node claims it
+            lease.lost = True
+            return False
+        if failed_items:
+            write_worklist(failed_items, os.path.join(self.state_dir('failed'), lease.batch))
+        return True
+
+    def reclaim_expired(self):
+        """
+        Move batches whose lease has not been renewed within lease_seconds back to
+        pending/. Returns the number of batches reclaimed.
+        """
+        reclaimed = 0
+        now = time.time()
+        with os.scandir(self.state_dir('leased')) as entries:
+            for entry in entries:
+                try:
+                    age = now - entry.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                if age < self.lease_seconds:
+                    continue
+                batch, _, node = entry.name.rpartition(LEASE_SEPARATOR)
+                try:
+                    os.rename(entry.path, os.path.join(self.state_dir('pending'), batch))
+                except FileNotFoundError:
+                    continue
+                logger.info(f"Reclaimed batch {batch} abandoned by {node} ({age:.0f} s since last heartbeat)")
+                reclaimed += 1
+        return reclaimed
+
+    def status(self):
+        """
+        Count batches in each state, and the leased batches per node.
+        """
+        counts = {state: len(os.listdir(self.state_dir(state))) for state in QUEUE_STATES}
+        nodes = {}
+        for name in os.listdir(self.state_dir('leased')):
+            node = name.rpartition(LEASE_SEPARATOR)[2]
+            nodes[node] = nodes.get(node, 0) + 1
+        counts['nodes'] = nodes
+        return counts
+
+
+def _heartbeat_loop(lease, interval, stop):
+    while not stop.wait(interval):
+        if not lease.heartbeat():
+            logger.warning(f"Warning: lease on batch {lease.batch} was reclaimed by another node")
+            return
+
+
+def work(queue, process_item, heartbeat_interval=None, wait_for_work=False, poll_interval=30):
+    """
+    Claim batches from the queue and call process_item on each item until the
+    queue is empty. A background thread renews the lease while a batch is being
+    processed. process_item raises an exception for a failed item.
+    Returns the number of items processed and the number of items failed.
+    """
+    heartbeat_interval = heartbeat_interval or queue.lease_seconds / 4
+    processed = 0
+    failed = 0
+    while True:
+        lease = queue.claim()
+        if lease is None:
+            if wait_for_work and queue.status()['leased']:
+                # Other nodes may still abandon their batches
+                time.sleep(poll_interval)
+                continue
+            break
+
+        logger.info(f"Claimed batch {lease.batch} as {queue.node}")
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat_loop, args=(lease, heartbeat_interval, stop), daemon=True)
+        heartbeat.start()
+        failed_items = []
+        try:
+            for item in lease.items():
+                if lease.lost:
+                    # The batch is back in pending/ and will be redone by another node
+                    break
+                try:
+                    process_item(item)
+                except Exception as e:
+                    logger.error(f"Error: Failed to generate MMD for {item['filename']}. Reason: {e}")
+                    failed_items.append(dict(item, error=str(e)))
+                    failed += 1
+                processed += 1
+        finally:
+            stop.set()
+            heartbeat.join()
+        if not lease.lost:
+            queue.release(lease, failed_items)
+    return processed, failed
@@ -0,0 +1,312 @@
+import json
+import multiprocessing
+import queue
+import resource
+import threading
+import time
+from mmd_utils.filename_parser import parse_product_name
+
+# How often the RSS of a busy worker is checked against the task limit
+POLL_SECONDS = 0.1
+_END = object()
+
+
+def read_rss(pid='self'):
+    """
+    Return the current and peak RSS (VmRSS, VmHWM) of a process in MB, from
+    /proc. Missing values are None where /proc is not available.
+    """
+    values = {}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    key, value = line.split(':', 1)
+                    values[key] = int(value.split()[0]) / 1024
+    except (OSError, ValueError):
+        pass
+    return values.get('VmRSS'), values.get('VmHWM')
+
+
+def reset_peak_rss():
+    """
+    Reset the peak RSS of this process to its current RSS, so the peak of the
+    next task can be read (Linux 4.0+). Returns False if it could not be reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _task_peak_rss(peak_was_reset):
+    _, peak = read_rss()
+    if peak_was_reset and peak is not None:
+        return peak
+    # Peak of the whole life of the worker, in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _worker_main(conn, function, initializer, initargs):
+    if initializer is not None:
+        initializer(*initargs)
+    # Ready: task timeouts do not include the start of the worker
+    conn.send(None)
+    while True:
+        try:
+            item = conn.recv()
+        except EOFError:
+            break
+        if item is None:
+            break
+        peak_was_reset = reset_peak_rss()
+        try:
+            status, value = 'ok', function(item)
+        except Exception as e:
+            status, value = 'error', str(e)
+        rss, _ = read_rss()
+        conn.send((status, value, _task_peak_rss(peak_was_reset), rss))
+    conn.close()
+
+
+class TaskKilled(RuntimeError):
+    """
+    A task whose worker was killed by a guard (timeout or memory limit), or
+    died, with the RSS of the worker at the time if known.
+    """
+
+    def __init__(self, message, rss_mb=None):
+        super().__init__(message)
+        self.rss_mb = rss_mb
+
+
+class RecycledWorker:
+    """
+    A worker process that applies function to one item at a time, started on
+    first use and replaced after max_tasks items or once its RSS is above
+    max_rss_mb after an item (either may be None), so lxml trees, geometries
+    and HDF5 handles that outlive a product are released with the process. While a task runs, the
+    worker is killed if it takes longer than task_timeout seconds or its RSS
+    goes above task_rss_mb, and the next task starts a new one.
+
+    Workers are spawned rather than forked, so they start from a small, clean
+    heap instead of a copy of the parent. function, initializer and the items
+    must be picklable; the function's return value is sent back to the parent.
+    """
+
+    def __init__(self, function, initializer=None, initargs=(), max_tasks=500, max_rss_mb=None, task_rss_mb=None,
+                 task_timeout=None):
+        self.function = function
+        self.initializer = initializer
+        self.initargs = initargs
+        self.max_tasks = max_tasks
+        self.max_rss_mb = max_rss_mb
+        self.task_rss_mb = task_rss_mb
+        self.task_timeout = task_timeout
+        self.process = None
+        self.conn = None
+        self.tasks = 0
+        self.started = 0
+
+    def _start(self):
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, self.function, self.initializer, self.initargs), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        try:
+            self.conn.recv()
+        except EOFError:
+            self.process.join()
+            exitcode = self.process.exitcode
+            self.conn.close()
+            self.process = None
+            raise TaskKilled(f"Worker failed to start, exit code {exitcode}") from None
+        self.tasks = 0
+        self.started += 1
+
+    def _kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self.process = None
+
+    def stop(self):
+        """
+        Let the worker finish and exit. The next task starts a new one.
+        """
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(10)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+        self.process = None
+
+    def _wait(self):
+        # Wait for the result of the task in flight, enforcing the guards
+        started = time.monotonic()
+        while not self.conn.poll(POLL_SECONDS):
+            if self.task_timeout and time.monotonic() - started > self.task_timeout:
+                rss, _ = read_rss(self.process.pid)
+                self._kill()
+                raise TaskKilled(f"Worker killed after {self.task_timeout} s", rss)
+            if self.task_rss_mb:
+                rss, _ = read_rss(self.process.pid)
+                if rss is not None and rss > self.task_rss_mb:
+                    self._kill()
+                    raise TaskKilled(f"Worker killed at {rss:.0f} MB RSS, over the limit of {self.task_rss_mb} MB", rss)
+        try:
+            return self.conn.recv()
+        except EOFError:
+            self.process.join()
+            exitcode = self.process.exitcode
+            self.conn.close()
+            self.process = None
+            raise TaskKilled(f"Worker died with exit code {exitcode}") from None
+
+    def run(self, item):
+        """
+        Apply the function to item in the worker process. Returns the result
+        and the peak RSS of the worker during the task in MB. Raises
+        RuntimeError if the function failed and TaskKilled if the worker was
+        killed or died.
+        """
+        if self.process is None:
+            self._start()
+        self.conn.send(item)
+        status, value, peak_rss_mb, rss_mb = self._wait()
+        self.tasks += 1
+        worn_out = self.max_tasks and self.tasks >= self.max_tasks
+        grown = self.max_rss_mb and rss_mb is not None and rss_mb > self.max_rss_mb
+        if worn_out or grown:
+            self.stop()
+        if status == 'error':
+            raise RuntimeError(value)
+        return value, peak_rss_mb
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def _serve(in_queue, out_queue, worker):
+    with worker:
+        while True:
+            item = in_queue.get()
+            if item is _END:
+                break
+            try:
+                result, peak_rss_mb = worker.run(item)
+                out_queue.put(dict(result, peak_rss_mb=peak_rss_mb))
+            except TaskKilled as e:
+                out_queue.put(dict(item, error=str(e), peak_rss_mb=e.rss_mb, killed=True))
+            except Exception as e:
+                out_queue.put(dict(item, error=str(e)))
+    out_queue.put(_END)
+
+
+def run_recycled(items, function, workers=1, initializer=None, initargs=(), queue_size=64, **worker_options):
+    """
+    Apply function to work items (dictionaries) in recycled worker processes,
+    see RecycledWorker for the options, and yield the resulting items as they
+    finish, not necessarily in input order. The peak RSS of the task is set in
+    'peak_rss_mb'; a failed item is yielded with its 'error'. An exception
+    raised by the items iterator is raised once the items before it are done.
+    """
+    in_queue = queue.Queue(queue_size)
+    out_queue = queue.Queue(queue_size)
+    feed_errors = []
+
+    def feed():
+        try:
+            for item in items:
+                in_queue.put(item)
+        except Exception as e:
+            feed_errors.append(e)
+        finally:
+            # Always let the workers finish, or the run would wait forever
+            for _ in range(workers):
+                in_queue.put(_END)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for _ in range(workers):
+        worker = RecycledWorker(function, initializer, initargs, **worker_options)
+        threads.append(threading.Thread(target=_serve, args=(in_queue, out_queue, worker), daemon=True))
+    for thread in threads:
+        thread.start()
+    finished = 0
+    while finished < workers:
+        item = out_queue.get()
+        if item is _END:
+            finished += 1
+            continue
+        yield item
+    for thread in threads:
+        thread.join()
+    if feed_errors:
+        raise feed_errors[0]
+
+
+class MemoryReport:
+    """
+    High-water marks of worker RSS per product type, to size the memory limits
+    and the number of workers per node.
+    """
+
+    def __init__(self):
+        self.types = {}
+
+    def record(self, item):
+        killed = item.get('killed')
+        if item.get('peak_rss_mb') is None and not killed:
+            return
+        product = parse_product_name(item['filename'])
+        product_type = product.product_type if product else 'unknown'
+        stats = self.types.setdefault(
+            product_type, {'products': 0, 'killed': 0, 'measured': 0, 'peak_rss_mb': 0.0, 'total_rss_mb': 0.0}
+        )
+        stats['products'] += 1
+        if killed:
+            stats['killed'] += 1
+        # A worker killed on a timeout may be gone before its RSS is read
+        if item.get('peak_rss_mb') is None:
+            return
+        stats['measured'] += 1
+        stats['total_rss_mb'] += item['peak_rss_mb']
+        stats['peak_rss_mb'] = max(stats['peak_rss_mb'], item['peak_rss_mb'])
+
+    def summary(self):
+        return {
+            product_type: {
+                'products': stats['products'],
+                'killed': stats['killed'],
+                'peak_rss_mb': round(stats['peak_rss_mb'], 1) if stats['measured'] else None,
+                'mean_peak_rss_mb': round(stats['total_rss_mb'] / stats['measured'], 1) if stats['measured'] else None,
+            }
+            for product_type, stats in sorted(self.types.items())
+        }
+
+    def lines(self):
+        return [
+            f"  {product_type}: {stats['products']} products, "
+            + (f"peak RSS {stats['peak_rss_mb']} MB (mean {stats['mean_peak_rss_mb']} MB)"
+               if stats['peak_rss_mb'] is not None else "peak RSS unknown")
+            + f", {stats['killed']} killed"
+            for product_type, stats in self.summary().items()
+        ]
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
@@ -0,0 +1,348 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, urlencode
+from shapely import wkt
+from mmd_utils.json_stream import iter_json_records
+from mmd_utils.mmd_utils import extract_polygon
+
+PRODUCTS_PATH = '/odata/v1/Products'
+DEFAULT_TOP = 20
+MAX_TOP = 1000
+
+# Collection of each mission, for records without a Collection
+COLLECTIONS = {'S1': 'SENTINEL-1', 'S2': 'SENTINEL-2', 'S3': 'SENTINEL-3', 'S5': 'SENTINEL-5P'}
+
+
+def _collection_name(record):
+    if record.get('Collection'):
+        return record['Collection'].get('Name')
+    return COLLECTIONS.get(record.get('Name', '')[:2])
+
+
+FILTER_FIELDS = {
+    'Name': lambda record: record.get('Name'),
+    'Collection/Name': _collection_name,
+    'Id': lambda record: record.get('Id'),
+    'ContentDate/Start': lambda record: (record.get('ContentDate') or {}).get('Start'),
+    'ContentDate/End': lambda record: (record.get('ContentDate') or {}).get('End'),
+    'ModificationDate': lambda record: record.get('ModificationDate'),
+    'PublicationDate': lambda record: record.get('PublicationDate'),
+}
+
+COMPARISONS = {
+    'eq': lambda a, b: a == b,
+    'ne': lambda a, b: a != b,
+    'gt': lambda a, b: a is not None and a > b,
+    'ge': lambda a, b: a is not None and a >= b,
+    'lt': lambda a, b: a is not None and a < b,
+    'le': lambda a, b: a is not None and a <= b,
+}
+
+COMPARISON_PATTERN = re.compile(r"^([\w/]+) (eq|ne|gt|ge|lt|le) (?:'([^']*)'|(\S+))$")
+FUNCTION_PATTERN = re.compile(r"^(contains|startswith|endswith)\(([\w/]+),\s*'([^']*)'\)$")
+INTERSECTS_PATTERN = re.compile(r"^OData\.CSC\.Intersects\(area=geography'SRID=4326;(.+)'\)$", re.IGNORECASE)
+
+
+@lru_cache(maxsize=100000)
+def _footprint(footprint):
+    return extract_polygon(footprint)
+
+
+def _intersects(record, area):
+    if not record.get('Footprint'):
+        return False
+    return _footprint(record['Footprint']).intersects(area)
+
+
+def _normalise_time(value):
+    # Compare timestamps as text: drop the trailing Z and pad fractional seconds
+    if value and len(value) >= 19 and value[4] == '-' and value[10] == 'T':
+        value = value.rstrip('Z')
+        if '.' not in value:
+            value += '.'
+        head, _, fraction = value.partition('.')
+        return f'{head}.{fraction:0<6}'
+    return value
+
+
+def parse_filter(expression):
+    """
+    Parse the subset of OData $filter used against the CDSE catalogue: comparisons
+    on Name, Id, Collection/Name and dates, contains/startswith/endswith on Name and
+    OData.CSC.Intersects on the footprint, joined with 'and'.
+    Returns a predicate on records.
+    """
+    predicates = []
+    for clause in re.split(r'\s+and\s+', expression.strip()):
+        clause = clause.strip()
+        while clause.startswith('(') and clause.endswith(')'):
+            clause = clause[1:-1].strip()
+        match = COMPARISON_PATTERN.match(clause)
+        if match:
+            field, operator, quoted, bare = match.groups()
+            if field not in FILTER_FIELDS:
+                raise ValueError(f'Unsupported filter field: {field}')
+            value = _normalise_time(quoted if quoted is not None else bare)
+            getter = FILTER_FIELDS[field]
+            compare = COMPARISONS[operator]
+            predicates.append(lambda record, g=getter, c=compare, v=value: c(_normalise_time(g(record)), v))
+            continue
+        match = FUNCTION_PATTERN.match(clause)
+        if match:
+            function, field, value = match.groups()
+            if field not in FILTER_FIELDS:
+                raise ValueError(f'Unsupported filter field: {field}')
+            getter = FILTER_FIELDS[field]
+            method = {'contains': str.__contains__, 'startswith': str.startswith, 'endswith': str.endswith}[function]
+            predicates.append(lambda record, g=getter, m=method, v=value: g(record) is not None and m(g(record), v))
+            continue
+        match = INTERSECTS_PATTERN.match(clause)
+        if match:
+            area = wkt.loads(match.group(1))
+            predicates.append(lambda record, a=area: _intersects(record, a))
+            continue
+        raise ValueError(f'Unsupported filter clause: {clause}')
+    return lambda record: all(predicate(record) for predicate in predicates)
+
+
+class FaultConfig:
+    """
+    Faults injected into responses. Rates are probabilities per request.
+    latency: mean added latency in seconds, with latency_jitter as the spread
+    rate_429: share of requests answered with 429 Too Many Requests (with Retry-After)
+    rate_5xx: share of requests answered with 500 or 503
+    timeout_rate: share of requests held for hang_seconds before answering,
+        longer than the client timeout
+    """
+
+    def __init__(self, latency=0.0, latency_jitter=0.0, rate_429=0.0, rate_5xx=0.0,
+                 timeout_rate=0.0, hang_seconds=30.0, retry_after=1, seed=None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def draw(self):
+        """
+        Decide the fault for one request: (delay in seconds, status code or None).
+        """
+        with self.lock:
+            delay = max(0.0, self.latency + self.random.uniform(-self.latency_jitter, self.latency_jitter))
+            roll = self.random.random()
+            status_roll = self.random.random()
+        if roll < self.timeout_rate:
+            return self.hang_seconds, None
+        roll -= self.timeout_rate
+        if roll < self.rate_429:
+            return delay, 429
+        roll -= self.rate_429
+        if roll < self.rate_5xx:
+            return delay, 503 if status_roll < 0.5 else 500
+        return delay, None
+
+
+class MockODataServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the CDSE OData Products endpoint, serving fixture records.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, records, faults=None, verbose=False):
+        super().__init__(address, MockODataHandler)
+        self.records = sorted(records, key=lambda record: record.get('Name', ''))
+        self.by_name = {record['Name']: record for record in self.records if 'Name' in record}
+        self.faults = faults or FaultConfig()
+        self.verbose = verbose
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}{PRODUCTS_PATH}'
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def query(self, params):
+        """
+        Answer a Products query. Returns the response body as a dictionary.
+        """
+        expression = params.get('$filter')
+        top = min(int(params.get('$top', DEFAULT_TOP)), MAX_TOP)
+        skip = int(params.get('$skip', 0))
+        expand = params.get('$expand', '')
+
+        name_match = re.fullmatch(r"\s*Name eq '([^']*)'\s*", expression or '')
+        if name_match:
+            # Lookups by name are the common case, answer them from the index
+            record = self.by_name.get(name_match.group(1))
+            matches = [record] if record else []
+        elif expression:
+            predicate = parse_filter(expression)
+            matches = [record for record in self.records if predicate(record)]
+        else:
+            matches = self.records
+
+        order = params.get('$orderby')
+        if order:
+            field, _, direction = order.partition(' ')
+            if field not in FILTER_FIELDS:
+                raise ValueError(f'Unsupported orderby field: {field}')
+            getter = FILTER_FIELDS[field]
+            matches = sorted(matches, key=lambda record: _normalise_time(getter(record)) or '',
+                             reverse=direction.strip().lower() == 'desc')
+
+        page = matches[skip:skip + top]
+        if 'Attributes' not in expand:
+            page = [{k: v for k, v in record.items() if k != 'Attributes'} for record in page]
+
+        body = {'@odata.context': '$metadata#Products', 'value': page}
+        if params.get('$count') == 'true':
+            body['@odata.count'] = len(matches)
+        if skip + top < len(matches):
+            next_params = dict(params, **{'$skip': str(skip + top), '$top': str(top)})
+            body['@odata.nextLink'] = f'{self.url}?{urlencode(next_params)}'
+        return body
+
+
+class MockODataHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up, e.g. after its timeout
+            self.server.count('client_disconnected')
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path == '/stats':
+            with self.server.stats_lock:
+                self._send_json(200, dict(self.server.stats))
+            return
+        if parts.path != PRODUCTS_PATH:
+            self.server.count('404')
+            self._send_json(404, {'detail': f'Unknown path {parts.path}'})
+            return
+
+        self.server.count('requests')
+        delay, status = self.server.faults.draw()
+        if delay:
+            time.sleep(delay)
+        if delay >= self.server.faults.hang_seconds and status is None and self.server.faults.timeout_rate:
+            self.server.count('timeouts')
+        if status == 429:
+            self.server.count('429')
+            self._send_json(429, {'detail': 'Too Many Requests'}, {'Retry-After': str(self.server.faults.retry_after)})
+            return
+        if status is not None:
+            self.server.count(str(status))
+            self._send_json(status, {'detail': 'Injected server error'})
+            return
+
+        params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        try:
+            body = self.server.query(params)
+        except ValueError as e:
+            self.server.count('400')
+            self._send_json(400, {'detail': str(e)})
+            return
+        self.server.count('200')
+        self._send_json(200, body)
+
+
+def load_fixtures(paths):
+    records = []
+    for path in paths:
+        records.extend(iter_json_records(path))
+    return records
+
+
+def start_server(records, host='127.0.0.1', port=0, faults=None, verbose=False):
+    """
+    Start the mock server on a background thread. Port 0 picks a free port;
+    the URL of the Products endpoint is server.url.
+    """
+    server = MockODataServer((host, port), records, faults, verbose)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def add_fault_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean added latency per request in seconds.")
+    parser.add_argument("--latency_jitter", type=float, default=0.0, help="Spread of the added latency in seconds.")
+    parser.add_argument("--rate_429", type=float, default=0.0, help="Share of requests answered with 429.")
+    parser.add_argument("--rate_5xx", type=float, default=0.0, help="Share of requests answered with 500 or 503.")
+    parser.add_argument("--timeout_rate", type=float, default=0.0, help="Share of requests held for --hang_seconds.")
+    parser.add_argument("--hang_seconds", type=float, default=30.0, help="How long timed out requests are held.")
+    parser.add_argument("--retry_after", type=int, default=1, help="Retry-After header of 429 responses, in seconds.")
+    parser.add_argument("--seed", type=int, required=False, help="Seed for the injected faults.")
+
+
+def faults_from_args(args):
+    return FaultConfig(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        timeout_rate=args.timeout_rate,
+        hang_seconds=args.hang_seconds,
+        retry_after=args.retry_after,
+        seed=args.seed
+    )
+
+
+def main():
+    """
+    Serve fixture OData records on a local Products endpoint, with injected faults.
+    """
+    parser = argparse.ArgumentParser(description="Local mock of the CDSE OData Products endpoint for testing.")
+    parser.add_argument(
+        "fixtures", nargs="+",
+        help="JSON/JSONL files with expanded OData product records."
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on.")
+    parser.add_argument("--verbose", action="store_true", help="Log every request.")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    records = load_fixtures(args.fixtures)
+    server = MockODataServer((args.host, args.port), records, faults_from_args(args), args.verbose)
+    print(f"Serving {len(records)} products at {server.url} (statistics at /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import logging
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+from mmd_utils.odata_mirror import get_fallback_metadata
+from mock_odata_server import load_fixtures, start_server, add_fault_arguments, faults_from_args
+
+
+def synthesize_records(templates, count):
+    """
+    Make count distinct product records from the fixture records by replacing
+    the product unique identifier (the last part of the name) and the Id.
+    """
+    records = []
+    for i in range(count):
+        record = dict(templates[i % len(templates)])
+        stem, dot, suffix = record['Name'].partition('.')
+        parts = stem.split('_')
+        parts[-1] = f'{i:04X}'[-4:] if len(parts[-1]) == 4 else f'{parts[-1]}{i}'
+        record['Name'] = '_'.join(parts) + dot + suffix
+        record['Id'] = str(uuid.uuid4())
+        records.append(record)
+    return records
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def fetch_one(basename, odata_url, query_options):
+    """
+    Run the OData fallback for one product. Returns (basename, found, seconds).
+    """
+    start = time.perf_counter()
+    metadata, id = get_fallback_metadata({}, None, basename, None, odata_url=odata_url, **query_options)
+    return basename, bool(metadata), time.perf_counter() - start
+
+
+def run_load_test(basenames, odata_url, workers, query_options):
+    """
+    Query OData for every basename on a pool of threads, the way batch runs use
+    the fallback. Returns the per-product results and the wall-clock time.
+    """
+    start = time.perf_counter()
+    # The fallback logs every attempt; keep the report readable
+    logging.disable(logging.CRITICAL)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda basename: fetch_one(basename, odata_url, query_options), basenames))
+    finally:
+        logging.disable(logging.NOTSET)
+    return results, time.perf_counter() - start
+
+
+def print_report(results, elapsed, workers):
+    latencies = [seconds for _, _, seconds in results]
+    found = sum(1 for _, ok, _ in results if ok)
+    print(f"Products:   {len(results)} with {workers} workers in {elapsed:.2f} s")
+    print(f"Throughput: {len(results) / elapsed:.1f} products/s")
+    print(f"Success:    {found}/{len(results)} ({100 * found / max(len(results), 1):.1f}%)")
+    print("Latency:    p50 {:.3f} s, p90 {:.3f} s, p99 {:.3f} s, max {:.3f} s".format(
+        _percentile(latencies, 0.5), _percentile(latencies, 0.9), _percentile(latencies, 0.99), max(latencies, default=0)
+    ))
+
+
+def main():
+    """
+    Measure throughput of the OData fallback against the mock server (started
+    in this process) or against another endpoint given with --url.
+    """
+    parser = argparse.ArgumentParser(description="Load test of the OData metadata fallback.")
+    parser.add_argument(
+        "fixtures", nargs="+",
+        help="JSON/JSONL files with expanded OData product records."
+    )
+    parser.add_argument(
+        "--url", type=str, required=False,
+        help="Products endpoint to test instead of starting the mock server."
+    )
+    parser.add_argument(
+        "-n", "--products", type=int, required=False,
+        help="Number of distinct products to synthesize from the fixtures (default: query the fixtures as they are)."
+    )
+    parser.add_argument("--workers", type=int, default=16, help="Number of concurrent queries.")
+    parser.add_argument("--max_retries", type=int, default=5, help="Attempts per query.")
+    parser.add_argument("--base_delay", type=float, default=0.1, help="Base delay of the backoff in seconds.")
+    parser.add_argument("--timeout", type=float, default=2.0, help="Timeout of each request in seconds.")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    records = load_fixtures(args.fixtures)
+    if args.products:
+        records = synthesize_records(records, args.products)
+    basenames = [record['Name'].split('.')[0] for record in records]
+
+    server = None
+    odata_url = args.url
+    if not odata_url:
+        server = start_server(records, faults=faults_from_args(args))
+        odata_url = server.url
+        print(f"Mock server with {len(records)} products at {odata_url}")
+
+    query_options = {'max_retries': args.max_retries, 'base_delay': args.base_delay, 'timeout': args.timeout}
+    results, elapsed = run_load_test(basenames, odata_url, args.workers, query_options)
+    print_report(results, elapsed, args.workers)
+
+    if server:
+        stats_url = odata_url.split('/odata/')[0] + '/stats'
+        with urlopen(stats_url) as response:
+            print(f"Server:     {json.load(response)}")
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import os
+import tempfile
+import unittest
+from lxml import etree as ET
+from mmd_utils.config_handling import save_xml_to_file
+from mmd_utils.mmd_update import (
+    carry_update_history,
+    is_provisional,
+    load_mmd,
+    mark_provisional,
+    mmd_changed,
+)
+from mmd_utils.parent_aggregates import ParentAggregates
+from mmd_utils.xml_creation import prepend_mmd
+
+S1_FILE = 'S1A_IW_GRDH_1SDV_20240301T070156_20240301T070226_052895_0372C9_DAA1.zip'
+
+
+def _element(parent, tag, text=None, **attributes):
+    element = ET.SubElement(parent, prepend_mmd(tag), **attributes)
+    element.text = text
+    return element
+
+
+def make_mmd(title='S1A product', updated='2024-03-01T12:00:00Z', north='78.9', parent_id='no.met:parent-a',
+             filename=S1_FILE, size='1024.00', start='2024-03-01T07:01:56Z', end='2024-03-01T07:02:26Z'):
+    """
+    A small MMD element tree with the elements the update and parent logic read.
+    """
+    root = ET.Element(prepend_mmd('mmd'), nsmap={'mmd': 'http://www.met.no/schema/mmd'})
+    _element(root, 'metadata_identifier', 'no.met.nbs:1')
+    _element(root, 'title', title)
+    history = _element(root, 'last_metadata_update')
+    update = _element(history, 'update')
+    _element(update, 'datetime', updated)
+    _element(update, 'type', 'Created')
+    _element(update, 'note', 'Created automatically')
+    temporal_extent = _element(root, 'temporal_extent')
+    _element(temporal_extent, 'start_date', start)
+    _element(temporal_extent, 'end_date', end)
+    rectangle = _element(_element(root, 'geographic_extent'), 'rectangle', srsName='EPSG:4326')
+    for name, value in (('north', north), ('south', '76.5'), ('east', '17.1'), ('west', '10.5')):
+        _element(rectangle, name, value)
+    _element(root, 'related_dataset', parent_id, relation_type='parent')
+    storage_information = _element(root, 'storage_information')
+    _element(storage_information, 'file_name', filename)
+    _element(storage_information, 'file_size', size, unit='MB')
+    return root
+
+
+def update_types(root):
+    return [element.text for element in root.iter(prepend_mmd('type'))]
+
+
+class MMDChangedTest(unittest.TestCase):
+
+    def test_same_content(self):
+        self.assertFalse(mmd_changed(make_mmd(), make_mmd()))
+
+    def test_timestamp_only(self):
+        self.assertFalse(mmd_changed(make_mmd(updated='2024-03-01T12:00:00Z'), make_mmd(updated='2025-01-01T00:00:00Z')))
+
+    def test_formatting_only(self):
+        pretty = ET.fromstring(ET.tostring(make_mmd(), pretty_print=True))
+        self.assertFalse(mmd_changed(pretty, make_mmd()))
+
+    def test_content_changed(self):
+        self.assertTrue(mmd_changed(make_mmd(), make_mmd(north='79.0')))
+
+    def test_provisional_to_final(self):
+        provisional = mark_provisional(make_mmd())
+        self.assertTrue(is_provisional(provisional))
+        self.assertTrue(mmd_changed(provisional, make_mmd()))
+        self.assertTrue(mmd_changed(make_mmd(), mark_provisional(make_mmd())))
+
+
+class CarryUpdateHistoryTest(unittest.TestCase):
+
+    def test_history_kept_and_extended(self):
+        existing = make_mmd(updated='2024-03-01T12:00:00Z')
+        new = carry_update_history(existing, make_mmd(north='79.0', updated='2025-01-01T00:00:00Z'))
+        self.assertEqual(update_types(new), ['Created', 'Minor modification'])
+        self.assertEqual(new.findtext(f"{prepend_mmd('last_metadata_update')}/{prepend_mmd('update')}/"
+                                      f"{prepend_mmd('datetime')}"), '2024-03-01T12:00:00Z')
+
+    def test_provisional_to_final_drops_the_mark(self):
+        new = carry_update_history(mark_provisional(make_mmd()), make_mmd(), note='Completed from OData')
+        self.assertEqual(update_types(new), ['Created', 'Minor modification'])
+        self.assertFalse(is_provisional(new))
+
+    def test_provisional_mark_of_new_tree_kept(self):
+        new = carry_update_history(make_mmd(), mark_provisional(make_mmd()))
+        self.assertTrue(is_provisional(new))
+
+
+class SaveUpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'product.xml')
+
+    def test_unchanged_content_skipped(self):
+        self.assertTrue(save_xml_to_file(make_mmd(), self.path, update=True))
+        with open(self.path, 'rb') as f:
+            written = f.read()
+        self.assertFalse(save_xml_to_file(make_mmd(updated='2025-01-01T00:00:00Z'), self.path, update=True))
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), written)
+
+    def test_provisional_rewritten_with_history(self):
+        save_xml_to_file(mark_provisional(make_mmd()), self.path)
+        self.assertTrue(save_xml_to_file(make_mmd(updated='2025-01-01T00:00:00Z'), self.path, update=True))
+        written = load_mmd(self.path)
+        self.assertFalse(is_provisional(written))
+        self.assertEqual(update_types(written), ['Created', 'Minor modification'])
+        # Final now, so the same content is not written again
+        self.assertFalse(save_xml_to_file(make_mmd(), self.path, update=True))
+
+
+class ParentAggregatesTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.aggregates = ParentAggregates(os.path.join(directory.name, 'parents.db'))
+        self.addCleanup(self.aggregates.close)
+
+    def parents(self):
+        return {parent['parent_id']: parent for parent in self.aggregates.parents()}
+
+    def test_children_counted(self):
+        self.aggregates.add(make_mmd())
+        self.aggregates.add(make_mmd(filename=S1_FILE.replace('DAA1', 'DAA2'), size='512.00', north='80.0'))
+        parent = self.parents()['no.met:parent-a']
+        self.assertEqual((parent['child_count'], parent['total_size_mb']), (2, 1536.0))
+        self.assertEqual(parent['north'], 80.0)
+
+    def test_child_added_again_counted_once(self):
+        self.aggregates.add(make_mmd())
+        self.aggregates.add(make_mmd(size='2048.00'))
+        parent = self.parents()['no.met:parent-a']
+        self.assertEqual((parent['child_count'], parent['total_size_mb']), (1, 2048.0))
+
+    def test_child_moved_between_parents(self):
+        self.aggregates.add(make_mmd())
+        self.aggregates.add(make_mmd(parent_id='no.met:parent-b'))
+        parents = self.parents()
+        self.assertEqual((parents['no.met:parent-a']['child_count'], parents['no.met:parent-a']['total_size_mb']),
+                         (0, 0.0))
+        self.assertEqual((parents['no.met:parent-b']['child_count'], parents['no.met:parent-b']['total_size_mb']),
+                         (1, 1024.0))
+
+        # Moving back counts it once in the first parent again
+        self.aggregates.add(make_mmd())
+        parents = self.parents()
+        self.assertEqual(parents['no.met:parent-a']['child_count'], 1)
+        self.assertEqual(parents['no.met:parent-b']['child_count'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
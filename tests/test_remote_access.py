@@ -0,0 +1,154 @@
+import io
+import os
+import tempfile
+import threading
+import unittest
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from mmd_utils.remote_access import HTTPRangeFile
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serves files of a directory with support for single byte ranges, which
+    SimpleHTTPRequestHandler lacks. With head_length False, HEAD responses do
+    not report a Content-Length.
+    """
+
+    head_length = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        if self.head_length:
+            return super().do_HEAD()
+        self.send_response(200)
+        self.end_headers()
+
+    def do_GET(self):
+        requested = self.headers.get('Range')
+        if requested is None:
+            return super().do_GET()
+        with open(self.translate_path(self.path), 'rb') as f:
+            data = f.read()
+        start, end = requested.removeprefix('bytes=').split('-')
+        start, end = int(start), min(int(end), len(data) - 1)
+        self.send_response(206)
+        self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(data[start:end + 1])
+
+
+class NoHeadLengthHandler(RangeRequestHandler):
+    head_length = False
+
+
+class HTTPRangeFileTest(unittest.TestCase):
+
+    handler = RangeRequestHandler
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.data = os.urandom(10 * 1000 + 123)
+        with open(os.path.join(directory.name, 'product.zip'), 'wb') as f:
+            f.write(self.data)
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), partial(self.handler, directory=directory.name))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.url = f'http://127.0.0.1:{server.server_address[1]}/product.zip'
+
+    def open(self, **options):
+        remote = HTTPRangeFile(self.url, **options)
+        self.addCleanup(remote.close)
+        return remote
+
+    def test_size(self):
+        self.assertEqual(self.open().size, len(self.data))
+
+    def test_read_all(self):
+        remote = self.open(block_size=1024)
+        self.assertEqual(remote.read(), self.data)
+        self.assertEqual(remote.read(), b'')
+        # Missing blocks are fetched in a single request
+        self.assertEqual(remote.requests_made, 1)
+
+    def test_seek_and_read(self):
+        remote = self.open(block_size=1000)
+        local = io.BytesIO(self.data)
+        for offset, whence, size in [
+            (0, io.SEEK_SET, 10),
+            (995, io.SEEK_SET, 10),
+            (500, io.SEEK_CUR, 2500),
+            (-22, io.SEEK_END, 100),
+            (len(self.data) + 5, io.SEEK_SET, 10),
+        ]:
+            self.assertEqual(remote.seek(offset, whence), local.seek(offset, whence))
+            self.assertEqual(remote.read(size), local.read(size))
+            self.assertEqual(remote.tell(), local.tell())
+        with self.assertRaises(ValueError):
+            remote.seek(-1)
+
+    def test_block_cache(self):
+        remote = self.open(block_size=1000, cache_blocks=2)
+        remote.seek(1500)
+        self.assertEqual(remote.read(1000), self.data[1500:2500])
+        self.assertEqual((remote.requests_made, remote.bytes_fetched), (1, 2000))
+
+        # Both blocks are cached
+        remote.seek(1000)
+        self.assertEqual(remote.read(2000), self.data[1000:3000])
+        self.assertEqual(remote.requests_made, 1)
+
+        # The least recently used block is evicted
+        remote.seek(5000)
+        self.assertEqual(remote.read(10), self.data[5000:5010])
+        remote.seek(1000)
+        self.assertEqual(remote.read(10), self.data[1000:1010])
+        self.assertEqual((remote.requests_made, remote.bytes_fetched), (3, 4000))
+
+        # The last block is short
+        remote.seek(-5, io.SEEK_END)
+        self.assertEqual(remote.read(), self.data[-5:])
+        self.assertEqual(remote.bytes_fetched, 4123)
+
+    def test_read_larger_than_cache(self):
+        remote = self.open(block_size=1000, cache_blocks=2)
+        remote.seek(500)
+        self.assertEqual(remote.read(5000), self.data[500:5500])
+        # Reads mixing cached and fetched blocks
+        remote.seek(4200)
+        self.assertEqual(remote.read(), self.data[4200:])
+        remote.seek(0)
+        self.assertEqual(remote.read(), self.data)
+
+    def test_readinto(self):
+        remote = self.open(block_size=1024)
+        buffer = bytearray(16)
+        remote.seek(100)
+        self.assertEqual(remote.readinto(buffer), 16)
+        self.assertEqual(bytes(buffer), self.data[100:116])
+
+
+class HTTPRangeFileWithoutHeadLengthTest(HTTPRangeFileTest):
+    """
+    The same tests against a server that does not report a length on HEAD,
+    so the size is probed with a range request for the first byte.
+    """
+
+    handler = NoHeadLengthHandler
+
+    def test_size_probe(self):
+        remote = self.open()
+        self.assertEqual(remote.size, len(self.data))
+        # The probe is not counted as a block fetch
+        self.assertEqual(remote.requests_made, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()